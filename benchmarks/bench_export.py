@@ -0,0 +1,70 @@
+# Run from the repository root: python -m benchmarks.bench_export
+import io
+import json
+import time
+import random
+import argparse
+
+from chauffeur.elements import ElementStream, CHUNK_SIZE
+from chauffeur.export import export, ElementWriter, CSVWriter, GeoJSONLinesWriter, ArrowWriter, pa
+
+
+TAGS = ("amenity", "name", "highway", "building")
+
+
+def synthetic_payload(n, seed=0):
+    rng = random.Random(seed)
+    elements = list()
+    for i in range(n):
+        tags = {k: f'''{k}_{rng.randrange(50)}''' for k in TAGS if rng.random() < 0.5}
+        elements.append({"type": "node", "id": i + 1,
+                         "lat": rng.uniform(-90, 90), "lon": rng.uniform(-180, 180), "tags": tags})
+    return json.dumps({"version": 0.6, "elements": elements}).encode()
+
+
+def chunks(payload, size=CHUNK_SIZE):
+    for i in range(0, len(payload), size):
+        yield payload[i:i + size]
+
+
+def writers():
+    yield "csv", lambda: CSVWriter(io.StringIO(), tags=TAGS)
+    yield "geojsonl", lambda: GeoJSONLinesWriter(io.StringIO())
+    if pa is not None:
+        yield "arrow", lambda: ArrowWriter(io.BytesIO(), tags=TAGS)
+        yield "parquet", lambda: ArrowWriter(io.BytesIO(), tags=TAGS, format="parquet")
+
+
+class _NullWriter(ElementWriter):
+    def write_batch(self, elements):
+        self.count += len(elements)
+
+
+def run(payload, make_writer, batch_size, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        export(ElementStream(chunks(payload), payload_format="json"), make_writer(), batch_size=batch_size)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Streaming export throughput on a synthetic JSON payload")
+    parser.add_argument("--elements", type=int, default=200000)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    payload = synthetic_payload(args.elements)
+    mb = len(payload) / 1e6
+    print(f'''payload: {args.elements} nodes, {mb:.1f} MB''')
+    parse = run(payload, _NullWriter, args.batch_size, args.repeat)
+    print(f'''{"parse only":>10}: {mb / parse:8.1f} MB/s''')
+    for name, make_writer in writers():
+        elapsed = run(payload, make_writer, args.batch_size, args.repeat)
+        print(f'''{name:>10}: {mb / elapsed:8.1f} MB/s''')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+# Run from the repository root:
+#   python -m benchmarks.suite --save benchmarks/baseline.json
+#   python -m benchmarks.suite --compare benchmarks/baseline.json
+import gc
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import statistics
+
+from chauffeur.query import QueryBuilder, NodeQuery, WayQuery
+from chauffeur.filters import TagFilter, CompoundFilter, BboxFilter
+from chauffeur.grammar import UnionQuerySet
+from chauffeur.elements import ElementStream
+from chauffeur.parser import parse, canonicalize
+
+from benchmarks.bench_export import synthetic_payload, chunks
+
+
+BENCHMARKS = dict()
+MIN_TIME = 0.2 # Seconds each timed sample runs for, looping the body as often as needed
+DEFAULT_THRESHOLD = 1.25 # A benchmark this much slower than the baseline is a regression
+
+
+def benchmark(name):
+    # Registers a setup function returning the zero-argument body to time
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+@benchmark("register.raw_query_string")
+def bench_register(n=500):
+    qb = QueryBuilder(basic_optimize=False)
+    for i in range(n):
+        qb.qsx.append(NodeQuery(filters=TagFilter("amenity", f'''value_{i}''')), name=f'''s{i}''')
+    qb.qsx.append(NodeQuery(filters=TagFilter("amenity", "cafe")))
+    return lambda: qb.raw_query_string
+
+
+@benchmark("register.raw_query_string.optimized")
+def bench_register_optimized(n=500):
+    qb = QueryBuilder(optimize_queries=True, bbox=[50.0, 10.0, 54.0, 16.0])
+    for i in range(n):
+        qb.qsx.append(WayQuery(filters=[TagFilter("highway", f'''value_{i}'''), BboxFilter([51.0, 11.0, 52.0, 12.0])]))
+    return lambda: qb.raw_query_string
+
+
+@benchmark("tagfilter.values")
+def bench_tagfilter(n=10000):
+    values = [f'''value_{i}''' for i in range(n)]
+    # Long lists are split over several statements, so format through one
+    return lambda: repr(NodeQuery(filters=TagFilter("name", values)))
+
+
+@benchmark("compoundfilter.add_chain")
+def bench_compound_add(n=2000):
+    filters = [TagFilter(f'''key_{i}''') for i in range(n)]
+
+    def run():
+        cf = CompoundFilter()
+        for f in filters:
+            cf = cf + f
+        return cf
+    return run
+
+
+@benchmark("unionqueryset.repr")
+def bench_union(n=2000):
+    statements = [NodeQuery(filters=TagFilter("amenity", f'''value_{i}''')) for i in range(n)]
+    return lambda: repr(UnionQuerySet(list(statements)))
+
+
+@benchmark("parse.overpassql")
+def bench_parse_overpassql():
+    query = ('[out:json][timeout:25];(node["amenity"="cafe"](50.7,7.1,50.8,7.2);'
+             'way["amenity"="cafe"][name~"^(A|B)$"](50.7,7.1,50.8,7.2););out body;')
+    return lambda: parse(query)
+
+
+@benchmark("parse.canonicalize")
+def bench_canonicalize():
+    query = ('[out:json][timeout:25];(way[name~"^(B|A)$"][amenity="cafe"](50.7,7.1,50.8,7.2);'
+             'node["amenity"="cafe"](50.7,7.1,50.8,7.2););out body;')
+    # Uncached, as for a query seen for the first time
+    return lambda: canonicalize.__wrapped__(query)
+
+
+def synthetic_xml(n, seed=0):
+    rng = random.Random(seed)
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>', '<osm version="0.6" generator="Overpass API">']
+    for i in range(n):
+        lines.append(f'''<node id="{i + 1}" lat="{rng.uniform(-90, 90):.7f}" lon="{rng.uniform(-180, 180):.7f}">''')
+        lines.append(f'''  <tag k="amenity" v="amenity_{rng.randrange(50)}"/>''')
+        lines.append("</node>")
+    lines.append("</osm>")
+    return "\n".join(lines).encode()
+
+
+@benchmark("parse.json")
+def bench_parse_json(n=20000):
+    payload = synthetic_payload(n)
+    return lambda: sum(1 for _ in ElementStream(chunks(payload), payload_format="json"))
+
+
+@benchmark("parse.xml")
+def bench_parse_xml(n=20000):
+    payload = synthetic_xml(n)
+    return lambda: sum(1 for _ in ElementStream(chunks(payload), payload_format="xml"))
+
+
+def _time(body, loops):
+    start = time.perf_counter()
+    for _ in range(loops):
+        body()
+    return time.perf_counter() - start
+
+
+def measure(body, repeat=5, min_time=MIN_TIME):
+    # Seconds per call, as the median of repeat samples; each sample loops until min_time has passed
+    loops = 1
+    elapsed = _time(body, loops)
+    while elapsed < min_time:
+        loops = max(loops * 2, int(loops * min_time / max(elapsed, 1e-9)))
+        elapsed = _time(body, loops)
+    samples = [elapsed / loops]
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        samples.extend(_time(body, loops) / loops for _ in range(repeat - 1))
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return {"median": statistics.median(samples), "min": min(samples), "loops": loops, "repeat": repeat}
+
+
+def run(names, repeat=5, min_time=MIN_TIME, out=sys.stdout):
+    results = dict()
+    for name in names:
+        body = BENCHMARKS[name]()
+        results[name] = measure(body, repeat=repeat, min_time=min_time)
+        print(f'''{name:<40} {results[name]["median"] * 1e3:10.3f} ms''', file=out)
+    return results
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    # Ratios of current to baseline median time, and the names slower than threshold
+    ratios = dict()
+    regressions = list()
+    for name, result in results.items():
+        base = baseline.get("results", {}).get(name)
+        if base is None:
+            continue
+        ratios[name] = result["median"] / base["median"]
+        if ratios[name] > threshold:
+            regressions.append(name)
+    return ratios, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for query compilation, filters and parsing")
+    parser.add_argument("names", nargs="*", help="substrings selecting benchmarks; all by default")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=MIN_TIME)
+    parser.add_argument("--save", metavar="PATH", help="write the results as a baseline")
+    parser.add_argument("--compare", metavar="PATH", help="fail if slower than this baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument("--list", action="store_true")
+    args = parser.parse_args(argv)
+
+    names = [n for n in BENCHMARKS if not args.names or any(s in n for s in args.names)]
+    if args.list:
+        print("\n".join(names))
+        return 0
+    results = run(names, repeat=args.repeat, min_time=args.min_time)
+    status = 0
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        ratios, regressions = compare(results, baseline, threshold=args.threshold)
+        print()
+        for name, ratio in ratios.items():
+            flag = "  REGRESSION" if name in regressions else ""
+            print(f'''{name:<40} {ratio:9.2f}x baseline{flag}''')
+        if regressions:
+            print(f'''\n{len(regressions)} benchmark(s) slower than {args.threshold:.2f}x the baseline''')
+            status = 1
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"python": platform.python_version(), "machine": platform.machine(),
+                       "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                       "results": results}, f, indent=2)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
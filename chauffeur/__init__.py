@@ -2,3 +2,14 @@ from .filters import BboxFilter, IdFilter, TagFilter, UserFilter
 from .query import *
 from .settings import QuerySettings
 from .formats import fmt
+from .cache import ResponseCache
+from .transport import Transport
+from .scheduler import SlotScheduler
+from .endpoints import EndpointPool
+from .singleflight import SingleFlight
+from .instrument import Instruments, MetricsAggregator
+from .parser import canonicalize
+from .batch import BatchQuery
+from .columnar import ElementTable
+from .spatial import SpatialIndex, index_table
+from .diff import ElementStore
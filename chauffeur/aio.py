@@ -0,0 +1,134 @@
+import json
+import time
+import asyncio
+import datetime
+
+import requests
+
+from .cache import ResponseCache, cache_key, has_remark
+from .transport import client_timeout
+
+try:
+    import aiohttp
+except ImportError: # pragma: no cover
+    aiohttp = None
+
+
+DEFAULT_CONCURRENCY = 8
+
+
+def _require_aiohttp():
+    if aiohttp is None:
+        raise ImportError("Async requests require aiohttp: pip install chauffeur-pass[async]")
+
+
+class AsyncResponse:
+    from_cache = False
+
+    def __init__(self, status_code, content, url=None, headers=None, reason=None, elapsed=None):
+        self.status_code = status_code
+        self.content = content
+        self.url = url
+        self.headers = headers or dict()
+        self.reason = reason
+        # Time until the headers arrived, as requests reports it
+        self.elapsed = elapsed
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8")
+
+    def json(self):
+        return json.loads(self.content)
+
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+    def raise_for_status(self):
+        if 400 <= self.status_code < 600:
+            raise requests.HTTPError(f'''{self.status_code} Error: {self.reason} for url: {self.url}''',
+                                     response=self)
+
+    def close(self):
+        pass
+
+
+async def _send(session, endpoint, query, timeout):
+    timeout = aiohttp.ClientTimeout(total=timeout)
+    start = time.perf_counter()
+    async with session.post(endpoint, data={"data": query}, timeout=timeout) as resp:
+        elapsed = datetime.timedelta(seconds=time.perf_counter() - start)
+        content = await resp.read()
+        return AsyncResponse(resp.status, content, url=str(resp.url),
+                             headers=dict(resp.headers), reason=resp.reason, elapsed=elapsed)
+
+
+async def _post(qb, session, query, timeout):
+    async def send():
+        if qb.endpoints is not None:
+            return await qb.endpoints.apost(lambda url: _send(session, url, query, timeout))
+        return await _send(session, qb.overpass_endpoint, query, timeout)
+
+    if qb._observed():
+        send = qb.instruments.wrap_asend(send, qb.overpass_endpoint, queued=qb.scheduler is not None)
+    if qb.scheduler is None:
+        return await send()
+    return await qb.scheduler.asubmit(send)
+
+
+async def arequest(qb, session=None, timeout=None):
+    _require_aiohttp()
+    query = qb._compile()
+    if qb.singleflight is not None:
+        key = cache_key(query, qb.overpass_endpoint)
+        return await qb.singleflight.afetch(key, lambda: _arequest(qb, query, session, timeout))
+    return await _arequest(qb, query, session, timeout)
+
+
+async def _arequest(qb, query, session, timeout):
+    if timeout is None:
+        timeout = client_timeout(qb.settings)
+    key = None
+    if qb.cache is not None:
+        key = cache_key(query, qb.overpass_endpoint)
+        content = qb.cache.get(key)
+        if content is not None:
+            response = AsyncResponse(200, content, url=qb.overpass_endpoint)
+            response.from_cache = True
+            return response
+    if session is None:
+        async with aiohttp.ClientSession() as session:
+            response = await _post(qb, session, query, timeout)
+    else:
+        response = await _post(qb, session, query, timeout)
+    if key is not None and response.status_code == 200 and not has_remark(response.content):
+        ttl = ResponseCache.FOREVER if qb.settings.date is not None else qb.cache.ttl
+        qb.cache.put(key, response.content, ttl=ttl)
+    return response
+
+
+async def arequest_all(builders, concurrency=DEFAULT_CONCURRENCY, session=None, return_exceptions=False):
+    _require_aiohttp()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bounded(qb, session):
+        async with semaphore:
+            return await arequest(qb, session=session)
+
+    async def run(session):
+        tasks = [asyncio.ensure_future(bounded(qb, session)) for qb in builders]
+        try:
+            return await asyncio.gather(*tasks, return_exceptions=return_exceptions)
+        except BaseException:
+            # Cancel the remaining requests when one fails or the caller cancels
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    if session is None:
+        connector = aiohttp.TCPConnector(limit=concurrency)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            return await run(session)
+    return await run(session)
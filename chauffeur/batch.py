@@ -0,0 +1,72 @@
+import re
+import copy
+from collections import OrderedDict
+
+from .query import QueryBuilder
+from .elements import CHUNK_SIZE
+
+
+MARKER_TYPE = "chauffeur_batch"
+_SET_NAME = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+class BatchQuery(QueryBuilder):
+    def __init__(self, items=None, name="batch", **kwargs):
+        super().__init__(name=name, **kwargs)
+        self._items = OrderedDict()
+        for item in items or ():
+            self.add(item)
+
+    @property
+    def names(self):
+        return list(self._items.keys())
+
+    def __len__(self):
+        return len(self._items)
+
+    def add(self, item, name=None):
+        if name is None:
+            name = f'''q{len(self._items)}'''
+        if not _SET_NAME.match(name) or name == MARKER_TYPE:
+            raise ValueError(f'''Invalid set name: {name}''')
+        if name in self._items:
+            raise ValueError(f'''Duplicate set name: {name}''')
+        if isinstance(item, QueryBuilder):
+            # All statements share one settings header
+            if repr(item.settings):
+                if not repr(self.settings):
+                    self.settings = copy.copy(item.settings)
+                elif repr(item.settings) != repr(self.settings):
+                    raise ValueError("Batched queries must share their settings")
+        self._items[name] = item
+        return name
+
+    def _fmt_marker(self, name):
+        return f'''make {MARKER_TYPE} name="{name}"->.{MARKER_TYPE};.{MARKER_TYPE} out;'''
+
+    def _fmt_item(self, name, item):
+        if isinstance(item, QueryBuilder):
+            return f'''{item.qsx}{self._fmt_marker(name)}{item.output_mode}'''
+        s = f'''{repr(item)[:-1]}->.{name};'''
+        if self._recurse_down(item._output):
+            s += f'''(.{name};.{name} >;)->.{name};'''
+        return f'''{s}{self._fmt_marker(name)}.{name} {self.output_mode}'''
+
+    @property
+    def raw_query_string(self):
+        return f'''{self.settings}{"".join(self._fmt_item(n, i) for n, i in self._items.items())}'''
+
+    def iter_results(self, chunk_size=CHUNK_SIZE):
+        name = None
+        for elm in self.iter_elements(chunk_size=chunk_size):
+            if elm["type"] == MARKER_TYPE:
+                name = elm["tags"]["name"]
+                continue
+            if name is not None:
+                yield name, elm
+
+    def results(self, chunk_size=CHUNK_SIZE):
+        results = OrderedDict((name, []) for name in self._items)
+        for name, elm in self.iter_results(chunk_size=chunk_size):
+            results[name].append(elm)
+        return results
@@ -0,0 +1,90 @@
+import collections
+import concurrent.futures
+from collections.abc import Mapping
+
+from .grammar import Node, Way, Relation
+from .elements import element_key
+from .tiling import DEFAULT_MAX_WORKERS
+
+
+ELEMENT_LEVELS = {"node": Node._level, "way": Way._level, "relation": Relation._level}
+MAX_IDS_PER_QUERY = 10000
+MAX_QUERY_LENGTH = 64 * 1024 # Keeps POST bodies well below common proxy limits
+DEFAULT_MAXSIZE = 536870912 # Server default [maxsize:] of 512 MiB
+# Generous upper bounds on server memory per element; a batch must fit in [maxsize:]
+ELEMENT_SIZE_ESTIMATES = {"node": 1024, "way": 16 * 1024, "relation": 256 * 1024}
+
+
+def group_ids(ids):
+    # Accepts {"node": [1, 2], "way": [3]} or an iterable of (type, id) pairs
+    grouped = collections.OrderedDict()
+    items = ids.items() if isinstance(ids, Mapping) else None
+    if items is None:
+        for element_type, osm_id in ids:
+            grouped.setdefault(element_type, list()).append(osm_id)
+    else:
+        for element_type, osm_ids in items:
+            grouped.setdefault(element_type, list()).extend(osm_ids)
+    for element_type in grouped:
+        if element_type not in ELEMENT_LEVELS:
+            raise ValueError(f'''Unknown element type "{element_type}"''')
+        grouped[element_type] = sorted(set(int(i) for i in grouped[element_type]))
+    return grouped
+
+
+def batch_size(element_type, maxsize=None, max_ids=MAX_IDS_PER_QUERY):
+    maxsize = maxsize or DEFAULT_MAXSIZE
+    return max(min(max_ids, maxsize // ELEMENT_SIZE_ESTIMATES[element_type]), 1)
+
+
+def chunk_ids(osm_ids, max_ids=MAX_IDS_PER_QUERY, max_length=MAX_QUERY_LENGTH):
+    # Greedy packing: a chunk closes when either the id count or the clause length runs out
+    chunk = list()
+    length = 0
+    for osm_id in osm_ids:
+        width = len(str(osm_id)) + 1
+        if chunk and (len(chunk) >= max_ids or length + width > max_length):
+            yield chunk
+            chunk = list()
+            length = 0
+        chunk.append(osm_id)
+        length += width
+    if chunk:
+        yield chunk
+
+
+def id_batches(ids, maxsize=None, max_ids=MAX_IDS_PER_QUERY, max_length=MAX_QUERY_LENGTH, overhead=0):
+    for element_type, osm_ids in group_ids(ids).items():
+        size = batch_size(element_type, maxsize=maxsize, max_ids=max_ids)
+        for chunk in chunk_ids(osm_ids, max_ids=size, max_length=max(max_length - overhead, 1)):
+            yield element_type, chunk
+
+
+def request_batches(builders, max_workers=DEFAULT_MAX_WORKERS):
+    # Elements are yielded as batches complete; at most 2 * max_workers batches are held at once
+    def fetch(qb):
+        return list(qb.iter_elements())
+
+    seen = set()
+    builders = iter(builders)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = set()
+        try:
+            while True:
+                for qb in builders:
+                    pending.add(pool.submit(fetch, qb))
+                    if len(pending) >= 2 * max_workers:
+                        break
+                if not pending:
+                    return
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    for elm in future.result():
+                        key = element_key(elm)
+                        if key in seen:
+                            continue
+                        seen.add(key)
+                        yield elm
+        finally:
+            for future in pending:
+                future.cancel()
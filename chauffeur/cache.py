@@ -0,0 +1,214 @@
+import re
+import json
+import time
+import zlib
+import hashlib
+import sqlite3
+import threading
+
+
+_QUERY_SEGMENTS = re.compile(r'"(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\'|[^"\']+')
+_WHITESPACE = re.compile(r"\s+")
+_PUNCT_SPACE = re.compile(r" ?([;:,()\[\]{}=~!<>.-]) ?")
+_REMARK_MARKERS = (b"<remark>", b'"remark"')
+
+
+def normalize_query(query):
+    segments = []
+    for seg in _QUERY_SEGMENTS.findall(query):
+        if seg[0] in "\"'":
+            segments.append(seg)
+        else:
+            # Whitespace is only significant between words in OverpassQL
+            segments.append(_PUNCT_SPACE.sub(r"\1", _WHITESPACE.sub(" ", seg)))
+    return "".join(segments).strip()
+
+
+def cache_key(query, endpoint):
+    h = hashlib.sha256()
+    h.update(endpoint.encode())
+    h.update(b"\0")
+    h.update(normalize_query(query).encode())
+    return h.hexdigest()
+
+
+class CachedResponse:
+    status_code = 200
+    from_cache = True
+
+    def __init__(self, content, url=None):
+        self.content = content
+        self.url = url
+        self.headers = {"Content-Length": str(len(content))}
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8")
+
+    def json(self):
+        return json.loads(self.content)
+
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+    def raise_for_status(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class _CachingResponse:
+    # Wraps a live response, compressing the body into the cache as it is read
+    def __init__(self, response, cache, key, ttl):
+        self._response = response
+        self._cache = cache
+        self._key = key
+        self._ttl = ttl
+        self.from_cache = False
+
+    def __getattr__(self, attr):
+        return getattr(self._response, attr)
+
+    def iter_content(self, chunk_size=1):
+        compressor = zlib.compressobj(self._cache.compress_level)
+        parts = []
+        size = 0
+        tail = b""
+        marked = False
+        for chunk in self._response.iter_content(chunk_size):
+            parts.append(compressor.compress(chunk))
+            size += len(chunk)
+            marked = marked or _has_marker(tail + chunk)
+            tail = chunk[-8:]
+            yield chunk
+        parts.append(compressor.flush())
+        # A marker may just be a tag; only then is the whole body needed to tell
+        remark = marked and has_remark(zlib.decompress(b"".join(parts)))
+        if self._response.status_code == 200 and not remark:
+            self._cache.put_compressed(self._key, b"".join(parts), size, ttl=self._ttl)
+
+
+def _has_marker(content):
+    return any(marker in content for marker in _REMARK_MARKERS)
+
+
+def has_remark(content):
+    # Overpass reports runtime errors in a remark; never cache those
+    xml_marker, json_marker = _REMARK_MARKERS
+    if xml_marker in content:
+        return True
+    if json_marker not in content or not content.lstrip().startswith(b"{"):
+        return False
+    # In JSON a tag may also be called remark; the server's is a member of the top-level object
+    try:
+        body = json.loads(content)
+    except ValueError:
+        return True
+    return not isinstance(body, dict) or "remark" in body
+
+
+class ResponseCache:
+    FOREVER = None
+
+    def __init__(self, path, ttl=None, max_bytes=None, compress_level=6):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.compress_level = compress_level
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, "
+            "content BLOB NOT NULL, "
+            "size INTEGER NOT NULL, "
+            "created REAL NOT NULL, "
+            "expires REAL, "
+            "accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self._conn.commit()
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    @property
+    def size(self):
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(SUM(LENGTH(content)), 0) FROM responses").fetchone()[0]
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT content, expires FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            content, expires = row
+            if expires is not None and expires <= now:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        return zlib.decompress(content)
+
+    def put(self, key, content, ttl=NotImplemented):
+        compressed = zlib.compress(content, self.compress_level)
+        self.put_compressed(key, compressed, len(content), ttl=ttl)
+
+    def put_compressed(self, key, compressed, size, ttl=NotImplemented):
+        if ttl is NotImplemented:
+            ttl = self.ttl
+        now = time.time()
+        expires = None if ttl is None else now + ttl
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, content, size, created, expires, accessed) "
+                "VALUES (?, ?, ?, ?, ?, ?)", (key, compressed, size, now, expires, now))
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        now = time.time()
+        self._conn.execute("DELETE FROM responses WHERE expires IS NOT NULL AND expires <= ?", (now,))
+        if self.max_bytes is None:
+            return
+        total = self._conn.execute("SELECT COALESCE(SUM(LENGTH(content)), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._conn.execute(
+            "SELECT key, LENGTH(content) FROM responses ORDER BY accessed ASC").fetchall()
+        stale = []
+        for key, length in rows:
+            if total <= self.max_bytes:
+                break
+            stale.append((key,))
+            total -= length
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", stale)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def fetch(self, key, send, stream=False, ttl=NotImplemented):
+        content = self.get(key)
+        if content is not None:
+            return CachedResponse(content)
+        response = send(stream)
+        if stream:
+            return _CachingResponse(response, self, key, ttl)
+        if response.status_code == 200 and not has_remark(response.content):
+            self.put(key, response.content, ttl=ttl)
+        return response
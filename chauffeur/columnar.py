@@ -0,0 +1,414 @@
+import array
+import datetime
+from collections import OrderedDict
+
+from .elements import ELEMENT_TYPES
+
+try:
+    import numpy as np
+except ImportError: # pragma: no cover
+    np = None
+
+
+NAT = -(2 ** 63) # numpy's int64 encoding of NaT
+_NAN = float("nan")
+_BOUNDS = ("minlat", "minlon", "maxlat", "maxlon")
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("Columnar results require numpy: pip install chauffeur-pass[numpy]")
+
+
+def _timestamp(ts):
+    if not ts:
+        return NAT
+    return int(datetime.datetime.fromisoformat(ts.replace("Z", "+00:00")).timestamp())
+
+
+def _float(val):
+    return _NAN if val is None else float(val)
+
+
+class StringPool:
+    # Interns strings to dense integer codes
+    def __init__(self, strings=()):
+        self.strings = list()
+        self.codes = dict()
+        for s in strings:
+            self.intern(s)
+
+    def intern(self, s):
+        code = self.codes.get(s)
+        if code is None:
+            code = self.codes[s] = len(self.strings)
+            self.strings.append(s)
+        return code
+
+    def code(self, s):
+        return self.codes.get(s, -1)
+
+    def __getitem__(self, code):
+        return self.strings[code]
+
+    def __len__(self):
+        return len(self.strings)
+
+
+class Ragged:
+    # CSR layout: row i owns entries offsets[i]:offsets[i + 1] of every array.
+    # Offsets are absolute, so slicing rows never touches the entry arrays.
+    def __init__(self, offsets, **arrays):
+        self.offsets = offsets
+        self.arrays = arrays
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def __contains__(self, name):
+        return name in self.arrays
+
+    @property
+    def counts(self):
+        return np.diff(self.offsets)
+
+    def entries(self, name):
+        return self.arrays[name][self.offsets[0]:self.offsets[-1]]
+
+    def entry_rows(self):
+        return np.repeat(np.arange(len(self)), self.counts)
+
+    def row(self, i):
+        lo, hi = self.offsets[i], self.offsets[i + 1]
+        return {name: arr[lo:hi] for name, arr in self.arrays.items()}
+
+    def slice(self, start, stop):
+        return Ragged(self.offsets[start:stop + 1], **self.arrays)
+
+    def take(self, rows):
+        counts = self.counts[rows]
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        positions = np.repeat(self.offsets[:-1][rows] - offsets[:-1], counts) + np.arange(offsets[-1])
+        return Ragged(offsets, **{name: arr[positions] for name, arr in self.arrays.items()})
+
+    @property
+    def nbytes(self):
+        return self.offsets.nbytes + sum(arr.nbytes for arr in self.arrays.values())
+
+
+class ElementTableBuilder:
+    # Accumulates columns in compact stdlib arrays; numpy views them without copying in build(),
+    # after which the arrays can no longer grow
+    def __init__(self):
+        _require_numpy()
+        self.types = StringPool(ELEMENT_TYPES)
+        self.keys = StringPool()
+        self.values = StringPool()
+        self.roles = StringPool()
+        self._id = self._column("columns.id", "q")
+        self._type = self._column("columns.type", "b")
+        self._lat = self._column("columns.lat", "d")
+        self._lon = self._column("columns.lon", "d")
+        self._version = self._column("columns.version", "i")
+        self._timestamp = self._column("columns.timestamp", "q")
+        self._bounds = None
+        self._tag_offsets = self._column("tags.offsets", "q", 0, 1)
+        self._tag_keys = self._column("tags.key", "i")
+        self._tag_values = self._column("tags.value", "i")
+        self._node_offsets = self._column("nodes.offsets", "q", 0, 1)
+        self._node_refs = self._column("nodes.ref", "q")
+        self._node_coords = None
+        self._member_offsets = self._column("members.offsets", "q", 0, 1)
+        self._member_types = self._column("members.type", "b")
+        self._member_refs = self._column("members.ref", "q")
+        self._member_roles = self._column("members.role", "i")
+
+    def _column(self, name, typecode, fill=0, count=0):
+        # Storage for one growing column, starting with count copies of fill
+        return array.array(typecode, [fill]) * count
+
+    def _array(self, column, dtype):
+        return np.frombuffer(column, dtype=dtype) if len(column) else np.zeros(0, dtype=dtype)
+
+    def __len__(self):
+        return len(self._id)
+
+    def add(self, elm):
+        lat, lon = elm.get("lat"), elm.get("lon")
+        center = elm.get("center")
+        if lat is None and center is not None:
+            lat, lon = center["lat"], center["lon"]
+        bounds = elm.get("bounds")
+        if bounds is not None:
+            bounds = tuple(bounds[b] for b in _BOUNDS)
+        coords = elm.get("geometry") if "nodes" in elm else None
+        if coords is not None:
+            coords = [(None, None) if c is None else (c["lat"], c["lon"]) for c in coords]
+        members = [(m["type"], m["ref"], m.get("role", "")) for m in elm.get("members", ())]
+        self._append(elm["type"], elm["id"], lat, lon, elm.get("version"), elm.get("timestamp"),
+                     bounds, elm.get("tags", {}).items(), elm.get("nodes", ()), coords, members)
+
+    def add_xml(self, node):
+        attrib = node.attrib
+        lat, lon = attrib.get("lat"), attrib.get("lon")
+        bounds = None
+        tags = list()
+        nodes = list()
+        coords = None
+        members = list()
+        for child in node:
+            a = child.attrib
+            if child.tag == "tag":
+                tags.append((a["k"], a["v"]))
+            elif child.tag == "nd":
+                nodes.append(int(a["ref"]))
+                if "lat" in a:
+                    if coords is None:
+                        coords = [(None, None)] * (len(nodes) - 1)
+                    coords.append((a["lat"], a["lon"]))
+                elif coords is not None:
+                    coords.append((None, None))
+            elif child.tag == "member":
+                members.append((a["type"], int(a["ref"]), a.get("role", "")))
+            elif child.tag == "bounds":
+                bounds = tuple(float(a[b]) for b in _BOUNDS)
+            elif child.tag == "center":
+                lat, lon = a["lat"], a["lon"]
+        version = attrib.get("version")
+        self._append(node.tag, int(attrib["id"]), lat, lon, version and int(version), attrib.get("timestamp"),
+                     bounds, tags, nodes, coords, members)
+
+    def _append(self, element_type, osm_id, lat, lon, version, timestamp, bounds, tags, nodes, coords, members):
+        row = len(self._id)
+        self._id.append(osm_id)
+        self._type.append(self.types.intern(element_type))
+        self._lat.append(_float(lat))
+        self._lon.append(_float(lon))
+        self._version.append(version or 0)
+        self._timestamp.append(_timestamp(timestamp))
+        if bounds is not None and self._bounds is None:
+            self._bounds = tuple(self._column(f'''columns.{b}''', "d", _NAN, row) for b in _BOUNDS)
+        if self._bounds is not None:
+            for col, val in zip(self._bounds, bounds or (_NAN,) * len(_BOUNDS)):
+                col.append(val)
+        for k, v in tags:
+            self._tag_keys.append(self.keys.intern(k))
+            self._tag_values.append(self.values.intern(v))
+        self._tag_offsets.append(len(self._tag_keys))
+        start = len(self._node_refs)
+        self._node_refs.extend(nodes)
+        if coords is not None and self._node_coords is None:
+            self._node_coords = (self._column("nodes.lat", "d", _NAN, start),
+                                 self._column("nodes.lon", "d", _NAN, start))
+        if self._node_coords is not None:
+            lats, lons = self._node_coords
+            if coords is None:
+                coords = [(None, None)] * (len(self._node_refs) - start)
+            for nlat, nlon in coords:
+                lats.append(_float(nlat))
+                lons.append(_float(nlon))
+        self._node_offsets.append(len(self._node_refs))
+        for member_type, ref, role in members:
+            self._member_types.append(self.types.intern(member_type))
+            self._member_refs.append(ref)
+            self._member_roles.append(self.roles.intern(role))
+        self._member_offsets.append(len(self._member_refs))
+
+    def build(self):
+        arr = self._array
+        columns = OrderedDict()
+        columns["id"] = arr(self._id, np.int64)
+        columns["type"] = arr(self._type, np.int8)
+        columns["lat"] = arr(self._lat, np.float64)
+        columns["lon"] = arr(self._lon, np.float64)
+        columns["version"] = arr(self._version, np.int32)
+        columns["timestamp"] = arr(self._timestamp, np.int64).view("datetime64[s]")
+        if self._bounds is not None:
+            for name, col in zip(_BOUNDS, self._bounds):
+                columns[name] = arr(col, np.float64)
+        tags = Ragged(arr(self._tag_offsets, np.int64),
+                      key=arr(self._tag_keys, np.int32),
+                      value=arr(self._tag_values, np.int32))
+        node_arrays = dict(ref=arr(self._node_refs, np.int64))
+        if self._node_coords is not None:
+            node_arrays["lat"] = arr(self._node_coords[0], np.float64)
+            node_arrays["lon"] = arr(self._node_coords[1], np.float64)
+        nodes = Ragged(arr(self._node_offsets, np.int64), **node_arrays)
+        members = Ragged(arr(self._member_offsets, np.int64),
+                         type=arr(self._member_types, np.int8),
+                         ref=arr(self._member_refs, np.int64),
+                         role=arr(self._member_roles, np.int32))
+        return ElementTable(columns, tags, nodes, members,
+                            types=self.types, keys=self.keys, values=self.values, roles=self.roles)
+
+
+class ElementTable:
+    def __init__(self, columns, tags, nodes, members, types, keys, values, roles):
+        self.columns = columns
+        self.tags = tags
+        self.nodes = nodes
+        self.members = members
+        self.types = types
+        self.keys = keys
+        self.values = values
+        self.roles = roles
+        self.spatial_index = None # See chauffeur.spatial.index_table
+
+    @classmethod
+    def from_stream(cls, stream):
+        return stream.fill(ElementTableBuilder()).build()
+
+    @classmethod
+    def from_elements(cls, elements):
+        builder = ElementTableBuilder()
+        for elm in elements:
+            builder.add(elm)
+        return builder.build()
+
+    def __len__(self):
+        return len(self.columns["id"])
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.columns[key]
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step == 1:
+                return self.view(start, stop)
+            return self.take(np.arange(start, stop, step))
+        if isinstance(key, (int, np.integer)):
+            return self.element(key)
+        key = np.asarray(key)
+        if key.dtype == bool:
+            return self.filter(key)
+        return self.take(key)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.element(i)
+
+    def _derive(self, columns, tags, nodes, members):
+        return ElementTable(columns, tags, nodes, members,
+                            types=self.types, keys=self.keys, values=self.values, roles=self.roles)
+
+    def view(self, start, stop):
+        # Zero copy: every column and CSR offset array is a numpy view of this table's buffers
+        stop = max(start, stop)
+        columns = OrderedDict((name, col[start:stop]) for name, col in self.columns.items())
+        return self._derive(columns, self.tags.slice(start, stop),
+                            self.nodes.slice(start, stop), self.members.slice(start, stop))
+
+    def take(self, rows):
+        rows = np.asarray(rows, dtype=np.int64)
+        columns = OrderedDict((name, col[rows]) for name, col in self.columns.items())
+        return self._derive(columns, self.tags.take(rows), self.nodes.take(rows), self.members.take(rows))
+
+    def filter(self, mask):
+        return self.take(np.flatnonzero(mask))
+
+    @property
+    def ids(self):
+        return self.columns["id"]
+
+    @property
+    def lat(self):
+        return self.columns["lat"]
+
+    @property
+    def lon(self):
+        return self.columns["lon"]
+
+    @property
+    def version(self):
+        return self.columns["version"]
+
+    @property
+    def timestamp(self):
+        return self.columns["timestamp"]
+
+    @property
+    def has_bounds(self):
+        return "minlat" in self.columns
+
+    @property
+    def nbytes(self):
+        return (sum(col.nbytes for col in self.columns.values())
+                + self.tags.nbytes + self.nodes.nbytes + self.members.nbytes)
+
+    def type_mask(self, element_type):
+        return self.columns["type"] == self.types.code(element_type)
+
+    def has_tag(self, key, value=None):
+        mask = np.zeros(len(self), dtype=bool)
+        kc = self.keys.code(key)
+        if kc < 0:
+            return mask
+        hits = self.tags.entries("key") == kc
+        if value is not None:
+            vc = self.values.code(value)
+            if vc < 0:
+                return mask
+            hits &= self.tags.entries("value") == vc
+        mask[self.tags.entry_rows()[hits]] = True
+        return mask
+
+    def tag_codes(self, key):
+        # Value code per row for one key, -1 where the key is missing
+        codes = np.full(len(self), -1, dtype=np.int32)
+        kc = self.keys.code(key)
+        if kc < 0:
+            return codes
+        hits = self.tags.entries("key") == kc
+        codes[self.tags.entry_rows()[hits]] = self.tags.entries("value")[hits]
+        return codes
+
+    def tag_values(self, key):
+        codes = self.tag_codes(key)
+        values = np.full(len(codes), None, dtype=object)
+        present = codes >= 0
+        # Only the values that occur are looked up, as the pool may be mapped from disk
+        distinct, inverse = np.unique(codes[present], return_inverse=True)
+        strings = np.empty(len(distinct), dtype=object)
+        strings[:] = [self.values[code] for code in distinct.tolist()]
+        values[present] = strings[inverse]
+        return values
+
+    def within(self, bbox):
+        s, w, n, e = bbox
+        lat, lon = self.lat, self.lon
+        return (lat >= s) & (lat <= n) & (lon >= w) & (lon <= e)
+
+    def element(self, i):
+        if i < 0:
+            i += len(self)
+        elm = {"type": self.types[self.columns["type"][i]], "id": int(self.ids[i])}
+        lat, lon = self.lat[i], self.lon[i]
+        if not np.isnan(lat):
+            if elm["type"] == "node":
+                elm["lat"], elm["lon"] = float(lat), float(lon)
+            else:
+                elm["center"] = {"lat": float(lat), "lon": float(lon)}
+        if self.version[i]:
+            elm["version"] = int(self.version[i])
+        if not np.isnat(self.timestamp[i]):
+            elm["timestamp"] = str(self.timestamp[i]) + "Z"
+        if self.has_bounds and not np.isnan(self.columns["minlat"][i]):
+            elm["bounds"] = {b: float(self.columns[b][i]) for b in _BOUNDS}
+        nodes = self.nodes.row(i)
+        if len(nodes["ref"]):
+            elm["nodes"] = nodes["ref"].tolist()
+            if "lat" in nodes:
+                elm["geometry"] = [None if np.isnan(a) else {"lat": float(a), "lon": float(o)}
+                                   for a, o in zip(nodes["lat"], nodes["lon"])]
+        members = self.members.row(i)
+        if len(members["ref"]):
+            elm["members"] = [{"type": self.types[t], "ref": int(r), "role": self.roles[ro]}
+                              for t, r, ro in zip(members["type"], members["ref"], members["role"])]
+        tags = self.tags.row(i)
+        if len(tags["key"]):
+            elm["tags"] = {self.keys[k]: self.values[v] for k, v in zip(tags["key"], tags["value"])}
+        return elm
@@ -0,0 +1,276 @@
+import os
+import math
+import json
+import time
+import threading
+import collections
+
+from .filters import TagFilter, BboxFilter, IdFilter
+from .formats import OutputFormatter, fmt
+from .grammar import Node, Way, Relation, CompoundQuery
+from .settings import QuerySettings
+from .optimize import _element_statements
+from .tiling import DEFAULT_MAX_WORKERS
+
+
+EARTH_RADIUS_KM = 6371.0088
+WORLD_BBOX = (-90.0, -180.0, 90.0, 180.0)
+
+# Elements per square kilometre in a built-up area; calibrated by the history
+DENSITY = {Node._level: 5000.0, Way._level: 600.0, Relation._level: 10.0}
+KEY_SELECTIVITY = {"building": 0.3, "highway": 0.15, "addr:housenumber": 0.1, "name": 0.05,
+                   "landuse": 0.02, "natural": 0.02, "amenity": 0.01, "shop": 0.005}
+DEFAULT_KEY_SELECTIVITY = 0.01
+VALUE_SELECTIVITY = 0.1 # Share of a key's elements carrying any one value
+USER_FILTER_SELECTIVITY = 0.5
+
+ELEMENT_BYTES = {fmt.Verbosity.BRIEF: 40, fmt.Verbosity.CONCISE: 60,
+                 fmt.Verbosity.GENERIC: 150, fmt.Verbosity.VERBOSE: 230}
+NODE_REF_BYTES = 15
+COORD_BYTES = 40
+NODES_PER_WAY = 10
+NODES_PER_RELATION = 200
+XML_OVERHEAD = 1.6
+
+REQUEST_OVERHEAD = 1.0 # Seconds of queueing and query setup
+ELEMENTS_PER_SECOND = 100000.0
+MEMORY_FACTOR = 4 # Server memory per payload byte
+SAFETY = 2.0
+MIN_TIMEOUT = 25
+MAX_TIMEOUT = 3600
+MIN_MAXSIZE = 64 * 1048576
+TILE_BYTES = 256 * 1048576 # Split queries expected to return more than this
+TILE_SECONDS = QuerySettings.DEFAULT_TIMEOUT
+
+
+COST_HISTORY_FILE = "cost_history.json"
+
+Estimate = collections.namedtuple("Estimate", ["elements", "bytes", "seconds"])
+Plan = collections.namedtuple("Plan", ["timeout", "maxsize", "rows", "cols", "estimate"])
+
+
+def bbox_area(bbox):
+    s, w, n, e = bbox
+    lat = math.sin(math.radians(n)) - math.sin(math.radians(s))
+    return EARTH_RADIUS_KM ** 2 * math.radians(e - w) * lat
+
+
+def tag_selectivity(tf):
+    key = KEY_SELECTIVITY.get(tf.key.key, DEFAULT_KEY_SELECTIVITY)
+    if not tf.key.exists:
+        return 1.0 - key
+    if not tf.values:
+        return key
+    vals = (tf.values,) if isinstance(tf.values, str) else tf.values
+    share = min(VALUE_SELECTIVITY * len(vals), 1.0)
+    return key * share if tf.exists else key * (1.0 - share)
+
+
+def element_bytes(level, output_mode, payload_format=None):
+    size = ELEMENT_BYTES[output_mode.VERBOSITY]
+    brief = output_mode.VERBOSITY is fmt.Verbosity.BRIEF
+    nodes = {Way._level: NODES_PER_WAY, Relation._level: NODES_PER_RELATION}.get(level, 0)
+    if level == Way._level and not brief:
+        size += NODES_PER_WAY * NODE_REF_BYTES
+    if output_mode.GEOMETRY is fmt.Geometry.FULL_GEOM:
+        size += nodes * COORD_BYTES
+    elif output_mode.GEOMETRY is fmt.Geometry.BOUNDING_BOX and nodes:
+        size += 2 * COORD_BYTES
+    elif output_mode.GEOMETRY is fmt.Geometry.CENTER_POINT and nodes:
+        size += COORD_BYTES
+    if (payload_format or QuerySettings.DEFAULT_FORMAT) == "xml":
+        size *= XML_OVERHEAD
+    return size
+
+
+class CountFormatter(OutputFormatter):
+    def __repr__(self):
+        return "out count;"
+
+
+def default_history_path(cache=None):
+    # Next to the response cache's database when there is one, else in the user's cache directory
+    path = getattr(cache, "path", None)
+    if path is not None and path != ":memory:":
+        directory = os.path.dirname(os.path.abspath(path))
+    else:
+        directory = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "chauffeur")
+    return os.path.join(directory, COST_HISTORY_FILE)
+
+
+_shared_histories = dict()
+_shared_lock = threading.Lock()
+
+
+class CostHistory:
+    # Running log-ratio of actual to predicted cost, per query signature
+    def __init__(self, path=None, alpha=0.3):
+        self.path = path
+        self.alpha = alpha
+        self._lock = threading.Lock()
+        self._factors = dict()
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self._factors = json.load(f)
+            except ValueError:
+                # A damaged history only costs the calibration
+                self._factors = dict()
+
+    @classmethod
+    def shared(cls, path):
+        # One history per file, so builders learning into it don't overwrite each other's updates
+        path = os.path.abspath(path)
+        with _shared_lock:
+            if path not in _shared_histories:
+                _shared_histories[path] = cls(path)
+            return _shared_histories[path]
+
+    def factors(self, signature):
+        with self._lock:
+            entry = self._factors.get(signature) or self._factors.get("*") or [0.0, 0.0]
+        return math.exp(entry[0]), math.exp(entry[1])
+
+    def record(self, signature, predicted, elements, seconds=None):
+        # seconds=None records the element count only, e.g. for tiled runs
+        observed = [math.log(max(elements, 1) / max(predicted.elements, 1)), None]
+        if seconds is not None:
+            observed[1] = math.log(max(seconds, 1e-3) / max(predicted.seconds, 1e-3))
+        with self._lock:
+            for key in (signature, "*"):
+                entry = self._factors.setdefault(key, [0.0, 0.0])
+                for i, new in enumerate(observed):
+                    if new is not None:
+                        entry[i] = (1 - self.alpha) * entry[i] + self.alpha * new
+            if self.path is not None:
+                self._save()
+
+    def _save(self):
+        # Called with the lock held; written aside and renamed, so a reader never sees half a file
+        tmp = f'''{self.path}.{os.getpid()}.tmp'''
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(tmp, "w") as f:
+                json.dump(self._factors, f)
+            os.replace(tmp, self.path)
+        except OSError:
+            # The history only tunes later estimates; a read-only disk must not fail the request
+            pass
+
+    def __len__(self):
+        return len(self._factors)
+
+
+class CostModel:
+    def __init__(self, history=None, densities=None, safety=SAFETY,
+                 tile_bytes=TILE_BYTES, tile_seconds=TILE_SECONDS):
+        self.history = history if history is not None else CostHistory()
+        self.densities = dict(DENSITY, **(densities or {}))
+        self.safety = safety
+        self.tile_bytes = tile_bytes
+        self.tile_seconds = tile_seconds
+
+    def _statements(self, qb):
+        for item in qb.qsx.qc:
+            qs = qb.qsx.r[item] if isinstance(item, str) else item
+            yield from _element_statements(qs)
+
+    def signature(self, qb):
+        levels = set()
+        keys = set()
+        for stmt in self._statements(qb):
+            levels.update(e._level for e in _elements(stmt))
+            keys.update(f.key.key for f in getattr(stmt, "filters", ()) if isinstance(f, TagFilter))
+        return f'''{",".join(str(l) for l in sorted(levels))}|{",".join(sorted(keys))}'''
+
+    def count(self, qb):
+        # Expected elements per level, before calibration
+        counts = collections.Counter()
+        for stmt in self._statements(qb):
+            bbox = qb.settings.bbox or WORLD_BBOX
+            selectivity = 1.0
+            ids = None
+            for f in getattr(stmt, "filters", ()):
+                if isinstance(f, TagFilter):
+                    selectivity *= tag_selectivity(f)
+                elif isinstance(f, BboxFilter):
+                    bbox = f.bbox
+                elif isinstance(f, IdFilter):
+                    ids = len(f.osm_ids)
+                else:
+                    selectivity *= USER_FILTER_SELECTIVITY
+            area = bbox_area(bbox)
+            for element in _elements(stmt):
+                expected = self.densities[element._level] * area * selectivity
+                counts[element._level] += expected if ids is None else min(ids, max(expected, 1.0))
+        if qb._recurse_down(qb.qsx.output):
+            counts[Node._level] += counts[Way._level] * NODES_PER_WAY
+        return counts
+
+    def estimate(self, qb, counts=None):
+        # counts, for instance from probe(), replace the density guess
+        count_factor, time_factor = self.history.factors(self.signature(qb))
+        if counts is None:
+            counts = {level: n * count_factor for level, n in self.count(qb).items()}
+        elements = sum(counts.values())
+        size = sum(n * element_bytes(level, qb.output_mode, qb.settings.payload_format)
+                   for level, n in counts.items())
+        seconds = (REQUEST_OVERHEAD + elements / ELEMENTS_PER_SECOND) * time_factor
+        return Estimate(elements, size, seconds)
+
+    def probe(self, qb):
+        # A cheap "out count;" run of the same statements
+        probe = qb.tile(qb.settings.bbox)
+        probe.output_mode = CountFormatter()
+        probe.auto_recourse_down = probe.recurse_down = False
+        counts = dict()
+        for elm in probe.iter_elements():
+            if elm.get("type") == "count":
+                tags = elm.get("tags", {})
+                counts = {Node._level: int(tags.get("nodes", 0)),
+                          Way._level: int(tags.get("ways", 0)),
+                          Relation._level: int(tags.get("relations", 0))}
+        return counts
+
+    def plan(self, qb, probe=False):
+        estimate = self.estimate(qb, counts=self.probe(qb) if probe else None)
+        tiles = 1
+        if qb.settings.bbox is not None:
+            tiles = max(math.ceil(estimate.bytes * self.safety / self.tile_bytes),
+                        math.ceil(estimate.seconds * self.safety / self.tile_seconds), 1)
+        side = math.ceil(math.sqrt(tiles))
+        per_tile = Estimate(*(v / (side * side) for v in estimate))
+        timeout = int(min(max(math.ceil(per_tile.seconds * self.safety), MIN_TIMEOUT), MAX_TIMEOUT))
+        maxsize = int(min(max(per_tile.bytes * MEMORY_FACTOR * self.safety, MIN_MAXSIZE),
+                          QuerySettings.MAXSIZE_LIMIT))
+        return Plan(timeout, maxsize, side, side, estimate)
+
+    def tune(self, qb, probe=False):
+        plan = self.plan(qb, probe=probe)
+        qb.settings.timeout = plan.timeout
+        qb.settings.maxsize = plan.maxsize
+        return plan
+
+    def record(self, qb, plan, elements, seconds=None):
+        self.history.record(self.signature(qb), plan.estimate, elements, seconds)
+
+
+def _elements(stmt):
+    if isinstance(stmt, CompoundQuery):
+        return stmt._elements
+    element = getattr(stmt, "_element", None)
+    return (element,) if element is not None and element is not NotImplemented else ()
+
+
+def request_auto(qb, model, probe=False, max_workers=DEFAULT_MAX_WORKERS):
+    # Tunes settings, tiles when the plan asks for it, and feeds the outcome back to the model
+    plan = model.tune(qb, probe=probe)
+    start = time.monotonic()
+    if plan.rows * plan.cols > 1:
+        elements = qb.request_tiled(rows=plan.rows, cols=plan.cols, max_workers=max_workers)
+        seconds = None
+    else:
+        elements = list(qb.iter_elements())
+        seconds = time.monotonic() - start
+    model.record(qb, plan, len(elements), seconds)
+    return plan, elements
@@ -0,0 +1,204 @@
+import json
+import sqlite3
+import threading
+import collections
+import xml.etree.ElementTree as ET
+
+from .elements import ELEMENT_TYPES, CHUNK_SIZE, xml_to_element, element_key
+
+
+Change = collections.namedtuple("Change", ["action", "old", "new"])
+
+# Augmented diffs wrap elements in <action type=...>; plain diffs use <insert>/<erase> blocks
+_BLOCK_ACTIONS = {"insert": "create", "erase": "delete"}
+
+
+class RefreshError(RuntimeError):
+    pass
+
+
+def _first_element(node):
+    for child in node:
+        if child.tag in ELEMENT_TYPES:
+            return xml_to_element(child)
+    return None
+
+
+def parse_action(node):
+    if node.tag in _BLOCK_ACTIONS:
+        action = _BLOCK_ACTIONS[node.tag]
+        for child in node:
+            if child.tag in ELEMENT_TYPES:
+                elm = xml_to_element(child)
+                yield Change(action, elm if action == "delete" else None, elm if action == "create" else None)
+        return
+    action = node.attrib.get("type")
+    old = node.find("old")
+    new = node.find("new")
+    if old is not None or new is not None:
+        old = _first_element(old) if old is not None else None
+        new = _first_element(new) if new is not None else None
+        yield Change(action, old, new)
+        return
+    for child in node:
+        if child.tag in ELEMENT_TYPES:
+            elm = xml_to_element(child)
+            yield Change(action, elm if action == "delete" else None, None if action == "delete" else elm)
+
+
+class ChangeStream:
+    # Streams Change records out of a [diff:] or [adiff:] XML response
+    def __init__(self, chunks, close=None):
+        self._chunks = iter(chunks)
+        self._close = close
+        self.osm_base = None
+        self.remark = None
+
+    def __iter__(self):
+        try:
+            yield from self._iter_xml()
+            for _ in self._chunks:
+                pass
+        finally:
+            self.close()
+
+    def close(self):
+        if self._close is not None:
+            self._close()
+            self._close = None
+
+    def _iter_xml(self):
+        parser = ET.XMLPullParser(events=("start", "end"))
+        depth = 0
+        root = None
+        for chunk in self._chunks:
+            parser.feed(chunk)
+            for event, node in parser.read_events():
+                if event == "start":
+                    if root is None:
+                        root = node
+                    depth += 1
+                    continue
+                depth -= 1
+                if depth != 1:
+                    continue
+                if node.tag == "meta":
+                    self.osm_base = node.attrib.get("osm_base")
+                elif node.tag == "remark":
+                    self.remark = (node.text or "").strip()
+                elif node.tag == "action" or node.tag in _BLOCK_ACTIONS:
+                    yield from parse_action(node)
+                root.remove(node)
+        parser.close()
+
+
+class ElementStore:
+    # SQLite-backed copy of a query's result, kept current with diffs
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS elements ("
+            "type TEXT NOT NULL, "
+            "id INTEGER NOT NULL, "
+            "data TEXT NOT NULL, "
+            "PRIMARY KEY (type, id))"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM elements").fetchone()[0]
+
+    def __contains__(self, key):
+        return self.get(*key) is not None
+
+    def __iter__(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT data FROM elements ORDER BY type, id").fetchall()
+        for (data,) in rows:
+            yield json.loads(data)
+
+    def get(self, element_type, osm_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM elements WHERE type = ? AND id = ?", (element_type, osm_id)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    @property
+    def timestamp(self):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'osm_base'").fetchone()
+        return None if row is None else row[0]
+
+    def _set_timestamp(self, osm_base):
+        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('osm_base', ?)", (osm_base,))
+
+    def _upsert(self, elements):
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO elements (type, id, data) VALUES (?, ?, ?)",
+            ((elm["type"], elm["id"], json.dumps(elm)) for elm in elements))
+
+    def load(self, stream):
+        # Replaces the store's contents with a full result; nothing is kept if the stream fails
+        count = 0
+
+        def counted():
+            nonlocal count
+            for elm in stream:
+                count += 1
+                yield elm
+
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM elements")
+            self._upsert(counted())
+            _check(stream)
+            self._set_timestamp(stream.osm_base)
+        return count
+
+    def apply(self, changes):
+        # A plain diff reports a modification as erase + insert, in either order, so settle each key first
+        upserts = collections.OrderedDict()
+        erased = set()
+        for change in changes:
+            if change.action == "delete":
+                erased.add(element_key(change.old or change.new))
+            else:
+                upserts[element_key(change.new)] = (change.action, change.new)
+        deletes = erased.difference(upserts)
+        counts = dict(create=0, modify=0, delete=len(deletes))
+        for key, (action, _) in upserts.items():
+            counts["modify" if action == "modify" or key in erased else "create"] += 1
+        with self._lock, self._conn:
+            _check(changes)
+            self._upsert(elm for _, elm in upserts.values())
+            self._conn.executemany("DELETE FROM elements WHERE type = ? AND id = ?", deletes)
+            if changes.osm_base is not None:
+                self._set_timestamp(changes.osm_base)
+        return counts
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM elements")
+            self._conn.execute("DELETE FROM meta")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _check(stream):
+    if stream.remark:
+        raise RefreshError(f'''Server reported an incomplete result: {stream.remark}''')
+
+
+def refresh(qb, store, augmented=True, chunk_size=CHUNK_SIZE):
+    # First run loads the full result; later runs fetch only what changed since the stored osm_base
+    since = store.timestamp
+    if since is None:
+        return {"create": store.load(qb.iter_elements(chunk_size=chunk_size)), "modify": 0, "delete": 0}
+    response = qb.diff_query(since, augmented=augmented).request(stream=True)
+    response.raise_for_status()
+    return store.apply(ChangeStream(response.iter_content(chunk_size), close=response.close))
@@ -0,0 +1,256 @@
+import re
+import json
+import codecs
+import threading
+import xml.etree.ElementTree as ET
+
+from .settings import QuerySettings
+
+
+ELEMENT_TYPES = ("node", "way", "relation")
+CHUNK_SIZE = 64 * 1024
+
+_INT_ATTRS = ("id", "version", "changeset", "uid", "ref")
+_FLOAT_ATTRS = ("lat", "lon", "minlat", "minlon", "maxlat", "maxlon")
+_XML_HEADER_TAGS = ("note", "meta", "bounds")
+_NUMBER_PREFIX = re.compile(r"-?\d*(\.\d*)?([eE][-+]?\d*)?")
+
+
+def element_key(elm):
+    return (elm["type"], elm["id"])
+
+
+def _coerce(attrs):
+    d = dict()
+    for k, v in attrs.items():
+        if k in _INT_ATTRS:
+            d[k] = int(v)
+        elif k in _FLOAT_ATTRS:
+            d[k] = float(v)
+        else:
+            d[k] = v
+    return d
+
+
+def xml_to_element(node):
+    elm = {"type": node.tag}
+    elm.update(_coerce(node.attrib))
+    tags = dict()
+    for child in node:
+        if child.tag == "tag":
+            tags[child.attrib["k"]] = child.attrib["v"]
+        elif child.tag == "nd":
+            elm.setdefault("nodes", []).append(int(child.attrib["ref"]))
+            if "lat" in child.attrib:
+                elm.setdefault("geometry", []).append(
+                    {"lat": float(child.attrib["lat"]), "lon": float(child.attrib["lon"])})
+        elif child.tag == "member":
+            member = _coerce(child.attrib)
+            geom = [{"lat": float(nd.attrib["lat"]), "lon": float(nd.attrib["lon"])}
+                    for nd in child if nd.tag == "nd"]
+            if geom:
+                member["geometry"] = geom
+            elm.setdefault("members", []).append(member)
+        elif child.tag == "bounds":
+            elm["bounds"] = _coerce(child.attrib)
+        elif child.tag == "center":
+            elm["center"] = _coerce(child.attrib)
+    if tags:
+        elm["tags"] = tags
+    return elm
+
+
+class ElementStream:
+    def __init__(self, chunks, payload_format=None, close=None):
+        self._chunks = iter(chunks)
+        self.payload_format = payload_format or QuerySettings.DEFAULT_FORMAT
+        self._close = close
+        self.osm_base = None
+        self.remark = None
+
+    def __iter__(self):
+        return self._parse(xml_to_element)
+
+    def fill(self, sink):
+        # Hands raw XML nodes or decoded JSON objects to sink.add_xml/sink.add, building no element dicts
+        for _ in self._parse(sink.add_xml, sink.add):
+            pass
+        return sink
+
+    def _parse(self, from_xml, from_json=None):
+        if self.payload_format == "json":
+            parse = self._iter_json(from_json)
+        elif self.payload_format == "xml":
+            parse = self._iter_xml(from_xml)
+        else:
+            raise ValueError(f'''Unsupported payload format: {self.payload_format}''')
+        try:
+            yield from parse
+            # Drain trailing bytes so wrapped responses see the end of the body
+            for _ in self._chunks:
+                pass
+        finally:
+            self.close()
+
+    def close(self):
+        if self._close is not None:
+            self._close()
+            self._close = None
+
+    def _iter_xml(self, convert):
+        parser = ET.XMLPullParser(events=("start", "end"))
+        depth = 0
+        root = None
+        for chunk in self._chunks:
+            parser.feed(chunk)
+            for event, node in parser.read_events():
+                if event == "start":
+                    if root is None:
+                        root = node
+                    depth += 1
+                    continue
+                depth -= 1
+                if depth != 1:
+                    continue
+                if node.tag == "meta":
+                    self.osm_base = node.attrib.get("osm_base")
+                elif node.tag == "remark":
+                    self.remark = (node.text or "").strip()
+                elif node.tag not in _XML_HEADER_TAGS:
+                    yield convert(node)
+                # Drop parsed subtrees so memory stays flat
+                root.remove(node)
+        parser.close()
+
+    def _iter_json(self, convert=None):
+        reader = _JSONReader(self._chunks)
+        reader.expect("{")
+        while True:
+            if reader.peek() == "}":
+                return
+            key = reader.value()
+            reader.expect(":")
+            if key == "elements":
+                reader.expect("[")
+                while reader.peek() != "]":
+                    value = reader.value()
+                    yield value if convert is None else convert(value)
+                    if reader.peek() == ",":
+                        reader.expect(",")
+                reader.expect("]")
+            else:
+                value = reader.value()
+                if key == "osm3s":
+                    self.osm_base = value.get("timestamp_osm_base")
+                elif key == "remark":
+                    self.remark = value
+            if reader.peek() == ",":
+                reader.expect(",")
+
+
+class ParsedStream(ElementStream):
+    # Elements parsed once, replayed to every consumer; callers share the element dicts, so treat them as read-only
+    def __init__(self, elements, payload_format=None, osm_base=None, remark=None):
+        super().__init__((), payload_format=payload_format)
+        self.elements = elements
+        self.osm_base = osm_base
+        self.remark = remark
+        self._lock = threading.Lock()
+        self._derived = dict()
+
+    @classmethod
+    def read(cls, stream):
+        elements = tuple(stream)
+        return cls(elements, payload_format=stream.payload_format, osm_base=stream.osm_base, remark=stream.remark)
+
+    def __iter__(self):
+        return iter(self.elements)
+
+    def __len__(self):
+        return len(self.elements)
+
+    def fill(self, sink):
+        for elm in self.elements:
+            sink.add(elm)
+        return sink
+
+    def shared(self, key, build):
+        # Values built from the elements, such as a table, are built once for every consumer
+        with self._lock:
+            if key not in self._derived:
+                self._derived[key] = build()
+            return self._derived[key]
+
+
+class _JSONReader:
+    _whitespace = " \t\n\r"
+    _number_start = "-0123456789"
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._decode = codecs.getincrementaldecoder("utf-8")().decode
+        self._decoder = json.JSONDecoder()
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self):
+        if self._eof:
+            return False
+        try:
+            chunk = next(self._chunks)
+        except StopIteration:
+            self._eof = True
+            return False
+        if isinstance(chunk, bytes):
+            chunk = self._decode(chunk)
+        self._buf = self._buf[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def peek(self):
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in self._whitespace:
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                raise ValueError("Unexpected end of JSON payload")
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f'''Malformed JSON payload: expected {char!r} at offset {self._pos}''')
+        self._pos += 1
+
+    def value(self):
+        if self.peek() in self._number_start:
+            # A number has no closing token, so wait until one follows it
+            while _NUMBER_PREFIX.match(self._buf, self._pos).end() == len(self._buf):
+                if not self._fill():
+                    break
+        while True:
+            try:
+                val, end = self._decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            self._pos = end
+            return val
+
+
+def parse_response(response, payload_format=None):
+    return list(ElementStream([response.content], payload_format))
+
+
+def merge_elements(results):
+    seen = set()
+    merged = []
+    for elements in results:
+        for elm in elements:
+            key = element_key(elm)
+            if key in seen:
+                continue
+            seen.add(key)
+            merged.append(elm)
+    return merged
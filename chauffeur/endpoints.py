@@ -0,0 +1,326 @@
+import time
+import random
+import asyncio
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from .transport import default_transport
+from .scheduler import status_url_for
+
+
+FAILURE_STATUS_CODES = (429, 500, 502, 503, 504)
+LATENCY_ALPHA = 0.3 # Weight of the newest sample in the moving average
+LATENCY_SAMPLES = 100
+MIN_HEDGE_SAMPLES = 10
+MAX_FAILURES = 3
+EJECT_SECONDS = 30.0
+EJECT_MAX = 600.0
+HEALTH_TIMEOUT = 5.0
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    if not ordered:
+        return None
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+class Endpoint:
+    def __init__(self, url):
+        self.url = url
+        self.latency = None
+        self.samples = collections.deque(maxlen=LATENCY_SAMPLES)
+        self.in_flight = 0
+        self.failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self.requests = 0
+        self.errors = 0
+
+    def ejected(self, now):
+        return self.ejected_until > now
+
+    def __repr__(self):
+        return f'''Endpoint({self.url!r}, latency={self.latency}, failures={self.failures})'''
+
+
+class EndpointPool:
+    # Spreads requests over several interpreter mirrors by latency, ejects failing ones,
+    # and optionally hedges a slow request to a second mirror
+    def __init__(self,
+                 urls,
+                 transport=None,
+                 hedge_quantile=None,
+                 hedge_delay=1.0,
+                 max_failures=MAX_FAILURES,
+                 eject_seconds=EJECT_SECONDS,
+                 eject_max=EJECT_MAX,
+                 max_workers=16,
+                 clock=time.monotonic):
+        if not urls:
+            raise ValueError("EndpointPool needs at least one endpoint")
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.transport = transport
+        self.hedge_quantile = hedge_quantile
+        self.hedge_delay = hedge_delay
+        self.max_failures = max_failures
+        self.eject_seconds = eject_seconds
+        self.eject_max = eject_max
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers) if hedge_quantile is not None else None
+        self._health = None
+        self._stop = threading.Event()
+        self._hedges = 0
+        self._hedge_wins = 0
+
+    def _transport(self):
+        return self.transport or default_transport()
+
+    def healthy(self):
+        now = self._clock()
+        with self._lock:
+            return [e for e in self.endpoints if not e.ejected(now)]
+
+    def select(self, exclude=()):
+        now = self._clock()
+        with self._lock:
+            candidates = [e for e in self.endpoints if e not in exclude]
+            healthy = [e for e in candidates if not e.ejected(now)]
+            # With every mirror ejected, keep sending rather than failing outright
+            candidates = healthy or candidates
+            if not candidates:
+                return None
+            known = [e.latency for e in candidates if e.latency is not None]
+            # Untried mirrors are weighted as the fastest known one, so each gets sampled
+            default = min(known) if known else 1.0
+            weights = [1.0 / (max(e.latency if e.latency is not None else default, 1e-3) * (e.in_flight + 1))
+                       for e in candidates]
+            return random.choices(candidates, weights)[0]
+
+    def _record(self, endpoint, latency=None, failed=False):
+        with self._lock:
+            endpoint.requests += 1
+            if not failed:
+                endpoint.samples.append(latency)
+                if endpoint.latency is None:
+                    endpoint.latency = latency
+                else:
+                    endpoint.latency = (1 - LATENCY_ALPHA) * endpoint.latency + LATENCY_ALPHA * latency
+                endpoint.failures = 0
+                endpoint.ejections = 0
+                return
+            endpoint.errors += 1
+            endpoint.failures += 1
+            if endpoint.failures >= self.max_failures:
+                # Each consecutive ejection doubles the time out of rotation
+                backoff = min(self.eject_seconds * 2 ** endpoint.ejections, self.eject_max)
+                endpoint.ejected_until = self._clock() + backoff
+                endpoint.ejections += 1
+                endpoint.failures = 0
+
+    def _start(self, endpoint):
+        with self._lock:
+            endpoint.in_flight += 1
+        return self._clock()
+
+    def _finish(self, endpoint, start, response=None):
+        # Without a response the attempt raised
+        with self._lock:
+            endpoint.in_flight -= 1
+        failed = response is None or response.status_code in FAILURE_STATUS_CODES
+        self._record(endpoint, self._clock() - start, failed=failed)
+
+    def _attempt(self, endpoint, query, stream, timeout):
+        start = self._start(endpoint)
+        try:
+            response = self._transport().post(endpoint.url, query, stream=stream, timeout=timeout)
+        except Exception:
+            self._finish(endpoint, start)
+            raise
+        self._finish(endpoint, start, response)
+        return endpoint, response
+
+    async def _aattempt(self, endpoint, send):
+        start = self._start(endpoint)
+        try:
+            response = await send(endpoint.url)
+        except asyncio.CancelledError:
+            # A cancelled hedge says nothing about the mirror
+            with self._lock:
+                endpoint.in_flight -= 1
+            raise
+        except Exception:
+            self._finish(endpoint, start)
+            raise
+        self._finish(endpoint, start, response)
+        return endpoint, response
+
+    def hedge_after(self):
+        # Seconds to wait on the first mirror before asking a second one
+        with self._lock:
+            samples = [s for e in self.endpoints for s in e.samples]
+        if len(samples) < MIN_HEDGE_SAMPLES:
+            return self.hedge_delay
+        return percentile(samples, self.hedge_quantile)
+
+    def post(self, query, stream=False, timeout=None):
+        primary = self.select()
+        if self._executor is None:
+            return self._attempt(primary, query, stream, timeout)[1]
+        # Hedged attempts stop at the headers, so a losing mirror's body is never downloaded
+        pending = {self._executor.submit(self._attempt, primary, query, True, timeout)}
+        hedged = False
+        last = None
+        while pending:
+            done, pending = wait(pending, timeout=None if hedged else self.hedge_after(),
+                                 return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    endpoint, response = future.result()
+                except Exception as exc:
+                    last = exc
+                    continue
+                if response.status_code not in FAILURE_STATUS_CODES:
+                    for loser in pending:
+                        _cancel(loser)
+                    if endpoint is not primary:
+                        with self._lock:
+                            self._hedge_wins += 1
+                    return _settle(response, stream)
+                if last is not None and not isinstance(last, Exception):
+                    last.close()
+                last = response
+            if not hedged:
+                # Fired by the hedge delay, or early when the first mirror failed
+                hedged = True
+                backup = self.select(exclude=(primary,))
+                if backup is not None:
+                    with self._lock:
+                        self._hedges += 1
+                    pending.add(self._executor.submit(self._attempt, backup, query, True, timeout))
+        if isinstance(last, Exception):
+            raise last
+        return _settle(last, stream)
+
+    async def apost(self, send):
+        # The asyncio counterpart of post: send(url) is awaited for each mirror tried,
+        # and cancelling a losing hedge aborts its connection outright
+        primary = self.select()
+        if self.hedge_quantile is None:
+            return (await self._aattempt(primary, send))[1]
+        pending = {asyncio.ensure_future(self._aattempt(primary, send))}
+        hedged = False
+        last = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=None if hedged else self.hedge_after(),
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    try:
+                        endpoint, response = task.result()
+                    except Exception as exc:
+                        last = exc
+                        continue
+                    if response.status_code not in FAILURE_STATUS_CODES:
+                        if endpoint is not primary:
+                            with self._lock:
+                                self._hedge_wins += 1
+                        return response
+                    last = response
+                if not hedged:
+                    hedged = True
+                    backup = self.select(exclude=(primary,))
+                    if backup is not None:
+                        with self._lock:
+                            self._hedges += 1
+                        pending.add(asyncio.ensure_future(self._aattempt(backup, send)))
+        finally:
+            for task in pending:
+                task.cancel()
+        if isinstance(last, Exception):
+            raise last
+        return last
+
+    def check(self):
+        # Active health check against each mirror's status page; a healthy answer re-admits an ejected mirror
+        transport = self._transport()
+        results = dict()
+        for endpoint in self.endpoints:
+            try:
+                response = transport.session.get(status_url_for(endpoint.url), timeout=HEALTH_TIMEOUT)
+                ok = response.status_code == 200
+                response.close()
+            except Exception:
+                ok = False
+            with self._lock:
+                if ok:
+                    endpoint.ejected_until = 0.0
+                    endpoint.failures = 0
+            if not ok:
+                self._record(endpoint, failed=True)
+            results[endpoint.url] = ok
+        return results
+
+    def start(self, interval=30.0):
+        if self._health is not None:
+            return
+        self._stop.clear()
+
+        def run():
+            while not self._stop.wait(interval):
+                self.check()
+
+        self._health = threading.Thread(target=run, daemon=True)
+        self._health.start()
+
+    def close(self):
+        self._stop.set()
+        if self._health is not None:
+            self._health.join()
+            self._health = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def metrics(self):
+        now = self._clock()
+        with self._lock:
+            return {
+                "hedges": self._hedges,
+                "hedge_wins": self._hedge_wins,
+                "endpoints": {e.url: {
+                    "latency": e.latency,
+                    "in_flight": e.in_flight,
+                    "requests": e.requests,
+                    "errors": e.errors,
+                    "ejected": e.ejected(now),
+                } for e in self.endpoints},
+            }
+
+
+def _settle(response, stream):
+    # Reads the body of a hedged winner for a caller that did not ask to stream
+    if not stream:
+        response.content
+    return response
+
+
+def _cancel(future):
+    # A loser that has not been sent yet is dropped; one on the wire has its connection
+    # closed as soon as its headers land, before any of the body is read. Closing it
+    # any earlier would gain nothing, the interpreter only notices once it writes.
+    if future.cancel():
+        return
+
+    def drop(f):
+        if not f.cancelled() and f.exception() is None:
+            f.result()[1].close()
+
+    future.add_done_callback(drop)
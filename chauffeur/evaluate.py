@@ -0,0 +1,201 @@
+import re
+
+from .filters import CompoundFilter, TagFilter, BboxFilter, IdFilter
+from .grammar import GenericElementQuery, CompoundQuery, BaseQuerySet, UnionQuerySet, DifferenceQuerySet
+from .regex import unquote
+from .columnar import ElementTable, np, _require_numpy
+from .geometry import assemble_ways
+from .cost import CountFormatter
+
+
+class UnsupportedFilter(ValueError):
+    pass
+
+
+def as_table(elements):
+    if isinstance(elements, ElementTable):
+        return elements
+    return ElementTable.from_elements(elements)
+
+
+def _pool_mask(table, clause):
+    # Which interned values satisfy one compiled clause; index -1 (missing key) stays False
+    pool = table.values.strings
+    allowed = np.zeros(len(pool) + 1, dtype=bool)
+    op, value = clause[0], clause[1:]
+    if value.startswith('"'):
+        value = unquote(value)
+    if op == "=":
+        code = table.values.code(value)
+        if code >= 0:
+            allowed[code] = True
+        return allowed
+    regex = re.compile(value)
+    allowed[:-1] = [regex.search(v) is not None for v in pool]
+    return allowed
+
+
+def _eval_tag(tf, table):
+    codes = table.tag_codes(tf.key.key)
+    present = codes >= 0
+    if not tf.key.exists:
+        return ~present
+    if not tf.values:
+        return present
+    # Match against the same clauses the filter compiles to, so results agree with the server
+    allowed = np.zeros(len(table.values) + 1, dtype=bool)
+    for _, clause in tf._value_chunks():
+        allowed |= _pool_mask(table, clause)
+    matched = allowed[codes]
+    if tf.exists:
+        return matched
+    return present & ~matched
+
+
+def _node_mask(table, bbox):
+    s, w, n, e = bbox
+    lat, lon = table.lat, table.lon
+    return (lat >= s) & (lat <= n) & (lon >= w) & (lon <= e)
+
+
+def _segments_cross(x1, y1, x2, y2, bbox):
+    s, w, n, e = bbox
+    overlap = ((np.minimum(x1, x2) <= e) & (np.maximum(x1, x2) >= w)
+               & (np.minimum(y1, y2) <= n) & (np.maximum(y1, y2) >= s))
+    sides = [(x2 - x1) * (cy - y1) - (y2 - y1) * (cx - x1) for cx, cy in ((w, s), (w, n), (e, s), (e, n))]
+    above = np.all([d > 0 for d in sides], axis=0)
+    below = np.all([d < 0 for d in sides], axis=0)
+    return overlap & ~above & ~below
+
+
+def _way_mask(table, bbox):
+    if "lat" not in table.nodes:
+        if table.has_bounds:
+            s, w, n, e = bbox
+            return ((table["minlat"] <= n) & (table["maxlat"] >= s)
+                    & (table["minlon"] <= e) & (table["maxlon"] >= w))
+        return _node_mask(table, bbox)
+    lat = table.nodes.entries("lat")
+    lon = table.nodes.entries("lon")
+    rows = table.nodes.entry_rows()
+    s, w, n, e = bbox
+    hits = (lat >= s) & (lat <= n) & (lon >= w) & (lon <= e)
+    # A way also matches when one of its segments passes through the box
+    same_way = rows[1:] == rows[:-1]
+    crossing = np.zeros(len(lat), dtype=bool)
+    crossing[1:] = same_way & _segments_cross(lon[:-1], lat[:-1], lon[1:], lat[1:], bbox)
+    mask = np.zeros(len(table), dtype=bool)
+    mask[rows[hits | crossing]] = True
+    return mask
+
+
+def _eval_bbox(bf, table):
+    index = table.spatial_index
+    if index is not None:
+        # Only the rows the index cannot rule out get the exact test
+        rows = index.candidates(bf.bbox)
+        if len(rows) * 4 > len(table):
+            return _scan_bbox(bf, index.table)
+        mask = np.zeros(len(table), dtype=bool)
+        mask[rows[_scan_bbox(bf, index.table.take(rows))]] = True
+        return mask
+    return _scan_bbox(bf, table)
+
+
+def _scan_bbox(bf, table):
+    if "lat" not in table.nodes and len(table.nodes.entries("ref")):
+        # Way geometry can come from recursed node rows; rows stay aligned
+        table = assemble_ways(table)
+    types = table.columns["type"]
+    node = types == table.types.code("node")
+    way = types == table.types.code("way")
+    relation = types == table.types.code("relation")
+    mask = node & _node_mask(table, bf.bbox)
+    mask |= way & _way_mask(table, bf.bbox)
+    if relation.any():
+        # A relation is in the box when one of its node or way members is
+        member_rows = table.members.entry_rows()
+        member_types = table.members.entries("type")
+        member_refs = table.members.entries("ref")
+        inside = np.zeros(len(member_refs), dtype=bool)
+        for code, mtype in ((table.types.code("node"), node), (table.types.code("way"), way)):
+            of_type = member_types == code
+            inside[of_type] = np.isin(member_refs[of_type], table.ids[mtype & mask])
+        found = np.zeros(len(table), dtype=bool)
+        found[member_rows[inside]] = True
+        # Without member rows, fall back to the relation's own center or bounds
+        mask |= relation & (found | _way_mask(table, bf.bbox))
+    return mask
+
+
+def evaluate(flt, table):
+    # Boolean row mask of the elements a filter (or filter chain) selects
+    _require_numpy()
+    if isinstance(flt, CompoundFilter):
+        mask = np.ones(len(table), dtype=bool)
+        for f in flt:
+            mask &= evaluate(f, table)
+        return mask
+    if isinstance(flt, TagFilter):
+        return _eval_tag(flt, table)
+    if isinstance(flt, BboxFilter):
+        return _eval_bbox(flt, table)
+    if isinstance(flt, IdFilter):
+        return np.isin(table.ids, np.array(flt.osm_ids, dtype=np.int64))
+    raise UnsupportedFilter(f'''{type(flt).__name__} {flt!r} cannot be evaluated locally''')
+
+
+def evaluate_statement(stmt, table):
+    if isinstance(stmt, DifferenceQuerySet):
+        return evaluate_statement(stmt.minued, table) & ~evaluate_statement(stmt.subtrahend, table)
+    if isinstance(stmt, UnionQuerySet):
+        mask = np.zeros(len(table), dtype=bool)
+        for qs in stmt.query_statements:
+            mask |= evaluate_statement(qs, table)
+        return mask
+    if isinstance(stmt, GenericElementQuery):
+        if getattr(stmt, "_inputs", None):
+            raise UnsupportedFilter("Statements reading named input sets cannot be evaluated locally")
+        elements = stmt._elements if isinstance(stmt, CompoundQuery) else (stmt._element,)
+        mask = np.zeros(len(table), dtype=bool)
+        for element in elements:
+            mask |= table.type_mask(element._fmt())
+        return mask & evaluate(stmt.filters, table)
+    raise UnsupportedFilter(f'''{type(stmt).__name__} cannot be evaluated locally''')
+
+
+def select(elements, query):
+    # Filters or statements narrow an element collection the way the server would
+    table = as_table(elements)
+    if isinstance(query, (GenericElementQuery, BaseQuerySet)):
+        return table[evaluate_statement(query, table)]
+    return table[evaluate(query, table)]
+
+
+def _register_statement(register, name=None):
+    if name is not None:
+        if name not in register.r:
+            raise KeyError(f'''Named query: {name} does not exist''')
+        return register.r[name]
+    # "out" prints the default set, written by the last statement not stored under a name
+    for item in reversed(register.qc):
+        if not isinstance(item, str):
+            return item
+    raise UnsupportedFilter("The query writes no statement to the default set, so out prints nothing")
+
+
+def select_builder(elements, qb, name=None):
+    # Answers a builder's query from elements already fetched by a broader one;
+    # name picks one of its named sets instead of the default set that out prints
+    if isinstance(qb.output_mode, CountFormatter):
+        raise UnsupportedFilter("out count returns counts, not elements")
+    if qb.output_mode.ResultLimit != -1:
+        raise UnsupportedFilter("Which elements a limited out prints depends on the server's sort order")
+    table = as_table(elements)
+    mask = evaluate_statement(_register_statement(qb.qsx, name), table)
+    if qb.settings.bbox is not None:
+        mask &= evaluate(BboxFilter(qb.settings.bbox), table)
+    if name is None and qb._recurse_down(qb.qsx.output):
+        refs = table.nodes.take(np.flatnonzero(mask)).entries("ref")
+        mask |= table.type_mask("node") & np.isin(table.ids, refs)
+    return table[mask]
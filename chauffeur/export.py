@@ -0,0 +1,151 @@
+import csv
+import json
+import itertools
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError: # pragma: no cover
+    pa = None
+    pq = None
+
+
+DEFAULT_BATCH_SIZE = 10000
+BASE_COLUMNS = ("type", "id", "lat", "lon")
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError("Arrow and Parquet export require pyarrow: pip install chauffeur-pass[arrow]")
+
+
+def batched(elements, size=DEFAULT_BATCH_SIZE):
+    elements = iter(elements)
+    while True:
+        batch = list(itertools.islice(elements, size))
+        if not batch:
+            return
+        yield batch
+
+
+def position(elm):
+    if "lat" in elm:
+        return elm["lat"], elm["lon"]
+    center = elm.get("center")
+    if center is not None:
+        return center["lat"], center["lon"]
+    return None, None
+
+
+def geometry(elm):
+    coords = elm.get("geometry")
+    if coords and all(c is not None for c in coords):
+        line = [[c["lon"], c["lat"]] for c in coords]
+        if len(line) > 3 and line[0] == line[-1]:
+            return {"type": "Polygon", "coordinates": [line]}
+        return {"type": "LineString", "coordinates": line}
+    lat, lon = position(elm)
+    if lat is None:
+        return None
+    return {"type": "Point", "coordinates": [lon, lat]}
+
+
+class ElementWriter:
+    # Writers consume batches of element dicts; nothing outlives a batch
+    def __init__(self, tags=()):
+        self.tags = tuple(tags)
+        self.count = 0
+
+    def write_batch(self, elements):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def row(self, elm):
+        lat, lon = position(elm)
+        tags = elm.get("tags", {})
+        return [elm["type"], elm["id"], lat, lon] + [tags.get(k) for k in self.tags]
+
+
+class CSVWriter(ElementWriter):
+    def __init__(self, f, tags=(), **fmtparams):
+        super().__init__(tags)
+        self._writer = csv.writer(f, **fmtparams)
+        self._writer.writerow(BASE_COLUMNS + self.tags)
+
+    def write_batch(self, elements):
+        self._writer.writerows(self.row(elm) for elm in elements)
+        self.count += len(elements)
+
+
+class GeoJSONLinesWriter(ElementWriter):
+    def __init__(self, f, tags=None):
+        # tags=None keeps every tag as a feature property
+        super().__init__(tags or ())
+        self._all_tags = tags is None
+        self._f = f
+
+    def feature(self, elm):
+        tags = elm.get("tags", {})
+        if self._all_tags:
+            properties = dict(tags)
+        else:
+            properties = {k: tags.get(k) for k in self.tags}
+        for meta in ("version", "timestamp"):
+            if meta in elm:
+                properties[f'''@{meta}'''] = elm[meta]
+        return {"type": "Feature",
+                "id": f'''{elm["type"]}/{elm["id"]}''',
+                "geometry": geometry(elm),
+                "properties": properties}
+
+    def write_batch(self, elements):
+        self._f.write("".join(json.dumps(self.feature(elm), separators=(",", ":")) + "\n" for elm in elements))
+        self.count += len(elements)
+
+
+class ArrowWriter(ElementWriter):
+    # One record batch, or Parquet row group, per element batch
+    FORMATS = ("ipc", "parquet")
+
+    def __init__(self, sink, tags=(), format="ipc", **kwargs):
+        _require_pyarrow()
+        if format not in self.FORMATS:
+            raise ValueError(f'''Unsupported Arrow format: {format}''')
+        super().__init__(tags)
+        fields = [pa.field("type", pa.string()), pa.field("id", pa.int64()),
+                  pa.field("lat", pa.float64()), pa.field("lon", pa.float64())]
+        fields.extend(pa.field(k, pa.string()) for k in self.tags)
+        self.schema = pa.schema(fields)
+        if format == "parquet":
+            self._writer = pq.ParquetWriter(sink, self.schema, **kwargs)
+        else:
+            self._writer = pa.ipc.new_stream(sink, self.schema, **kwargs)
+        self.format = format
+
+    def write_batch(self, elements):
+        if not elements:
+            return
+        columns = zip(*(self.row(elm) for elm in elements))
+        arrays = [pa.array(col, type=field.type) for col, field in zip(columns, self.schema)]
+        self._writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=self.schema))
+        self.count += len(elements)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+def export(elements, writer, batch_size=DEFAULT_BATCH_SIZE):
+    with writer:
+        for batch in batched(elements, batch_size):
+            writer.write_batch(batch)
+    return writer.count
@@ -1,12 +1,80 @@
+import re
+import math
 import typing
+import itertools
 
+from .regex import quote, split_values, MAX_REGEX_LENGTH
+
+
+def _restore(cls, state):
+    inst = object.__new__(cls)
+    for attr, val in state.items():
+        object.__setattr__(inst, attr, val)
+    return inst
+
+
+class Frozen:
+    # Immutable, slotted value objects with structural equality and a cached hash
+    __slots__ = ("_hash",)
+
+    def _key(self):
+        raise NotImplementedError
+
+    def _set(self, **attrs):
+        for attr, val in attrs.items():
+            object.__setattr__(self, attr, val)
+
+    def __setattr__(self, attr, val):
+        raise AttributeError(f'''{type(self).__name__} is immutable''')
+
+    def __delattr__(self, attr):
+        raise AttributeError(f'''{type(self).__name__} is immutable''')
+
+    def __eq__(self, other):
+        if type(self) is not type(other):
+            return NotImplemented
+        return self._key() == other._key()
+
+    def __hash__(self):
+        try:
+            return self._hash
+        except AttributeError:
+            h = hash((type(self), self._key()))
+            self._set(_hash=h)
+            return h
+
+    def __reduce__(self):
+        state = dict()
+        for cls in type(self).__mro__:
+            for attr in getattr(cls, "__slots__", ()):
+                if hasattr(self, attr):
+                    state[attr] = getattr(self, attr)
+        return (_restore, (type(self), state))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+class Filter(Frozen):
+    __slots__ = ("_repr",)
 
-class Filter:
     def _fmt(self):
         raise NotImplementedError
 
+    def alternatives(self):
+        return (self,)
+
     def __repr__(self):
-        return self._fmt()
+        # Formatting is memoized; a filter never changes once built
+        try:
+            return self._repr
+        except AttributeError:
+            s = self._fmt()
+            self._set(_repr=s)
+            return s
 
     def __add__(self, other):
         if isinstance(other, str):
@@ -21,13 +89,53 @@ class Filter:
     def __iadd__(self, other):
         return self.__add__(other)
 
+    def freeze(self):
+        return self
+
+
+class FrozenCompoundFilter(Frozen):
+    # Hashable snapshot of a CompoundFilter, for dict and cache keys
+    __slots__ = ("filters", "_repr")
+
+    def __init__(self, filters):
+        self._set(filters=tuple(filters))
+
+    def _key(self):
+        return self.filters
+
+    def __iter__(self):
+        return iter(self.filters)
+
+    def __len__(self):
+        return len(self.filters)
+
+    def __repr__(self):
+        try:
+            return self._repr
+        except AttributeError:
+            s = "".join(repr(f) for f in self.filters)
+            self._set(_repr=s)
+            return s
+
+    def freeze(self):
+        return self
+
+    def thaw(self):
+        return CompoundFilter(list(self.filters))
+
 
 class CompoundFilter:
+    __slots__ = ("_filters", "_repr")
+
     def __init__(self, filters=None):
         self._filters = list()
+        self._invalidate()
         if filters is not None:
             self.filters = filters
 
+    def _invalidate(self):
+        self._repr = None
+
     @property
     def filters(self):
         return self._filters
@@ -42,23 +150,47 @@ class CompoundFilter:
     @filters.deleter
     def filters(self):
         self._filters = list()
+        self._invalidate()
 
     def __iter__(self):
         return iter(self.filters)
 
+    def __len__(self):
+        return len(self._filters)
+
+    def __eq__(self, other):
+        if not isinstance(other, CompoundFilter):
+            return NotImplemented
+        return self._filters == other._filters
+
+    # Mutable, so compared by value like a list; freeze() gives a hashable snapshot
+    __hash__ = None
+
+    def freeze(self):
+        return FrozenCompoundFilter(self._filters)
+
     def __repr__(self):
-        return f'''{"".join(f._fmt() for f in self.filters)}'''
+        if self._repr is None:
+            self._repr = f'''{"".join(repr(f) for f in self.filters)}'''
+        return self._repr
 
     def add_filter(self, other):
         if isinstance(other, str):
             other = UserFilter(other)
         if isinstance(other, Filter):
             self._filters.append(other)
+            self._invalidate()
             return
-        if isinstance(other, CompoundFilter):
+        if isinstance(other, (CompoundFilter, FrozenCompoundFilter)):
             self._filters.extend(other.filters)
+            self._invalidate()
             return
         if isinstance(other, typing.Sequence):
+            if all(isinstance(f, Filter) for f in other):
+                # The common case, a plain list of filters, in one step
+                self._filters.extend(other)
+                self._invalidate()
+                return
             for f in other:
                 self.add_filter(f)
         else:
@@ -86,51 +218,76 @@ class CompoundFilter:
 
 
 class GenericFilter(Filter):
-    pass
+    __slots__ = ()
 
 
 class UserFilter(GenericFilter):
+    __slots__ = ("_fs",)
+
     def __init__(self, filterstring):
-        self._fs = filterstring
+        self._set(_fs=filterstring)
+
+    def _key(self):
+        return self._fs
 
     def _fmt(self):
         return self._fs
 
 
 class IdFilter(GenericFilter):
+    __slots__ = ("_id",)
+
     def __init__(self, osm_id):
-        self._id = osm_id
+        if isinstance(osm_id, typing.Iterable) and not isinstance(osm_id, str):
+            osm_id = tuple(osm_id)
+            if len(osm_id) == 1:
+                osm_id = osm_id[0]
+        self._set(_id=osm_id)
 
     @property
     def osm_id(self):
         return self._id
 
-    @osm_id.setter
-    def osm_id(self, val):
-        self._id = val
+    @property
+    def osm_ids(self):
+        if isinstance(self._id, tuple):
+            return self._id
+        return (self._id,)
+
+    def _key(self):
+        return self._id
 
     def _fmt(self):
-        return f'''(id:{self.osm_id})'''
+        return f'''(id:{",".join(str(i) for i in self.osm_ids)})'''
 
 
 class BboxFilter(GenericFilter):
+    __slots__ = ("bbox",)
+
     def __init__(self, bbox):
-        self.bbox = bbox
+        self._set(bbox=tuple(bbox))
+
+    def _key(self):
+        return self.bbox
 
     def _fmt(self):
         s, w, n, e = self.bbox
         return f'''({s:.8f},{w:.8f},{n:.8f},{e:.8f})'''
 
 
-class KeySpec:
+class KeySpec(Frozen):
+    __slots__ = ("key", "exists")
+
     def __init__(self, key, exists=True):
         if key.startswith("!"):
             if not exists:
                 raise AttributeError("Input existence conflict")
             key = key.strip("!")
             exists = False
-        self.key = key
-        self.exists = exists
+        self._set(key=key, exists=exists)
+
+    def _key(self):
+        return (self.key, self.exists)
 
     def __bool__(self):
         return self.exists
@@ -143,55 +300,77 @@ class KeySpec:
 
 
 
-def format_values(vals):
+_PLAIN_VALUE = re.compile(r"^\w+$", re.ASCII)
+
+
+def format_value(val):
+    if _PLAIN_VALUE.match(val):
+        return val
+    return quote(val)
+
+
+def _value_chunks(vals, max_length=MAX_REGEX_LENGTH):
     if isinstance(vals, str):
-        return f'''={vals}'''
-    if isinstance(vals, list):
-        if len(vals) == 1:
-            val = vals[0]
-            return f'''={val}'''
-        else:
-            svals = "|".join(vals)
-            return f'''~"^({svals})$"'''
+        vals = (vals,)
+    if len(vals) == 1:
+        return [(tuple(vals), f'''={format_value(vals[0])}''')]
+    return [(tuple(chunk), f'''~{quote(regex)}''') for chunk, regex in split_values(vals, max_length)]
+
+
+def format_values(vals):
+    # One clause however long; statements split long lists through TagFilter.alternatives
+    return _value_chunks(vals, max_length=math.inf)[0][1]
 
 
 class TagFilter(GenericFilter):
-    def __init__(self, key, vals=[], exists=True):
-        if vals == ['*']:
+    __slots__ = ("_keyspec", "_vals", "exists", "_chunks")
+
+    def __init__(self, key, vals=(), exists=True):
+        if isinstance(vals, list):
+            vals = tuple(vals)
+        if vals == ('*',):
             vals = None
         if not vals:
-            self._key = KeySpec(key, exists=exists)
+            keyspec = KeySpec(key, exists=exists)
         else:
-            self._key = KeySpec(key)
-        self._vals = vals
-        self.exists = exists
+            keyspec = KeySpec(key)
+        self._set(_keyspec=keyspec, _vals=vals, exists=exists)
 
     @property
     def key(self):
-        return self._key
-
-    @key.setter
-    def key(self, val):
-        self._key = KeySpec(key)
+        return self._keyspec
 
     @property
     def values(self):
         return self._vals
 
-    @values.setter
-    def values(self, vals):
-        self._vals = vals
+    def _key(self):
+        return (self._keyspec, self._vals, self.exists)
+
+    def _value_chunks(self):
+        try:
+            return self._chunks
+        except AttributeError:
+            chunks = _value_chunks(self.values)
+            self._set(_chunks=chunks)
+            return chunks
+
+    def alternatives(self):
+        if not self.key.exists or not self.values or not self.exists:
+            return (self,)
+        chunks = self._value_chunks()
+        if len(chunks) == 1:
+            return (self,)
+        return tuple(TagFilter(self.key.key, list(chunk)) for chunk, _ in chunks)
 
     def _fmt(self):
         if not self.key.exists:
             return f'''[{self.key}]'''
         if not self.values:
             return f'''[{self.key}]'''
-        svals = format_values(self.values)
         if self.exists:
-            return f'''[{self.key}{svals}]'''
-        return f'''[{self.key}][{self.key}!{svals}]'''
-
-
-
-
+            # Standalone, a long list is one oversized clause; statements union one per chunk instead
+            return f'''[{self.key}{format_values(self.values)}]'''
+        chunks = self._value_chunks()
+        # Exclusions AND together, so a long list splits into several clauses
+        return f'''[{self.key}]{"".join(f"[{self.key}!{svals}]" for _, svals in chunks)}'''
@@ -0,0 +1,61 @@
+from .columnar import Ragged, np, _require_numpy
+
+
+class NodeIndex:
+    # Node ids sorted once; lookups are a vectorized binary search
+    def __init__(self, ids, lat, lon):
+        _require_numpy()
+        order = np.argsort(ids, kind="stable")
+        self.ids = ids[order]
+        self.lat = lat[order]
+        self.lon = lon[order]
+
+    @classmethod
+    def from_table(cls, table):
+        nodes = table.type_mask("node") & ~np.isnan(table.lat)
+        return cls(table.ids[nodes], table.lat[nodes], table.lon[nodes])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def lookup(self, refs):
+        # Returns lat, lon arrays aligned with refs, NaN where a node is missing
+        lat = np.full(len(refs), np.nan)
+        lon = np.full(len(refs), np.nan)
+        if not len(self.ids):
+            return lat, lon
+        pos = np.searchsorted(self.ids, refs)
+        np.minimum(pos, len(self.ids) - 1, out=pos)
+        found = self.ids[pos] == refs
+        lat[found] = self.lat[pos[found]]
+        lon[found] = self.lon[pos[found]]
+        return lat, lon
+
+
+def assemble_ways(table, index=None):
+    # Fills way node coordinates from the node rows of a skel + (._;>;) response,
+    # giving the same table an "out geom" response would have produced
+    if index is None:
+        index = NodeIndex.from_table(table)
+    refs = table.nodes.entries("ref")
+    lat, lon = index.lookup(refs)
+    offsets = table.nodes.offsets - table.nodes.offsets[0]
+    nodes = Ragged(offsets, ref=refs, lat=lat, lon=lon)
+    return table._derive(table.columns, table.tags, nodes, table.members)
+
+
+def coordinates(table, row):
+    # (n, 2) lon/lat array for one way, in GeoJSON axis order
+    nodes = table.nodes.row(row)
+    return np.column_stack((nodes["lon"], nodes["lat"]))
+
+
+def is_complete(table):
+    # True per row when every referenced node has coordinates
+    if "lat" in table.nodes:
+        missing = np.isnan(table.nodes.entries("lat"))
+    else:
+        missing = np.ones(len(table.nodes.entries("ref")), dtype=bool)
+    incomplete = np.zeros(len(table), dtype=bool)
+    incomplete[table.nodes.entry_rows()[missing]] = True
+    return ~incomplete
@@ -1,6 +1,6 @@
 import itertools
 import collections
-from .filters import CompoundFilter
+from .filters import CompoundFilter, Frozen
 
 
 class OSMElement:
@@ -24,6 +24,7 @@ class Relation(OSMElement):
 
 
 class AbstractQueryStatement:
+    __slots__ = ("_inputs", "_name", "filters")
     _input = None
     _output = None
     _default_name = "_"
@@ -38,6 +39,27 @@ class AbstractQueryStatement:
     def _fmt_statement(self):
         raise NotImplementedError
 
+    def _key(self):
+        return (getattr(self, "_inputs", None), getattr(self, "_name", None), self.filters)
+
+    def __eq__(self, other):
+        if type(self) is not type(other):
+            return NotImplemented
+        return self._key() == other._key()
+
+    # Statements stay mutable (add_filter, query_statements); freeze() gives a hashable snapshot
+    __hash__ = None
+
+    def freeze(self):
+        return FrozenStatement(type(self), getattr(self, "_name", None), self._frozen_parts())
+
+    def _frozen_parts(self):
+        return self.filters.freeze()
+
+    @classmethod
+    def _thaw(cls, frozen):
+        return cls(name=frozen.name, filters=frozen.parts)
+
     def __repr__(self):
         return f'''{self._fmt_statement()};'''
 
@@ -78,7 +100,34 @@ class AbstractQueryStatement:
 
 
 
+class FrozenStatement(Frozen):
+    # Hashable snapshot of a query statement and everything under it, for dict and cache keys
+    __slots__ = ("statement_type", "name", "parts", "_repr")
+
+    def __init__(self, statement_type, name, parts):
+        self._set(statement_type=statement_type, name=name, parts=parts)
+
+    def _key(self):
+        return (self.statement_type, self.name, self.parts)
+
+    def freeze(self):
+        return self
+
+    def thaw(self):
+        # A new mutable statement equal to the one frozen
+        return self.statement_type._thaw(self)
+
+    def __repr__(self):
+        try:
+            return self._repr
+        except AttributeError:
+            s = repr(self.thaw())
+            self._set(_repr=s)
+            return s
+
+
 class GenericElementQuery(AbstractQueryStatement):
+    __slots__ = ()
     _element = NotImplemented
     _input = None
 
@@ -97,12 +146,19 @@ class GenericElementQuery(AbstractQueryStatement):
 
     def _fmt_statement(self):
         msg = f'''{self._fmt_element()}'''
-        if self.filters.filters:
-            msg = f'''{msg}{self.filters}'''
-        return msg
+        if not self.filters.filters:
+            return msg
+        alternatives = [f.alternatives() for f in self.filters]
+        if all(len(alts) == 1 for alts in alternatives):
+            return f'''{msg}{self.filters}'''
+        # Values too many for one regex: union one statement per value chunk
+        statements = "".join(f'''{msg}{"".join(repr(f) for f in combo)};'''
+                             for combo in itertools.product(*alternatives))
+        return f'''({statements})'''
 
 
 class CompoundQuery(GenericElementQuery):
+    __slots__ = ()
     _elements = ()
 
     @property
@@ -115,6 +171,8 @@ class CompoundQuery(GenericElementQuery):
 
 
 class BaseQuerySet(AbstractQueryStatement):
+    __slots__ = ("query_statements",)
+
     def __init__(self, query_statements=None):
         if query_statements is None:
             self.query_statements = list()
@@ -135,16 +193,30 @@ class BaseQuerySet(AbstractQueryStatement):
     def __iter__(self):
         return iter(self.query_statements)
 
+    def _key(self):
+        return tuple(self.query_statements)
+
+    def _frozen_parts(self):
+        return tuple(qs.freeze() for qs in self.query_statements)
+
+    @classmethod
+    def _thaw(cls, frozen):
+        return cls([qs.thaw() for qs in frozen.parts])
+
     def __repr__(self):
         return f'''({self._fmt_statement()});'''
 
 
 class UnionQuerySet(BaseQuerySet):
+    __slots__ = ()
+
     def _fmt_statement(self):
         return f'''{"".join(repr(qs) for qs in self.query_statements)}'''
 
 
 class DifferenceQuerySet(BaseQuerySet):
+    __slots__ = ("minued", "subtrahend")
+
     def __init__(self, query_statements=None):
         assert len(query_statements) == 2
         super().__init__(query_statements)
@@ -0,0 +1,307 @@
+import time
+import math
+import bisect
+import threading
+import contextlib
+import collections
+import http.server
+
+from .elements import ElementStream
+
+
+PHASES = ("compile", "queue", "ttfb", "transfer", "parse")
+# Upper bounds in seconds, as Prometheus client libraries default to, stretched for long queries
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 25.0, 60.0, 180.0, 600.0, math.inf)
+
+Span = collections.namedtuple("Span", ["phase", "seconds", "endpoint", "status", "bytes", "counts", "error"],
+                              defaults=(None, None, None, None, None))
+
+
+class Instruments:
+    # Fans execution spans out to subscribers; QueryBuilder checks `active` before timing anything
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self._subscribers = tuple()
+        self._lock = threading.Lock()
+
+    @property
+    def active(self):
+        return bool(self._subscribers)
+
+    def subscribe(self, callback):
+        with self._lock:
+            self._subscribers = self._subscribers + (callback,)
+        return callback
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            self._subscribers = tuple(s for s in self._subscribers if s != callback)
+
+    def emit(self, span):
+        for subscriber in self._subscribers:
+            subscriber(span)
+
+    @contextlib.contextmanager
+    def span(self, phase, **fields):
+        start = self.clock()
+        try:
+            yield
+        except Exception as exc:
+            self.emit(Span(phase, self.clock() - start, error=type(exc).__name__, **fields))
+            raise
+        self.emit(Span(phase, self.clock() - start, **fields))
+
+    def wrap_send(self, send, endpoint, stream=False, queued=False):
+        # Times the HTTP exchange; with queued, also the wait between submitting and sending
+        submitted = self.clock()
+
+        def timed():
+            start = self._sending(submitted, endpoint, queued)
+            try:
+                response = send()
+            except Exception as exc:
+                self.emit(Span("ttfb", self.clock() - start, endpoint=endpoint, error=type(exc).__name__))
+                raise
+            return self._answered(start, response, endpoint, stream)
+
+        return timed
+
+    def wrap_asend(self, send, endpoint, queued=False):
+        # The asyncio counterpart of wrap_send; async bodies are always read inside send
+        submitted = self.clock()
+
+        async def timed():
+            start = self._sending(submitted, endpoint, queued)
+            try:
+                response = await send()
+            except Exception as exc:
+                self.emit(Span("ttfb", self.clock() - start, endpoint=endpoint, error=type(exc).__name__))
+                raise
+            return self._answered(start, response, endpoint, False)
+
+        return timed
+
+    def _sending(self, submitted, endpoint, queued):
+        start = self.clock()
+        if queued:
+            self.emit(Span("queue", start - submitted, endpoint=endpoint))
+        return start
+
+    def _answered(self, start, response, endpoint, stream):
+        seconds = self.clock() - start
+        used = getattr(response, "url", None) or endpoint
+        status = response.status_code
+        elapsed = getattr(response, "elapsed", None)
+        if stream or elapsed is None:
+            self.emit(Span("ttfb", seconds, endpoint=used, status=status))
+        else:
+            # The body was read inside send; the response times the headers separately
+            ttfb = min(elapsed.total_seconds(), seconds)
+            self.emit(Span("ttfb", ttfb, endpoint=used, status=status))
+            self.emit(Span("transfer", seconds - ttfb, endpoint=used, status=status,
+                           bytes=len(response.content)))
+        return response
+
+
+class InstrumentedStream(ElementStream):
+    # Splits the time spent iterating into reading chunks (transfer) and parsing them, and counts elements
+    def __init__(self, instruments, chunks, payload_format=None, close=None, endpoint=None, status=None,
+                 live=True):
+        self._instruments = instruments
+        self.live = live
+        self._clock = instruments.clock
+        self.endpoint = endpoint
+        self.status = status
+        self.bytes = 0
+        self.transfer_seconds = 0.0
+        self.counts = collections.Counter()
+        super().__init__(self._timed(chunks), payload_format=payload_format, close=close)
+
+    def _timed(self, chunks):
+        clock = self._clock
+        chunks = iter(chunks)
+        while True:
+            start = clock()
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                self.transfer_seconds += clock() - start
+                return
+            self.transfer_seconds += clock() - start
+            self.bytes += len(chunk)
+            yield chunk
+
+    def _parse(self, from_xml, from_json=None):
+        counts = self.counts
+
+        def xml(node):
+            counts[node.tag] += 1
+            return from_xml(node)
+
+        def decoded(value):
+            counts[value.get("type")] += 1
+            return value if from_json is None else from_json(value)
+
+        clock = self._clock
+        parse = super()._parse(xml, decoded)
+        busy = 0.0
+        error = None
+        try:
+            while True:
+                # Only time spent inside the parser counts, not the consumer's work between elements
+                start = clock()
+                try:
+                    item = next(parse)
+                except StopIteration:
+                    busy += clock() - start
+                    return
+                busy += clock() - start
+                yield item
+        except Exception as exc:
+            error = type(exc).__name__
+            raise
+        finally:
+            parse.close()
+            fields = dict(endpoint=self.endpoint, status=self.status, error=error)
+            if self.live:
+                self._instruments.emit(Span("transfer", self.transfer_seconds, bytes=self.bytes, **fields))
+            self._instruments.emit(Span("parse", max(busy - self.transfer_seconds, 0.0),
+                                        counts=dict(counts), **fields))
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def percentile(self, q):
+        # Interpolated linearly inside the bucket holding the q-th observation
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for upper, n in zip(self.buckets, self.counts):
+            if n and seen + n >= rank:
+                if math.isinf(upper):
+                    return lower
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+            lower = upper
+        return lower
+
+
+class MetricsAggregator:
+    # In-process subscriber keeping a latency histogram per (phase, endpoint) and running totals
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.histograms = dict()
+        self.bytes = collections.Counter()
+        self.elements = collections.Counter()
+        self.responses = collections.Counter()
+        self.errors = collections.Counter()
+
+    def __call__(self, span):
+        with self._lock:
+            key = (span.phase, span.endpoint or "")
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.buckets)
+            histogram.observe(span.seconds)
+            if span.bytes:
+                self.bytes[span.endpoint or ""] += span.bytes
+            if span.counts:
+                self.elements.update(span.counts)
+            if span.phase == "ttfb" and span.status is not None:
+                self.responses[(span.endpoint or "", span.status)] += 1
+            if span.error is not None:
+                self.errors[(span.phase, span.error)] += 1
+
+    def percentile(self, phase, q, endpoint=None):
+        # Over every endpoint unless one is named
+        with self._lock:
+            merged = Histogram(self.buckets)
+            for (p, e), histogram in self.histograms.items():
+                if p == phase and (endpoint is None or e == endpoint):
+                    merged.counts = [a + b for a, b in zip(merged.counts, histogram.counts)]
+                    merged.count += histogram.count
+                    merged.sum += histogram.sum
+        return merged.percentile(q)
+
+    def summary(self, quantiles=(0.5, 0.9, 0.99)):
+        phases = sorted({p for p, _ in self.histograms}, key=lambda p: PHASES.index(p) if p in PHASES else len(PHASES))
+        return {phase: {f'''p{int(q * 100)}''': self.percentile(phase, q) for q in quantiles} for phase in phases}
+
+
+def _labels(**labels):
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return ",".join(f'''{k}="{escape(v)}"''' for k, v in labels.items())
+
+
+def _bound(upper):
+    return "+Inf" if math.isinf(upper) else repr(upper)
+
+
+def prometheus_text(aggregator, prefix="chauffeur"):
+    # Prometheus text exposition format, version 0.0.4
+    lines = list()
+    with aggregator._lock:
+        name = f'''{prefix}_phase_seconds'''
+        lines.append(f'''# HELP {name} Time spent in each phase of query execution.''')
+        lines.append(f'''# TYPE {name} histogram''')
+        for (phase, endpoint), histogram in sorted(aggregator.histograms.items()):
+            cumulative = 0
+            for upper, n in zip(histogram.buckets, histogram.counts):
+                cumulative += n
+                labels = _labels(phase=phase, endpoint=endpoint, le=_bound(upper))
+                lines.append(f'''{name}_bucket{{{labels}}} {cumulative}''')
+            labels = _labels(phase=phase, endpoint=endpoint)
+            lines.append(f'''{name}_sum{{{labels}}} {histogram.sum!r}''')
+            lines.append(f'''{name}_count{{{labels}}} {histogram.count}''')
+        counters = (
+            ("received_bytes_total", "Response bytes received.", aggregator.bytes,
+             lambda k: dict(endpoint=k)),
+            ("elements_total", "Elements parsed, by type.", aggregator.elements,
+             lambda k: dict(type=k)),
+            ("responses_total", "HTTP responses, by endpoint and status.", aggregator.responses,
+             lambda k: dict(endpoint=k[0], status=k[1])),
+            ("errors_total", "Phases that raised, by exception type.", aggregator.errors,
+             lambda k: dict(phase=k[0], error=k[1])),
+        )
+        for suffix, help_text, counter, labels_of in counters:
+            name = f'''{prefix}_{suffix}'''
+            lines.append(f'''# HELP {name} {help_text}''')
+            lines.append(f'''# TYPE {name} counter''')
+            for key, value in sorted(counter.items(), key=lambda kv: str(kv[0])):
+                lines.append(f'''{name}{{{_labels(**labels_of(key))}}} {value}''')
+    return "\n".join(lines) + "\n"
+
+
+def start_http_server(aggregator, port, addr="127.0.0.1", prefix="chauffeur"):
+    # Serves prometheus_text on every GET from a daemon thread; returns the server for shutdown()
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = prometheus_text(aggregator, prefix=prefix).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer((addr, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,253 @@
+import copy
+from collections import OrderedDict
+
+from .filters import CompoundFilter, TagFilter, BboxFilter, IdFilter
+from .grammar import GenericElementQuery, BaseQuerySet, UnionQuerySet, DifferenceQuerySet
+
+
+class QueryContradiction(ValueError):
+    pass
+
+
+class _KeyState:
+    def __init__(self, key):
+        self.key = key
+        self.exists = False
+        self.absent = False
+        self.allowed = None
+        self.excluded = list()
+
+    def add(self, tf):
+        vals = tf.values
+        if isinstance(vals, str):
+            vals = (vals,)
+        if not tf.key.exists:
+            self.absent = True
+        elif not vals:
+            self.exists = True
+        elif tf.exists:
+            self.exists = True
+            if self.allowed is None:
+                self.allowed = list(vals)
+            else:
+                self.allowed = [v for v in self.allowed if v in vals]
+        else:
+            self.exists = True
+            self.excluded.extend(v for v in vals if v not in self.excluded)
+
+    def resolve(self):
+        if self.absent:
+            if self.exists:
+                raise QueryContradiction(f'''Key "{self.key}" is required to exist and not to exist''')
+            return TagFilter(self.key, exists=False)
+        if self.allowed is not None:
+            vals = [v for v in self.allowed if v not in self.excluded]
+            if not vals:
+                raise QueryContradiction(f'''No value of key "{self.key}" satisfies every filter''')
+            return TagFilter(self.key, vals if len(vals) > 1 else vals[0])
+        if self.excluded:
+            return TagFilter(self.key, self.excluded, exists=False)
+        return TagFilter(self.key)
+
+
+def _intersect_bboxes(a, b):
+    s, w = max(a[0], b[0]), max(a[1], b[1])
+    n, e = min(a[2], b[2]), min(a[3], b[3])
+    if s > n or w > e:
+        raise QueryContradiction(f'''Bounding boxes {a} and {b} do not intersect''')
+    return (s, w, n, e)
+
+
+def optimize_filters(filters):
+    # Clauses in a filter chain are ANDed: merge per key, drop duplicates and implied filters
+    slots = list()
+    keys = OrderedDict()
+    seen = set()
+    bbox = None
+    osm_ids = None
+    for f in filters:
+        if isinstance(f, TagFilter):
+            if f.key.key not in keys:
+                keys[f.key.key] = _KeyState(f.key.key)
+                slots.append(keys[f.key.key])
+            keys[f.key.key].add(f)
+        elif isinstance(f, BboxFilter):
+            if bbox is None:
+                slots.append(BboxFilter)
+                bbox = f.bbox
+            else:
+                bbox = _intersect_bboxes(bbox, f.bbox)
+        elif isinstance(f, IdFilter):
+            if osm_ids is None:
+                slots.append(IdFilter)
+                osm_ids = list(dict.fromkeys(f.osm_ids))
+            else:
+                osm_ids = [i for i in osm_ids if i in f.osm_ids]
+                if not osm_ids:
+                    raise QueryContradiction("Id filters share no id")
+        elif f not in seen:
+            seen.add(f)
+            slots.append(f)
+    optimized = list()
+    for slot in slots:
+        if isinstance(slot, _KeyState):
+            optimized.append(slot.resolve())
+        elif slot is BboxFilter:
+            optimized.append(BboxFilter(bbox))
+        elif slot is IdFilter:
+            optimized.append(IdFilter(osm_ids))
+        else:
+            optimized.append(slot)
+    return CompoundFilter(optimized)
+
+
+def _with_filters(stmt, filters):
+    new = copy.copy(stmt)
+    new.filters = filters
+    return new
+
+
+def _union_signatures(stmt):
+    # One signature per mergeable tag filter: everything about the statement except that filter's values
+    filters = list(stmt.filters)
+    # Statements reading other input sets, or stored under other names, never merge
+    scope = (repr(getattr(stmt, "_inputs", None)), getattr(stmt, "_name", None))
+    signatures = list()
+    for i, f in enumerate(filters):
+        if isinstance(f, TagFilter) and f.key.exists and f.exists and f.values:
+            rest = tuple(filters[:i] + filters[i + 1:])
+            signatures.append(((type(stmt), scope, f.key.key, i, rest), i))
+    return signatures
+
+
+def _unnamed(stmt):
+    return not getattr(stmt, "_name", None) and not getattr(stmt, "_inputs", None)
+
+
+def _flatten_union(statements):
+    # (a;(b;c;);) is (a;b;c;)
+    flat = list()
+    for stmt in statements:
+        if isinstance(stmt, UnionQuerySet) and _unnamed(stmt):
+            flat.extend(stmt.query_statements)
+        else:
+            flat.append(stmt)
+    return flat
+
+
+def _merge_union(statements):
+    # (node[k=a];node[k=b];) is node[k~"^(a|b)$"] when nothing else differs
+    merged = list()
+    groups = dict()
+    for stmt in statements:
+        if stmt in merged:
+            continue
+        if not isinstance(stmt, GenericElementQuery):
+            merged.append(stmt)
+            continue
+        filters = list(stmt.filters)
+        signatures = _union_signatures(stmt)
+        for sig, i in signatures:
+            if sig in groups:
+                idx = groups[sig]
+                target = merged[idx]
+                tfilters = list(target.filters)
+                vals = tfilters[i].values
+                vals = [vals] if isinstance(vals, str) else list(vals)
+                new_vals = filters[i].values
+                new_vals = [new_vals] if isinstance(new_vals, str) else list(new_vals)
+                vals.extend(v for v in new_vals if v not in vals)
+                tfilters[i] = TagFilter(filters[i].key.key, vals)
+                merged[idx] = _with_filters(target, CompoundFilter(tfilters))
+                # The target's other signatures described its old values; only the merged ones may match now
+                for old in _union_signatures(target):
+                    if groups.get(old[0]) == idx:
+                        del groups[old[0]]
+                for new, _ in _union_signatures(merged[idx]):
+                    groups.setdefault(new, idx)
+                break
+        else:
+            for sig, _ in signatures:
+                groups[sig] = len(merged)
+            merged.append(stmt)
+    return merged
+
+
+def optimize_statement(stmt):
+    if isinstance(stmt, DifferenceQuerySet):
+        return DifferenceQuerySet([optimize_statement(stmt.minued), optimize_statement(stmt.subtrahend)])
+    if isinstance(stmt, BaseQuerySet):
+        statements = [optimize_statement(qs) for qs in stmt.query_statements]
+        if isinstance(stmt, UnionQuerySet):
+            statements = _merge_union(_flatten_union(statements))
+            if len(statements) == 1 and _unnamed(stmt):
+                # (a;) is just a;
+                return statements[0]
+        return type(stmt)(statements)
+    if isinstance(stmt, GenericElementQuery):
+        return _with_filters(stmt, optimize_filters(stmt.filters))
+    return stmt
+
+
+def _element_statements(stmt):
+    if isinstance(stmt, DifferenceQuerySet):
+        yield from _element_statements(stmt.minued)
+        yield from _element_statements(stmt.subtrahend)
+    elif isinstance(stmt, BaseQuerySet):
+        for qs in stmt.query_statements:
+            yield from _element_statements(qs)
+    else:
+        yield stmt
+
+
+def _drop_bbox(stmt, bbox):
+    if isinstance(stmt, DifferenceQuerySet):
+        return DifferenceQuerySet([_drop_bbox(stmt.minued, bbox), _drop_bbox(stmt.subtrahend, bbox)])
+    if isinstance(stmt, BaseQuerySet):
+        return type(stmt)([_drop_bbox(qs, bbox) for qs in stmt.query_statements])
+    if isinstance(stmt, GenericElementQuery):
+        return _with_filters(stmt, CompoundFilter([f for f in stmt.filters if f != bbox]))
+    return stmt
+
+
+def _common_bbox(statements):
+    common = None
+    for stmt in statements:
+        if not isinstance(stmt, GenericElementQuery):
+            return None
+        bboxes = [f for f in stmt.filters if isinstance(f, BboxFilter)]
+        if len(bboxes) != 1:
+            return None
+        if common is None:
+            common = bboxes[0]
+        elif bboxes[0] != common:
+            return None
+    return common
+
+
+def optimize_register(settings, register):
+    # Returns optimized copies; the register and settings passed in are left untouched
+    statements = list()
+    for item in register.qc:
+        qs = register.r[item] if isinstance(item, str) else item
+        statements.append((item, optimize_statement(qs)))
+
+    elements = [s for _, qs in statements for s in _element_statements(qs)]
+    common = _common_bbox(elements)
+    settings = copy.copy(settings)
+    if common is not None:
+        if settings.bbox is None or tuple(settings.bbox) == common.bbox:
+            # Every statement shares the bbox: state it once in the global setting
+            settings.bbox = common.bbox
+            statements = [(item, _drop_bbox(qs, common)) for item, qs in statements]
+
+    optimized = copy.copy(register)
+    optimized.qc = list()
+    optimized.r = OrderedDict()
+    for item, qs in statements:
+        if isinstance(item, str):
+            optimized.r[item] = qs
+            optimized.qc.append(item)
+        else:
+            optimized.qc.append(qs)
+    return settings, optimized
@@ -0,0 +1,444 @@
+import re
+import datetime
+import functools
+
+from dateutil.parser import parse as dateparse
+
+from .grammar import Node, Way, Relation, GenericElementQuery, UnionQuerySet, DifferenceQuerySet
+from .filters import TagFilter, BboxFilter, IdFilter, UserFilter
+from .formats import OutputFormatter, fmt
+from .regex import quote, unquote
+from .cost import CountFormatter
+from .query import QueryBuilder, element_query_factory
+
+
+CANONICAL_CACHE_SIZE = 4096
+
+_NUM = r"-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?"
+# One token per match; bbox and id clauses are matched whole, as they are the most common
+_TOKEN = re.compile(rf'''\s*(
+    \(\s*{_NUM}\s*,\s*{_NUM}\s*,\s*{_NUM}\s*,\s*{_NUM}\s*\)
+  | \(\s*(?:id\s*:\s*\d+(?:\s*,\s*\d+)*|\d+)\s*\)
+  | [\[\]();:,=]
+  | "[^"\\]*(?:\\.[^"\\]*)*"|'[^'\\]*(?:\\.[^'\\]*)*'
+  | {_NUM}
+  | \w+
+  | ->|!=|!~|/\*.*?\*/|//[^\n]*
+  | \S)''', re.VERBOSE | re.DOTALL)
+_NUMBER = re.compile(_NUM)
+_DIGITS = re.compile(r"\d+")
+
+_ELEMENTS = {
+    "node": (Node._level,),
+    "way": (Way._level,),
+    "rel": (Relation._level,),
+    "relation": (Relation._level,),
+    "nw": (Node._level, Way._level),
+    "nr": (Node._level, Relation._level),
+    "wr": (Way._level, Relation._level),
+    "nwr": (Node._level, Way._level, Relation._level),
+}
+_VERBOSITY = {v.value: v for v in fmt.Verbosity}
+_GEOMETRY = {g.value: g for g in fmt.Geometry}
+_SORTORDER = {s.value: s for s in fmt.SortOrder}
+_RECURSE = ["(", ".", "_", ";", ">", ";", ")", ";"]
+
+_PLAIN_KEY = re.compile(r"^\w+$")
+# A regex that only lists literal values, as TagFilter writes them
+_LITERAL = r"(?:\\[.^$*+?()\[\]{}|\\]|[^.^$*+?()\[\]{}|\\])+"
+_LITERAL_LIST = re.compile(rf"^\^(?:\(({_LITERAL}(?:\|{_LITERAL})*)\)|({_LITERAL}))\$$")
+_FILTER_ORDER = {IdFilter: 0, TagFilter: 1, BboxFilter: 2}
+
+
+class ParseError(ValueError):
+    pass
+
+
+def literal_values(regex):
+    m = _LITERAL_LIST.match(regex)
+    if m is None:
+        return None
+    body = m.group(1) if m.group(1) is not None else m.group(2)
+    return [re.sub(r"\\(.)", r"\1", v) for v in re.findall(_LITERAL, body)]
+
+
+def _utc(date):
+    date = dateparse(date)
+    if date.tzinfo is not None:
+        date = date.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return date
+
+
+def _unquote(tok):
+    # Most literals hold no escapes, so skip the regex for them
+    return unquote(tok) if "\\" in tok else tok[1:-1]
+
+
+def _is_str(tok):
+    return len(tok) > 1 and tok[0] in "\"'"
+
+
+def _is_num(tok):
+    return tok[-1:].isdigit() and (tok[0].isdigit() or tok[0] == "-")
+
+
+def _is_word(tok):
+    return tok[:1].isalpha() or tok[:1] == "_"
+
+
+def _is_atom(tok):
+    return _is_word(tok) or _is_num(tok)
+
+
+class _Parser:
+    def __init__(self, query):
+        self.query = query
+        tokens = _TOKEN.findall(query)
+        if "/" in query:
+            tokens = [t for t in tokens if not t.startswith(("/*", "//"))]
+        tokens.append("")
+        self.tokens = tokens
+        self.i = 0
+
+    def position(self):
+        # Only worked out for error messages
+        i = self.i
+        for m in _TOKEN.finditer(self.query):
+            if m.group(1).startswith(("/*", "//")):
+                continue
+            if not i:
+                return m.start(1)
+            i -= 1
+        return len(self.query)
+
+    def error(self, expected):
+        tok = self.tokens[self.i]
+        found = f'''"{tok}"''' if tok else "end of query"
+        return ParseError(f'''Expected {expected} at position {self.position()}, found {found}''')
+
+    def accept(self, text):
+        if self.tokens[self.i] == text:
+            self.i += 1
+            return True
+        return False
+
+    def expect(self, text):
+        if self.tokens[self.i] != text:
+            raise self.error(f'''"{text}"''')
+        self.i += 1
+
+    def take(self, test, expected):
+        tok = self.tokens[self.i]
+        if not test(tok):
+            raise self.error(expected)
+        self.i += 1
+        return tok
+
+    def number(self, cast=float):
+        tok = self.take(_is_num, "a number")
+        try:
+            return cast(tok)
+        except ValueError:
+            self.i -= 1
+            raise self.error("an integer") from None
+
+    def string(self):
+        return _unquote(self.take(_is_str, "a quoted string"))
+
+    def raw(self, start):
+        # Canonical text of the tokens from start, for clauses kept as a UserFilter
+        parts = list()
+        prev = False
+        for tok in self.tokens[start:self.i]:
+            atom = _is_atom(tok)
+            if _is_str(tok):
+                tok = quote(_unquote(tok))
+            elif tok[0] == "(":
+                tok = "".join(tok.split())
+            elif atom and prev:
+                parts.append(" ")
+            parts.append(tok)
+            prev = atom
+        return "".join(parts)
+
+    def skip_group(self, close):
+        opening = self.tokens[self.i]
+        depth = 0
+        while True:
+            tok = self.tokens[self.i]
+            if not tok:
+                raise self.error(f'''"{close}"''')
+            self.i += 1
+            if tok == opening:
+                depth += 1
+            elif tok == close:
+                depth -= 1
+                if not depth:
+                    return
+
+    def settings(self):
+        found = dict()
+        if self.tokens[self.i] != "[":
+            return found
+        while self.accept("["):
+            name = self.take(_is_word, "a setting")
+            self.expect(":")
+            if name == "out":
+                if self.tokens[self.i] not in ("json", "xml"):
+                    raise self.error('''"json" or "xml"''')
+                found["payload_format"] = self.tokens[self.i]
+                self.i += 1
+            elif name in ("timeout", "maxsize"):
+                found[name] = self.number(int)
+            elif name == "bbox":
+                found["bbox"] = self.numbers(4)
+            elif name == "date":
+                found["date"] = _utc(self.date())
+            elif name in ("diff", "adiff"):
+                dates = [self.string()]
+                if self.accept(","):
+                    dates.append(self.string())
+                found[name] = dates[0] if len(dates) == 1 else tuple(dates)
+            else:
+                self.i -= 2
+                raise self.error("a supported setting")
+            self.expect("]")
+        self.expect(";")
+        return found
+
+    def date(self):
+        if _is_str(self.tokens[self.i]):
+            return self.string()
+        # QuerySettings writes the date unquoted
+        start = self.i
+        while self.tokens[self.i] not in ("]", ""):
+            self.i += 1
+        return "".join(self.tokens[start:self.i])
+
+    def numbers(self, n):
+        values = [self.number()]
+        for _ in range(n - 1):
+            self.expect(",")
+            values.append(self.number())
+        return tuple(values)
+
+    def set_name(self):
+        if not self.accept("->"):
+            return None
+        self.expect(".")
+        return self.take(_is_word, "a set name")
+
+    def statement(self):
+        if self.accept("("):
+            first = self.block_statement()
+            if self.accept("-"):
+                second = self.block_statement()
+                self.expect(")")
+                return DifferenceQuerySet([first, second])
+            members = [first]
+            while not self.accept(")"):
+                members.append(self.block_statement())
+            return UnionQuerySet(members)
+        levels = _ELEMENTS.get(self.tokens[self.i])
+        if levels is None:
+            raise self.error("a statement")
+        self.i += 1
+        if self.tokens[self.i] == ".":
+            raise self.error("filters; input sets are not supported")
+        filters = list()
+        while True:
+            tok = self.tokens[self.i]
+            if tok == "[":
+                f = self.tag_filter(filters)
+            elif tok == "(":
+                start = self.i
+                self.skip_group(")")
+                f = UserFilter(self.raw(start))
+            elif tok[:1] == "(":
+                self.i += 1
+                f = self.clause(tok)
+            else:
+                break
+            if f is not None:
+                filters.append(f)
+        return element_query_factory(levels)(filters=filters)
+
+    def block_statement(self):
+        stmt = self.statement()
+        if self.tokens[self.i] == "->":
+            raise self.error('''";"; named sets inside a block are not supported''')
+        self.expect(";")
+        return stmt
+
+    @staticmethod
+    def clause(tok):
+        if "id" not in tok and tok.count(",") == 3:
+            return BboxFilter(float(n) for n in _NUMBER.findall(tok))
+        return IdFilter([int(n) for n in _DIGITS.findall(tok)])
+
+    def key(self):
+        tok = self.tokens[self.i]
+        if _is_str(tok):
+            self.i += 1
+            key = _unquote(tok)
+            return key, bool(_PLAIN_KEY.match(key))
+        key = self.take(_is_atom, "a key")
+        # Unquoted keys such as addr:street, the way TagFilter writes them
+        while self.tokens[self.i] == ":" and _is_atom(self.tokens[self.i + 1]):
+            key = f'''{key}:{self.tokens[self.i + 1]}'''
+            self.i += 2
+        return key, True
+
+    def value(self):
+        if _is_str(self.tokens[self.i]):
+            return self.string()
+        return self.take(_is_atom, "a value")
+
+    def tag_filter(self, filters):
+        start = self.i
+        self.i += 1
+        if self.tokens[self.i] == "~":
+            self.i = start
+            self.skip_group("]")
+            return UserFilter(self.raw(start))
+        negated = self.accept("!")
+        key, plain = self.key()
+        if negated or self.tokens[self.i] == "]":
+            self.expect("]")
+            if not plain:
+                return UserFilter(self.raw(start))
+            return TagFilter(f'''!{key}''' if negated else key)
+        op = self.tokens[self.i]
+        if op not in ("=", "!=", "~", "!~"):
+            raise self.error("a tag operator")
+        self.i += 1
+        value = self.value()
+        flagged = self.accept(",")
+        if flagged:
+            self.take(_is_word, "a regex flag")
+        self.expect("]")
+        values = [value]
+        if op in ("~", "!~"):
+            values = None if flagged else literal_values(value)
+        if not plain or not values or not all(values):
+            return UserFilter(self.raw(start))
+        vals = values[0] if len(values) == 1 else values
+        if op in ("=", "~"):
+            return TagFilter(key, vals)
+        # TagFilter's exclusions also require the key, so they fold into a preceding [key]
+        for i, f in enumerate(filters):
+            if isinstance(f, TagFilter) and f.key.exists and f.key.key == key and not f.values:
+                filters[i] = TagFilter(key, vals, exists=False)
+                return None
+        return UserFilter(self.raw(start))
+
+    def output(self):
+        self.expect("out")
+        formatter = OutputFormatter()
+        modes = list()
+        while not self.accept(";"):
+            tok = self.tokens[self.i]
+            if tok.isdigit() and int(tok):
+                formatter.ResultLimit = int(tok)
+            elif not _is_word(tok):
+                raise self.error('''an output mode or ";"''')
+            elif tok in _VERBOSITY:
+                formatter.VERBOSITY = _VERBOSITY[tok]
+            elif tok == "tags":
+                formatter.IncludeTags = True
+            elif tok in _GEOMETRY:
+                formatter.GEOMETRY = _GEOMETRY[tok]
+            elif tok in _SORTORDER:
+                formatter.SORTORDER = _SORTORDER[tok]
+            elif tok != "count":
+                raise self.error("an output mode")
+            modes.append(tok)
+            self.i += 1
+        if "count" in modes:
+            if modes != ["count"]:
+                raise ParseError("out count takes no other modes")
+            return CountFormatter()
+        return formatter
+
+    def parse(self, qb):
+        for name, value in self.settings().items():
+            setattr(qb.settings, name, value)
+        recurse = False
+        while self.tokens[self.i] != "out":
+            if self.tokens[self.i:self.i + len(_RECURSE)] == _RECURSE:
+                self.i += len(_RECURSE)
+                recurse = True
+                break
+            stmt = self.statement()
+            name = self.set_name()
+            self.expect(";")
+            qb.qsx.append(stmt, name=name)
+        if not qb.qsx.qc or isinstance(qb.qsx.qc[-1], str):
+            raise self.error("a statement writing to the default set")
+        qb.output_mode = self.output()
+        if self.tokens[self.i]:
+            raise self.error("end of query; only one out statement is supported")
+        # Recurse exactly as the query says, never by the builder's own rule
+        qb.auto_recourse_down = False
+        qb.recurse_down = recurse
+        return qb
+
+
+def parse(query, qb=None):
+    # Fills qb, or a new QueryBuilder without basic_optimize, from an OverpassQL string.
+    # Settings the query states replace the builder's; its statements are appended.
+    if qb is None:
+        qb = QueryBuilder(basic_optimize=False)
+    return _Parser(query).parse(qb)
+
+
+def _filter_order(f):
+    # repr is memoized on the filter and needed for the output anyway
+    return (_FILTER_ORDER.get(type(f), len(_FILTER_ORDER)), repr(f))
+
+
+def _canonical_filter(f):
+    # A value list matches any of its values, so it is a set as well
+    if isinstance(f, TagFilter) and f.values and isinstance(f.values, tuple):
+        values = sorted(set(f.values))
+        return TagFilter(f.key.key, values[0] if len(values) == 1 else values, exists=f.exists)
+    return f
+
+
+def _canonical_filters(filters):
+    # Filters formatting the same are the same filter, so the sort key also drops repeats
+    keyed = dict()
+    for f in filters:
+        f = _canonical_filter(f)
+        keyed[_filter_order(f)] = f
+    # [k] is implied by any [k=v], [k~...] or [k][k!=v] on the same key
+    valued = {f.key.key for f in keyed.values() if isinstance(f, TagFilter) and f.key.exists and f.values}
+    return [f for f in (keyed[k] for k in sorted(keyed))
+            if not (isinstance(f, TagFilter) and f.key.exists and not f.values and f.key.key in valued)]
+
+
+def canonical_statement(stmt):
+    # Filters AND together and union members are a set, so neither order nor repeats matter
+    if isinstance(stmt, DifferenceQuerySet):
+        return DifferenceQuerySet([canonical_statement(stmt.minued), canonical_statement(stmt.subtrahend)])
+    if isinstance(stmt, UnionQuerySet):
+        members = {repr(s): s for s in (canonical_statement(s) for s in stmt)}
+        return UnionQuerySet([members[k] for k in sorted(members)])
+    if isinstance(stmt, GenericElementQuery):
+        filters = _canonical_filters(stmt.filters)
+        if filters == stmt.filters.filters:
+            return stmt
+        return type(stmt)(filters=filters)
+    return stmt
+
+
+@functools.lru_cache(maxsize=CANONICAL_CACHE_SIZE)
+def canonicalize(query):
+    # One string for queries differing only in whitespace, quoting, clause order or repeated filters.
+    # Works on the parsed tree alone: the optimizer is slower and rejects contradictions
+    qb = parse(query)
+    qsx = qb.qsx
+    for name in qsx.r:
+        qsx.r[name] = canonical_statement(qsx.r[name])
+    qsx.qc = [item if isinstance(item, str) else canonical_statement(item) for item in qsx.qc]
+    return qb.raw_query_string
@@ -1,14 +1,29 @@
 from enum import Enum
 from collections import OrderedDict, defaultdict
 import functools
-import csv
+import copy
 
 from .grammar import Node, Way, Relation, GenericElementQuery, CompoundQuery
 from .settings import QuerySettings
 from .filters import BboxFilter, TagFilter, IdFilter, UserFilter
 from .formats import OutputFormatter, fmt
-
-import requests
+from .elements import ElementStream, ParsedStream, CHUNK_SIZE
+from .instrument import InstrumentedStream
+from .columnar import ElementTable
+from .geometry import assemble_ways
+from .spill import request_spill
+from .evaluate import select_builder
+from .diff import refresh
+from .cost import CostModel, CostHistory, default_history_path, request_auto
+from .export import export, DEFAULT_BATCH_SIZE
+from .cache import ResponseCache, cache_key
+from .singleflight import SharedResponse
+from .transport import default_transport, client_timeout
+from . import aio
+from .optimize import optimize_register
+from .tiling import grid_tiles, quadtiles, quadtile_index, request_tiles, request_adaptive
+from .tiling import DEFAULT_MAX_WORKERS, QUADTILE_MAX_ZOOM, MIN_TILE_SIZE
+from .bulk import id_batches, request_batches, ELEMENT_LEVELS, MAX_IDS_PER_QUERY, MAX_QUERY_LENGTH
 
 
 __all__ = ["NodeQuery",
@@ -26,37 +41,44 @@ def reduce_union_or(querylist):
 
 
 class NodeQuery(GenericElementQuery):
+    __slots__ = ()
     _element = Node
 
 
 class WayQuery(GenericElementQuery):
+    __slots__ = ()
     _element = Way
 
 
 class RelationQuery(GenericElementQuery):
+    __slots__ = ()
     _element = Relation
 
 
 class NodeWayQuery(CompoundQuery):
+    __slots__ = ()
     _elements = (Node, Way)
 
 
 class NodeRelationQuery(CompoundQuery):
+    __slots__ = ()
     _elements = (Node, Relation)
 
 
 class WayRelationQuery(CompoundQuery):
+    __slots__ = ()
     _elements = (Way, Relation)
 
 
 class NodeWayRelationQuery(CompoundQuery):
+    __slots__ = ()
     _elements = (Node, Way, Relation)
 
 
 query_index_lut = dict()
 query_index_lut[( (Node._level,) )] = NodeQuery
 query_index_lut[( (Way._level,) )] = WayQuery
-query_index_lut[( (Relation._level) )] = RelationQuery
+query_index_lut[( (Relation._level,) )] = RelationQuery
 query_index_lut[( (Node._level, Way._level) )] = NodeWayQuery
 query_index_lut[( (Node._level, Relation._level) )] = NodeRelationQuery
 query_index_lut[( (Way._level, Relation._level) )] = WayRelationQuery
@@ -105,38 +127,55 @@ class QueryRegister:
         _ = reversed(self.qc)
         while True:
             item = next(_)
-            if item not in self.r.keys():
+            # Named statements are registered by their name
+            if not isinstance(item, str):
                 return item
 
     @property
     def output(self):
         return self._dset._output
 
+    def _fmt_item(self, item):
+        if isinstance(item, str):
+            return f'''{repr(self.r[item])[:-1]}->.{item};'''
+        return repr(item)
+
     def __repr__(self):
-        s =  f'''{"".join(repr(qs) for qs in self.qc)}'''
-        if self.qb.auto_recourse_down and self.output != Node:
-            if self.qb.output_mode.VERBOSITY is (fmt.Verbosity.CONCISE or fmt.Verbosity.GENERIC):
-                if self.qb.output_mode.GEOMETRY is None:
-                    s += "(._;>;);"
+        s =  f'''{"".join(self._fmt_item(qs) for qs in self.qc)}'''
+        if self.qb._recurse_down(self.output):
+            s += "(._;>;);"
         return s
 
 
 
 class QueryBuilder:
     overpass_endpoint = 'http://overpass-api.de/api/interpreter'
+    transport = None
+    endpoints = None
+    scheduler = None
+    cache = None
+    singleflight = None
+    instruments = None
+    tile_history = None
+    cost_model = None
 
     def __init__(self,
                  name="default",
                  basic_optimize=True,
                  auto_recourse=True,
+                 optimize_queries=False,
                  **kwargs):
         self.name = name
+        self.basic_optimize = basic_optimize
+        # Rewriting the statements changes the compiled query, so it is asked for explicitly
+        self.optimize_queries = optimize_queries
         self.settings = QuerySettings(**kwargs)
         self.output_mode = OutputFormatter()
         self.qsx = QueryRegister(self)
         if basic_optimize:
             self.output_mode.SORTORDER = fmt.SortOrder.QUADTILE
         self.auto_recourse_down = auto_recourse
+        self.recurse_down = False
 
     @property
     def GlobalBoundingBox(self):
@@ -146,6 +185,16 @@ class QueryBuilder:
     def GlobalBoundingBox(self, bbox):
         self.settings.bbox = bbox
 
+    def _recurse_down(self, output):
+        if self.recurse_down:
+            # Stated outright, as by a parsed query
+            return True
+        if self.auto_recourse_down and output != Node:
+            if self.output_mode.VERBOSITY is (fmt.Verbosity.CONCISE or fmt.Verbosity.GENERIC):
+                if self.output_mode.GEOMETRY is None:
+                    return True
+        return False
+
     def include_geometries(self):
         self.output_mode.GEOMETRY = fmt.Geometry.FULL_GEOM
 
@@ -155,18 +204,189 @@ class QueryBuilder:
     def include_centerpoints(self):
         self.output_mode.GEOMETRY = fmt.Geometry.CENTER_POINT
 
+    def optimize(self):
+        return optimize_register(self.settings, self.qsx)
+
     @property
     def raw_query_string(self):
-        return f'''{self.settings}{self.qsx}{self.output_mode}'''
+        settings, qsx = self.settings, self.qsx
+        if self.optimize_queries and qsx.qc:
+            settings, qsx = self.optimize()
+        return f'''{settings}{qsx}{self.output_mode}'''
 
     @classmethod
     def from_query(cls, query, *args, **kwargs):
-        inst = cls(*args, **kwargs)
-        cls._query = query
-
-    def request(self):
-        return requests.get(self.overpass_endpoint, data=self.raw_query_string)
-
-
-
-
+        from .parser import parse
+        return parse(query, cls(*args, **kwargs))
+
+    def _observed(self):
+        hub = self.instruments
+        return hub is not None and hub.active
+
+    def _compile(self):
+        if not self._observed():
+            return self.raw_query_string
+        with self.instruments.span("compile", endpoint=self.overpass_endpoint):
+            return self.raw_query_string
+
+    def _send(self, query, stream=False):
+        transport = self.transport or default_transport()
+
+        def send():
+            if self.endpoints is not None:
+                return self.endpoints.post(query, stream=stream, timeout=client_timeout(self.settings))
+            return transport.post(self.overpass_endpoint, query, stream=stream,
+                                  timeout=client_timeout(self.settings))
+
+        if self._observed():
+            send = self.instruments.wrap_send(send, self.overpass_endpoint, stream=stream,
+                                              queued=self.scheduler is not None)
+        if self.scheduler is None:
+            return send()
+        return self.scheduler.submit(send, stream=stream)
+
+    def request(self, stream=False):
+        query = self._compile()
+        if self.singleflight is not None:
+            # Coalesced callers share one fully read body, so the response is never streamed
+            key = cache_key(query, self.overpass_endpoint)
+            return self.singleflight.fetch(key, lambda: self._request(query))
+        return self._request(query, stream=stream)
+
+    def _request(self, query, stream=False):
+        if self.cache is None:
+            return self._send(query, stream=stream)
+        # A dated query reads an immutable snapshot, so it never goes stale
+        ttl = ResponseCache.FOREVER if self.settings.date is not None else self.cache.ttl
+        key = cache_key(query, self.overpass_endpoint)
+        return self.cache.fetch(key, lambda stream: self._send(query, stream=stream), stream=stream, ttl=ttl)
+
+    async def arequest(self, session=None, timeout=None):
+        return await aio.arequest(self, session=session, timeout=timeout)
+
+    def iter_elements(self, chunk_size=CHUNK_SIZE):
+        response = self.request(stream=True)
+        response.raise_for_status()
+        if isinstance(response, SharedResponse):
+            # Callers of a coalesced request parse its body once between them
+            return response.shared("elements", lambda: ParsedStream.read(self._element_stream(response, chunk_size)))
+        return self._element_stream(response, chunk_size)
+
+    def _element_stream(self, response, chunk_size):
+        if self._observed():
+            return InstrumentedStream(self.instruments, response.iter_content(chunk_size),
+                                      payload_format=self.settings.payload_format, close=response.close,
+                                      endpoint=getattr(response, "url", None) or self.overpass_endpoint,
+                                      status=response.status_code,
+                                      # Cached and coalesced bodies were already read, or never sent
+                                      live=hasattr(response, "raw"))
+        return ElementStream(response.iter_content(chunk_size),
+                             payload_format=self.settings.payload_format,
+                             close=response.close)
+
+    def request_table(self, chunk_size=CHUNK_SIZE, assemble=False):
+        stream = self.iter_elements(chunk_size=chunk_size)
+        if isinstance(stream, ParsedStream):
+            # Coalesced callers share one parsed stream, and with it one table
+            table = stream.shared("table", lambda: ElementTable.from_stream(stream))
+        else:
+            table = ElementTable.from_stream(stream)
+        if assemble:
+            # Way coordinates come from the recursed node set rather than "out geom"
+            table = assemble_ways(table)
+        return table
+
+    def request_spill(self, path, chunk_size=CHUNK_SIZE):
+        # Like request_table, but the columns are written under path and memory-mapped back
+        return request_spill(self, path, chunk_size=chunk_size)
+
+    def diff_query(self, since, until=None, augmented=True):
+        query = copy.copy(self)
+        query.settings = copy.copy(self.settings)
+        # Overpass only prints diffs as XML
+        query.settings.payload_format = "xml"
+        dates = since if until is None else (since, until)
+        query.settings.diff = query.settings.adiff = None
+        if augmented:
+            query.settings.adiff = dates
+        else:
+            query.settings.diff = dates
+        query.qsx = copy.copy(self.qsx)
+        query.qsx.qb = query
+        return query
+
+    def refresh(self, store, augmented=True, chunk_size=CHUNK_SIZE):
+        return refresh(self, store, augmented=augmented, chunk_size=chunk_size)
+
+    def select(self, elements, name=None):
+        return select_builder(elements, self, name=name)
+
+    def export(self, writer, batch_size=DEFAULT_BATCH_SIZE, chunk_size=CHUNK_SIZE):
+        return export(self.iter_elements(chunk_size=chunk_size), writer, batch_size=batch_size)
+
+    def tile(self, bbox):
+        tiled = copy.copy(self)
+        tiled.settings = copy.copy(self.settings)
+        tiled.settings.bbox = bbox
+        tiled.qsx = copy.copy(self.qsx)
+        tiled.qsx.qb = tiled
+        return tiled
+
+    def tiles(self, rows=None, cols=None, zoom=None):
+        if self.GlobalBoundingBox is None:
+            raise ValueError("Tiled requests require a GlobalBoundingBox")
+        if zoom is not None:
+            return quadtiles(self.GlobalBoundingBox, zoom)
+        if rows is None or cols is None:
+            raise ValueError("Specify either a quadtile zoom or grid rows and cols")
+        tiles = grid_tiles(self.GlobalBoundingBox, rows, cols)
+        if self.output_mode.SORTORDER is fmt.SortOrder.QUADTILE:
+            tiles.sort(key=lambda t: quadtile_index(t[0], t[1], QUADTILE_MAX_ZOOM))
+        return tiles
+
+    def request_tiled(self, rows=None, cols=None, zoom=None, max_workers=DEFAULT_MAX_WORKERS):
+        return request_tiles(self, self.tiles(rows=rows, cols=cols, zoom=zoom), max_workers=max_workers)
+
+    def request_adaptive(self, min_size=MIN_TILE_SIZE, max_workers=DEFAULT_MAX_WORKERS, history=None):
+        if self.GlobalBoundingBox is None:
+            raise ValueError("Adaptive requests require a GlobalBoundingBox")
+        return request_adaptive(self, self.GlobalBoundingBox, min_size=min_size, max_workers=max_workers,
+                                history=history if history is not None else self.tile_history)
+
+    def _cost_model(self, model):
+        if model is not None:
+            return model
+        if self.cost_model is None:
+            # Calibration carries over between runs, kept beside the response cache if there is one
+            self.cost_model = CostModel(history=CostHistory.shared(default_history_path(self.cache)))
+        return self.cost_model
+
+    def estimate(self, model=None, probe=False):
+        model = self._cost_model(model)
+        return model.estimate(self, counts=model.probe(self) if probe else None)
+
+    def tune(self, model=None, probe=False):
+        return self._cost_model(model).tune(self, probe=probe)
+
+    def request_auto(self, model=None, probe=False, max_workers=DEFAULT_MAX_WORKERS):
+        return request_auto(self, self._cost_model(model), probe=probe, max_workers=max_workers)
+
+    def id_batch(self, element_type, osm_ids):
+        batch = copy.copy(self)
+        batch.settings = copy.copy(self.settings)
+        batch.qsx = QueryRegister(batch)
+        query = element_query_factory((ELEMENT_LEVELS[element_type],))
+        batch.qsx.append(query(filters=IdFilter(osm_ids)))
+        return batch
+
+    def id_batches(self, ids, max_ids=MAX_IDS_PER_QUERY, max_length=MAX_QUERY_LENGTH):
+        # Settings, output clause and statement boilerplate count against the query length
+        overhead = len(self.id_batch("relation", ()).raw_query_string)
+        batches = id_batches(ids, maxsize=self.settings.maxsize, max_ids=max_ids,
+                             max_length=max_length, overhead=overhead)
+        return [self.id_batch(element_type, chunk) for element_type, chunk in batches]
+
+    def request_ids(self, ids, max_ids=MAX_IDS_PER_QUERY, max_length=MAX_QUERY_LENGTH,
+                    max_workers=DEFAULT_MAX_WORKERS):
+        batches = self.id_batches(ids, max_ids=max_ids, max_length=max_length)
+        return request_batches(batches, max_workers=max_workers)
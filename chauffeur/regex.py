@@ -0,0 +1,140 @@
+import re
+
+
+TRIE_THRESHOLD = 16 # Value lists at least this long are trie compressed
+MAX_REGEX_LENGTH = 4096 # Longer regexes are split across several clauses
+
+_METACHARS = frozenset(".^$*+?()[]{}|\\")
+_CLASS_SAFE = re.compile(r"^[A-Za-z0-9_]$")
+_END = ""
+_LEAF = {_END: True}
+
+
+def escape(value):
+    return "".join("\\" + c if c in _METACHARS else c for c in value)
+
+
+def quote(s):
+    # OverpassQL string literal; backslashes in the regex must survive unescaping
+    s = s.replace("\\", "\\\\").replace('"', '\\"')
+    return f'''"{s}"'''
+
+
+def unquote(s):
+    s = s[1:-1]
+    return re.sub(r"\\(.)", r"\1", s)
+
+
+def _build_trie(values):
+    root = dict()
+    for value in values:
+        node = root
+        for c in value:
+            node = node.setdefault(c, dict())
+        node[_END] = True
+    return root
+
+
+def _is_atom(s):
+    # Only single bytes and classes take a bare quantifier, whatever the server's locale
+    if _CLASS_SAFE.match(s) or (len(s) == 2 and s[0] == "\\"):
+        return True
+    return s.startswith("[") and s.endswith("]") and "]" not in s[1:-1]
+
+
+def _char_class(chars):
+    # chars are sorted single ASCII word characters; runs collapse to ranges
+    parts = list()
+    start = prev = chars[0]
+    for c in chars[1:] + [None]:
+        if c is not None and ord(c) == ord(prev) + 1 and c.isalnum() == prev.isalnum():
+            prev = c
+            continue
+        if ord(prev) - ord(start) >= 2:
+            parts.append(f'''{start}-{prev}''')
+        else:
+            parts.append("".join(chr(o) for o in range(ord(start), ord(prev) + 1)))
+        start = prev = c
+    return f'''[{"".join(parts)}]'''
+
+
+def _emit_node(node, emitted):
+    terminal = _END in node
+    alts = list()
+    leaves = list()
+    for c in sorted(k for k in node if k != _END):
+        child = node[c]
+        if len(child) == 1 and _END in child and _CLASS_SAFE.match(c):
+            leaves.append(c)
+        else:
+            alts.append(escape(c) + emitted.pop(id(child), ""))
+    if len(leaves) == 1:
+        alts.append(leaves[0])
+    elif leaves:
+        alts.append(_char_class(leaves))
+    if not alts:
+        return ""
+    if len(alts) == 1:
+        body = alts[0]
+        if not terminal:
+            return body
+        if _is_atom(body):
+            return body + "?"
+        return f'''({body})?'''
+    body = f'''({"|".join(alts)})'''
+    return body + "?" if terminal else body
+
+
+def _collapse(node):
+    # Chains of single, non-terminal children become one literal run, so a long value is one edge
+    for c in [k for k in node if k != _END]:
+        run, child = c, node[c]
+        while _END not in child and len(child) == 1:
+            (k, child), = child.items()
+            run += k
+        if run != c:
+            del node[c]
+            node[run] = child
+
+
+def _emit(root):
+    # Post-order with an explicit stack; nested prefixes would otherwise recurse once per value
+    emitted = dict()
+    stack = [(root, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if expanded:
+            emitted[id(node)] = _emit_node(node, emitted)
+            continue
+        _collapse(node)
+        stack.append((node, True))
+        # Leaves emit nothing, so they are never visited
+        stack.extend((child, False) for k, child in node.items() if k != _END and child != _LEAF)
+    return emitted[id(root)]
+
+
+def trie_regex(values):
+    return f'''^{_emit(_build_trie(values))}$'''
+
+
+def alternation_regex(values):
+    return f'''^({"|".join(escape(v) for v in values)})$'''
+
+
+def split_values(values, max_length=MAX_REGEX_LENGTH):
+    values = list(dict.fromkeys(values))
+    if len(values) < TRIE_THRESHOLD:
+        return [(values, alternation_regex(values))]
+    return _split(sorted(values), max_length)
+
+
+def _split(values, max_length):
+    regex = trie_regex(values)
+    if len(regex) <= max_length or len(values) == 1:
+        return [(values, regex)]
+    mid = len(values) // 2
+    return _split(values[:mid], max_length) + _split(values[mid:], max_length)
+
+
+def compile_values(values, max_length=MAX_REGEX_LENGTH):
+    return [regex for _, regex in split_values(values, max_length)]
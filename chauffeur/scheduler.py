@@ -0,0 +1,261 @@
+import re
+import time
+import random
+import asyncio
+import threading
+
+from .transport import default_transport
+
+
+RETRY_STATUS_CODES = (429, 503, 504)
+
+_RATE_LIMIT = re.compile(r"Rate limit:\s*(\d+)")
+_SLOTS_AVAILABLE = re.compile(r"(\d+)\s+slots? available now")
+_SLOT_COOLDOWN = re.compile(r"Slot available after:.*?in\s+(-?\d+)\s+seconds?")
+
+
+def status_url_for(endpoint):
+    base, _, last = endpoint.rstrip("/").rpartition("/")
+    if last == "interpreter":
+        return f'''{base}/status'''
+    return f'''{endpoint.rstrip("/")}/status'''
+
+
+class ServerStatus:
+    def __init__(self, rate_limit=0, available=0, cooldowns=()):
+        self.rate_limit = rate_limit
+        self.available = available
+        self.cooldowns = sorted(cooldowns)
+
+    @classmethod
+    def parse(cls, text):
+        m = _RATE_LIMIT.search(text)
+        rate_limit = int(m.group(1)) if m else 0
+        m = _SLOTS_AVAILABLE.search(text)
+        available = int(m.group(1)) if m else 0
+        cooldowns = [max(int(c), 0) for c in _SLOT_COOLDOWN.findall(text)]
+        if rate_limit and not m and not cooldowns:
+            available = rate_limit
+        return cls(rate_limit=rate_limit, available=available, cooldowns=cooldowns)
+
+    @property
+    def unlimited(self):
+        return self.rate_limit == 0
+
+    @property
+    def next_slot(self):
+        if self.available or not self.cooldowns:
+            return 0
+        return self.cooldowns[0]
+
+
+class SlotScheduler:
+    def __init__(self,
+                 status_url,
+                 transport=None,
+                 max_retries=5,
+                 backoff_base=1.0,
+                 backoff_max=60.0,
+                 poll_interval=1.0,
+                 fallback_concurrency=2,
+                 clock=time.monotonic,
+                 sleep=time.sleep):
+        self.status_url = status_url
+        self.transport = transport
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.poll_interval = poll_interval
+        self.fallback_concurrency = fallback_concurrency
+        self._clock = clock
+        self._sleep = sleep
+        self._cond = threading.Condition()
+        self._slots = None
+        self._delay = 0
+        self._refreshing = False
+        self._waiting = 0
+        self._in_flight = 0
+        self._requests = 0
+        self._retries = 0
+        self._wait_count = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    @classmethod
+    def for_endpoint(cls, endpoint, **kwargs):
+        return cls(status_url_for(endpoint), **kwargs)
+
+    def fetch_status(self):
+        transport = self.transport or default_transport()
+        try:
+            response = transport.session.get(self.status_url, timeout=self.poll_interval * 10)
+            response.raise_for_status()
+        except Exception:
+            # Without a status page, fall back to a fixed number of slots
+            return ServerStatus(rate_limit=self.fallback_concurrency,
+                                available=max(self.fallback_concurrency - self._in_flight, 0))
+        return ServerStatus.parse(response.text)
+
+    def _refresh(self):
+        status = self.fetch_status()
+        with self._cond:
+            if status.unlimited:
+                self._slots = float("inf")
+            else:
+                # Our own requests may not show up in the status page yet
+                self._slots = max(min(status.available, status.rate_limit - self._in_flight), 0)
+            if self._slots:
+                self._delay = 0
+            else:
+                # Wait out the announced cooldown, or poll if none was given
+                self._delay = status.next_slot or self.poll_interval
+            self._refreshing = False
+            self._cond.notify_all()
+        return status
+
+    def acquire(self):
+        start = self._clock()
+        with self._cond:
+            self._waiting += 1
+        try:
+            while True:
+                with self._cond:
+                    if self._slots:
+                        self._slots -= 1
+                        self._in_flight += 1
+                        break
+                    if self._refreshing:
+                        self._cond.wait(self.poll_interval)
+                        continue
+                    self._refreshing = True
+                    delay = self._delay
+                if delay:
+                    self._sleep(delay)
+                self._refresh()
+        finally:
+            with self._cond:
+                self._waiting -= 1
+        waited = self._clock() - start
+        with self._cond:
+            self._wait_count += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        return waited
+
+    def release(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def backoff(self, attempt):
+        # Full jitter keeps parallel clients from retrying in lockstep
+        cap = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return random.uniform(0, cap)
+
+    def _hold(self, response):
+        # A streamed body is still downloading when send returns, so the slot is only given back once
+        # the body has been read to the end or the response is closed
+        held = [True]
+
+        def release():
+            with self._cond:
+                if not held[0]:
+                    return
+                held[0] = False
+            self.release()
+
+        close, iter_content = response.close, response.iter_content
+
+        def closing():
+            try:
+                close()
+            finally:
+                release()
+
+        def releasing(*args, **kwargs):
+            try:
+                yield from iter_content(*args, **kwargs)
+            finally:
+                release()
+
+        response.close = closing
+        response.iter_content = releasing
+        return response
+
+    def submit(self, send, stream=False):
+        attempt = 0
+        while True:
+            self.acquire()
+            try:
+                response = send()
+            except BaseException:
+                self.release()
+                raise
+            with self._cond:
+                self._requests += 1
+            if response.status_code not in RETRY_STATUS_CODES or attempt >= self.max_retries:
+                # Error bodies are short and often dropped unread, so only a good streamed body keeps the slot
+                if stream and response.ok:
+                    return self._hold(response)
+                self.release()
+                return response
+            response.close()
+            self.release()
+            with self._cond:
+                self._retries += 1
+                # The server rejected the slot, so the cached count is stale
+                self._slots = 0
+                self._delay = 0
+            self._sleep(self.backoff(attempt))
+            attempt += 1
+
+    async def _aacquire(self):
+        # acquire blocks on the status page and on cooldowns, so it waits off the event loop
+        future = asyncio.get_running_loop().run_in_executor(None, self.acquire)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # The thread still takes the slot once one frees up, so hand it straight back
+            def give_back(f):
+                if not f.cancelled() and f.exception() is None:
+                    self.release()
+
+            future.add_done_callback(give_back)
+            raise
+
+    async def asubmit(self, send):
+        # The asyncio counterpart of submit; async bodies are read in full, so the slot is given back at once
+        attempt = 0
+        while True:
+            await self._aacquire()
+            try:
+                response = await send()
+            finally:
+                self.release()
+            with self._cond:
+                self._requests += 1
+            if response.status_code not in RETRY_STATUS_CODES or attempt >= self.max_retries:
+                return response
+            with self._cond:
+                self._retries += 1
+                self._slots = 0
+                self._delay = 0
+            await asyncio.sleep(self.backoff(attempt))
+            attempt += 1
+
+    @property
+    def queue_depth(self):
+        return self._waiting
+
+    def metrics(self):
+        with self._cond:
+            return {
+                "queue_depth": self._waiting,
+                "in_flight": self._in_flight,
+                "requests": self._requests,
+                "retries": self._retries,
+                "wait_count": self._wait_count,
+                "wait_time_total": self._wait_total,
+                "wait_time_max": self._wait_max,
+                "wait_time_mean": self._wait_total / self._wait_count if self._wait_count else 0.0,
+            }
@@ -46,6 +46,15 @@ class Bbox(BaseSetting, param_name="bbox"):
         return f'''{s:.8f},{w:.8f},{n:.8f},{e:.8f}'''
 
 
+def format_date(date):
+    # Accepts datetimes or ISO strings such as an osm_base timestamp
+    if isinstance(date, str):
+        date = dateparse(date)
+    if date.tzinfo is not None:
+        date = date.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return date.isoformat(timespec="seconds") + "Z"
+
+
 class Date(BaseSetting, param_name="date"):
     def __init__(self, date):
         self.date = date
@@ -55,6 +64,24 @@ class Date(BaseSetting, param_name="date"):
 
 
 
+class Diff(BaseSetting, param_name="diff"):
+    # A start date, or a (start, end) pair; the end defaults to the latest data
+    def __init__(self, diff):
+        self.diff = diff
+
+    def _fmt_param(self):
+        dates = self._alias
+        if isinstance(dates, (str, datetime.datetime)):
+            dates = (dates,)
+        return ",".join(f'''"{format_date(d)}"''' for d in dates)
+
+
+class AugmentedDiff(Diff, param_name="adiff"):
+    def __init__(self, adiff):
+        self.adiff = adiff
+
+
+
 class QuerySettings:
     DEFAULT_FORMAT = "xml"
     DEFAULT_TIMEOUT = 180
@@ -65,13 +92,19 @@ class QuerySettings:
                  timeout=None,
                  maxsize=None,
                  date=None,
-                 bbox=None):
+                 bbox=None,
+                 diff=None,
+                 adiff=None):
 
         self.payload_format = payload_format
         self.timeout = timeout
         self.maxsize = maxsize
         self.date = date
         self.bbox = bbox
+        self._diff = Diff(None)
+        self._adiff = AugmentedDiff(None)
+        self.diff = diff
+        self.adiff = adiff
 
     def __repr__(self):
         s = (
@@ -79,6 +112,8 @@ class QuerySettings:
             f'''{self._timeout}'''
             f'''{self._maxsize}'''
             f'''{self._date}'''
+            f'''{self._diff}'''
+            f'''{self._adiff}'''
             f'''{self._bbox}'''
         )
         if s != "":
@@ -125,4 +160,22 @@ class QuerySettings:
     def bbox(self, val):
         self._bbox = Bbox(val)
 
+    @property
+    def diff(self):
+        return self._diff.diff
+
+    @diff.setter
+    def diff(self, val):
+        if val is not None and self.adiff is not None:
+            raise ValueError("A query cannot be both a diff and an augmented diff")
+        self._diff = Diff(val)
 
+    @property
+    def adiff(self):
+        return self._adiff.adiff
+
+    @adiff.setter
+    def adiff(self, val):
+        if val is not None and self.diff is not None:
+            raise ValueError("A query cannot be both a diff and an augmented diff")
+        self._adiff = AugmentedDiff(val)
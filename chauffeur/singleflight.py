@@ -0,0 +1,192 @@
+import json
+import time
+import asyncio
+import threading
+
+import requests
+
+from .cache import has_remark
+
+
+class SharedResponse:
+    # A fully read response handed to every caller of a coalesced request
+    from_cache = False
+
+    def __init__(self, status_code, content, url=None, headers=None, reason=None):
+        self.status_code = status_code
+        self.content = content
+        self.url = url
+        self.headers = dict(headers or ())
+        self.reason = reason
+        self._lock = threading.Lock()
+        self._derived = dict()
+
+    @classmethod
+    def read(cls, response):
+        try:
+            return cls(response.status_code, response.content, url=getattr(response, "url", None),
+                       headers=getattr(response, "headers", None), reason=getattr(response, "reason", None))
+        finally:
+            response.close()
+
+    def shared(self, key, build):
+        # Values derived from the body, such as its parsed elements, are built once for every caller holding it
+        with self._lock:
+            if key not in self._derived:
+                self._derived[key] = build()
+            return self._derived[key]
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8")
+
+    def json(self):
+        return json.loads(self.content)
+
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+    def raise_for_status(self):
+        if 400 <= self.status_code < 600:
+            raise requests.HTTPError(f'''{self.status_code} Error: {self.reason} for url: {self.url}''',
+                                     response=self)
+
+    def close(self):
+        pass
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def _memoizable(response):
+    return response.status_code == 200 and not has_remark(response.content)
+
+
+class SingleFlight:
+    # Concurrent callers with the same key share one request; memo_ttl keeps a good result
+    # around for a few seconds after it lands, for callers arriving just too late to join
+    def __init__(self, memo_ttl=0.0, clock=time.monotonic):
+        self.memo_ttl = memo_ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._calls = dict()
+        self._tasks = dict()
+        self._memo = dict()
+        self._hits = 0
+        self._memo_hits = 0
+        self._misses = 0
+
+    def _lookup(self, key):
+        # Called with the lock held
+        entry = self._memo.get(key)
+        if entry is None:
+            return None
+        expires, response = entry
+        if expires <= self._clock():
+            del self._memo[key]
+            return None
+        self._memo_hits += 1
+        return response
+
+    def _remember(self, key, response):
+        # Called with the lock held
+        if not self.memo_ttl or not _memoizable(response):
+            return
+        now = self._clock()
+        for stale in [k for k, (expires, _) in self._memo.items() if expires <= now]:
+            del self._memo[stale]
+        self._memo[key] = (now + self.memo_ttl, response)
+
+    def fetch(self, key, send):
+        with self._lock:
+            memo = self._lookup(key)
+            if memo is not None:
+                return memo
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._misses += 1
+            else:
+                self._hits += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = SharedResponse.read(send())
+        except BaseException as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                if call.error is None:
+                    self._remember(key, call.result)
+            call.done.set()
+        return call.result
+
+    async def afetch(self, key, send):
+        # The asyncio counterpart of fetch; send is a coroutine function returning a read response.
+        # Futures belong to one event loop, so calls are only shared between tasks of the same loop
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            memo = self._lookup(key)
+            if memo is not None:
+                return memo
+            future = self._tasks.get((loop, key))
+            if future is not None:
+                self._hits += 1
+        if future is not None:
+            # A cancelled follower must not cancel the request the others wait on
+            return await asyncio.shield(future)
+        future = loop.create_future()
+        with self._lock:
+            self._tasks[loop, key] = future
+            self._misses += 1
+        try:
+            response = await send()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as exc:
+            future.set_exception(exc)
+            # Followers retrieve the exception; don't warn about it going unread otherwise
+            future.exception()
+            raise
+        else:
+            future.set_result(response)
+        finally:
+            with self._lock:
+                del self._tasks[loop, key]
+                if not future.cancelled() and future.exception() is None:
+                    self._remember(key, future.result())
+        return response
+
+    def clear(self):
+        with self._lock:
+            self._memo.clear()
+
+    @property
+    def hits(self):
+        return self._hits + self._memo_hits
+
+    @property
+    def misses(self):
+        return self._misses
+
+    def metrics(self):
+        with self._lock:
+            return {
+                "hits": self._hits,
+                "memo_hits": self._memo_hits,
+                "misses": self._misses,
+                "in_flight": len(self._calls) + len(self._tasks),
+                "memo_size": len(self._memo),
+            }
@@ -0,0 +1,167 @@
+import math
+
+from .columnar import np, _require_numpy
+from .geometry import assemble_ways
+
+
+MAX_ZOOM = 24 # Finest quadtile level the index will use, cells of about 2m
+LEAF_SIZE = 8 # Elements per finest cell the zoom is chosen for
+EARTH_RADIUS = 6371008.8 # Meters, the mean radius
+
+
+def _cells(values, origin, span, ncells):
+    # Quadtile cell column (lon) or row (lat) at a zoom with ncells per axis, as tiling.quadtile_index
+    cells = np.floor((values - origin) / span * ncells)
+    return np.clip(cells, 0, ncells - 1).astype(np.int64)
+
+
+def _bit_length(values):
+    return np.frexp(values.astype(np.float64))[1].astype(np.int64)
+
+
+def _level_offset(level):
+    # Keys of all coarser levels come first; level l has 4**l cells
+    return ((1 << (2 * level)) - 1) // 3
+
+
+def _ranges(starts, ends):
+    # Concatenated aranges of [start, end) pairs
+    lengths = ends - starts
+    keep = lengths > 0
+    starts, lengths = starts[keep], lengths[keep]
+    if not len(lengths):
+        return np.zeros(0, dtype=np.int64)
+    shifts = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return shifts + np.arange(lengths.sum())
+
+
+def extents(table):
+    # Per row (minlat, minlon, maxlat, maxlon), NaN where the row cannot match any bbox;
+    # follows how evaluate tests each element type against a BboxFilter
+    lat, lon = table.lat, table.lon
+    minlat, minlon = lat.astype(np.float64), lon.astype(np.float64)
+    maxlat, maxlon = minlat.copy(), minlon.copy()
+    other = ~table.type_mask("node")
+    if "lat" in table.nodes:
+        offsets = table.nodes.offsets - table.nodes.offsets[0]
+        counts = np.diff(offsets)
+        rows = np.flatnonzero(counts > 0)
+        bounds = [np.full(len(table), np.nan) for _ in range(4)]
+        for arr, reduce, out in ((table.nodes.entries("lat"), np.fmin, bounds[0]),
+                                 (table.nodes.entries("lon"), np.fmin, bounds[1]),
+                                 (table.nodes.entries("lat"), np.fmax, bounds[2]),
+                                 (table.nodes.entries("lon"), np.fmax, bounds[3])):
+            if len(rows):
+                out[rows] = reduce.reduceat(arr, offsets[rows])
+    elif table.has_bounds:
+        bounds = [table[b] for b in ("minlat", "minlon", "maxlat", "maxlon")]
+    else:
+        bounds = [lat, lon, lat, lon]
+    for out, bound in zip((minlat, minlon, maxlat, maxlon), bounds):
+        out[other] = bound[other]
+    return minlat, minlon, maxlat, maxlon
+
+
+class SpatialIndex:
+    # Multi-level quadtile grid: each element sits in the finest cell that holds its whole extent,
+    # and a lookup binary searches the cell rows a box covers on every level
+    def __init__(self, table, zoom=None):
+        _require_numpy()
+        if "lat" not in table.nodes and len(table.nodes.entries("ref")):
+            # Way geometry from the recursed node rows, assembled once here instead of per lookup
+            table = assemble_ways(table)
+        self.table = table
+        self.minlat, self.minlon, self.maxlat, self.maxlon = extents(table)
+        known = ~np.isnan(self.minlat) & ~np.isnan(self.minlon)
+        # A relation may also match through its members, so the index never rules one out
+        self.unindexed = np.flatnonzero(table.type_mask("relation") & (np.diff(table.members.offsets) > 0))
+        rows = np.flatnonzero(known)
+        if zoom is None:
+            zoom = self._choose_zoom(rows)
+        self.zoom = zoom
+        ncells = 1 << zoom
+        x0 = _cells(self.minlon[rows], -180.0, 360.0, ncells)
+        x1 = _cells(self.maxlon[rows], -180.0, 360.0, ncells)
+        y0 = _cells(self.minlat[rows], -90.0, 180.0, ncells)
+        y1 = _cells(self.maxlat[rows], -90.0, 180.0, ncells)
+        shift = _bit_length((x0 ^ x1) | (y0 ^ y1))
+        levels = zoom - shift
+        keys = np.array([_level_offset(level) for level in range(zoom + 1)], dtype=np.int64)[levels]
+        keys += (y0 >> shift) * (np.int64(1) << levels) + (x0 >> shift)
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        self.rows = rows[order]
+        self.levels = np.unique(levels).tolist()
+        self._yrange = (int(y0.min()), int(y1.max())) if len(rows) else (0, -1)
+
+    def _choose_zoom(self, rows):
+        if not len(rows):
+            return 0
+        dlat = (np.nanmax(self.maxlat[rows]) - np.nanmin(self.minlat[rows])) / 180.0
+        dlon = (np.nanmax(self.maxlon[rows]) - np.nanmin(self.minlon[rows])) / 360.0
+        cells = max(len(rows) / LEAF_SIZE, 1.0) / max(dlat * dlon, 4.0 ** -MAX_ZOOM)
+        return int(min(max(math.ceil(math.log(cells, 4)), 0), MAX_ZOOM))
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _lookup(self, bbox):
+        # Rows whose cell meets the box, on every occupied level
+        s, w, n, e = bbox
+        ncells = 1 << self.zoom
+        xa, xb = _cells(np.array([w, e]), -180.0, 360.0, ncells)
+        ya, yb = _cells(np.array([s, n]), -90.0, 180.0, ncells)
+        ya, yb = max(ya, self._yrange[0]), min(yb, self._yrange[1])
+        if ya > yb or s > n or w > e:
+            return np.zeros(0, dtype=np.int64)
+        found = list()
+        for level in self.levels:
+            shift = self.zoom - level
+            ys = np.arange(ya >> shift, (yb >> shift) + 1, dtype=np.int64)
+            base = _level_offset(level) + ys * (np.int64(1) << level)
+            starts = np.searchsorted(self.keys, base + (xa >> shift), side="left")
+            ends = np.searchsorted(self.keys, base + (xb >> shift), side="right")
+            found.append(self.rows[_ranges(starts, ends)])
+        return np.concatenate(found)
+
+    def query_bbox(self, bbox):
+        # Sorted row indices of the elements whose extent intersects bbox
+        s, w, n, e = bbox
+        rows = self._lookup(bbox)
+        hit = ((self.minlat[rows] <= n) & (self.maxlat[rows] >= s)
+               & (self.minlon[rows] <= e) & (self.maxlon[rows] >= w))
+        return np.sort(rows[hit])
+
+    def candidates(self, bbox):
+        # query_bbox plus the rows the index cannot rule out; a superset of what BboxFilter selects
+        return np.union1d(self.query_bbox(bbox), self.unindexed)
+
+    def query_radius(self, lat, lon, radius):
+        # Sorted row indices of the elements whose extent comes within radius meters of (lat, lon)
+        dlat = math.degrees(radius / EARTH_RADIUS)
+        coslat = math.cos(math.radians(lat))
+        dlon = 180.0 if coslat < 1e-12 else min(math.degrees(radius / (EARTH_RADIUS * coslat)), 180.0)
+        s, w, n, e = lat - dlat, lon - dlon, lat + dlat, lon + dlon
+        # A box reaching past the antimeridian continues on the other side
+        boxes = [(s, max(w, -180.0), n, min(e, 180.0))]
+        if w < -180.0:
+            boxes.append((s, w + 360.0, n, 180.0))
+        if e > 180.0:
+            boxes.append((s, -180.0, n, e - 360.0))
+        rows = np.unique(np.concatenate([self.query_bbox(box) for box in boxes]))
+        # Distance to the nearest point of each extent, on whichever side of the antimeridian; exact for nodes
+        plat = np.radians(np.clip(lat, self.minlat[rows], self.maxlat[rows]))
+        lat0, lon0 = math.radians(lat), math.radians(lon)
+        hlon = np.full(len(rows), np.inf)
+        for shift in (-360.0, 0.0, 360.0):
+            plon = np.radians(np.clip(lon + shift, self.minlon[rows], self.maxlon[rows]))
+            hlon = np.minimum(hlon, np.sin((plon - lon0) / 2) ** 2)
+        h = np.sin((plat - lat0) / 2) ** 2 + math.cos(lat0) * np.cos(plat) * hlon
+        distance = 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(h, 1.0)))
+        return rows[distance <= radius]
+
+
+def index_table(table, zoom=None):
+    # Builds an index and keeps it on the table, where evaluating a BboxFilter picks it up
+    table.spatial_index = SpatialIndex(table, zoom=zoom)
+    return table.spatial_index
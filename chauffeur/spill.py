@@ -0,0 +1,230 @@
+import os
+import json
+import array
+from collections import OrderedDict
+
+from .columnar import ElementTableBuilder, ElementTable, Ragged, _require_numpy
+from .elements import CHUNK_SIZE
+
+try:
+    import numpy as np
+except ImportError: # pragma: no cover
+    np = None
+
+
+MANIFEST = "table.json"
+BUFFER_BYTES = 1048576 # Per column, before it is appended to its file
+ITER_BLOCK = 65536 # Strings decoded per read when scanning a mapped pool
+_RAGGED = ("tags", "nodes", "members")
+_POOLS = ("types", "keys", "values", "roles")
+
+
+class ColumnFile:
+    # Append-only fixed-width column on disk; only the last few items are held in memory
+    def __init__(self, path, typecode, buffer_bytes=BUFFER_BYTES):
+        self.path = path
+        self.typecode = typecode
+        self._file = open(path, "wb")
+        self._buffer = array.array(typecode)
+        self._limit = max(buffer_bytes // self._buffer.itemsize, 1)
+        self._written = 0
+
+    def __len__(self):
+        return self._written + len(self._buffer)
+
+    def append(self, value):
+        self._buffer.append(value)
+        if len(self._buffer) >= self._limit:
+            self.flush()
+
+    def extend(self, values):
+        self._buffer.extend(values)
+        if len(self._buffer) >= self._limit:
+            self.flush()
+
+    def fill(self, value, count):
+        while count > 0:
+            n = min(count, self._limit)
+            self._buffer.extend(array.array(self.typecode, [value]) * n)
+            self.flush()
+            count -= n
+
+    def flush(self):
+        if self._buffer:
+            self._buffer.tofile(self._file)
+            self._written += len(self._buffer)
+            self._buffer = array.array(self.typecode)
+
+    def close(self):
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+
+class MappedStrings:
+    # Read-only sequence over a pool's blob; each string is decoded as it is read
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def encoded(self, code):
+        return self.blob[self.offsets[code]:self.offsets[code + 1]].tobytes()
+
+    def __getitem__(self, code):
+        if code < 0:
+            code += len(self)
+        if not 0 <= code < len(self):
+            raise IndexError("string pool code out of range")
+        return self.encoded(code).decode("utf-8")
+
+    def __iter__(self):
+        # A block of strings at a time, so a full scan never holds the whole pool
+        for start in range(0, len(self), ITER_BLOCK):
+            offsets = self.offsets[start:start + ITER_BLOCK + 1].tolist()
+            base = offsets[0]
+            chunk = self.blob[base:offsets[-1]].tobytes()
+            for lo, hi in zip(offsets[:-1], offsets[1:]):
+                yield chunk[lo - base:hi - base].decode("utf-8")
+
+
+class MappedStringPool:
+    # A StringPool saved as an offsets array, a UTF-8 blob and the codes in byte order, all mapped
+    # from disk; code() binary searches instead of holding a dict of every string
+    def __init__(self, offsets, blob, order):
+        self.strings = MappedStrings(offsets, blob)
+        self.order = order
+
+    def code(self, s):
+        target = s.encode("utf-8")
+        lo, hi = 0, len(self.order)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.strings.encoded(self.order[mid]) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self.order) and self.strings.encoded(self.order[lo]) == target:
+            return int(self.order[lo])
+        return -1
+
+    def __getitem__(self, code):
+        return self.strings[code]
+
+    def __len__(self):
+        return len(self.strings)
+
+
+def _pool_arrays(pool):
+    if isinstance(pool, MappedStringPool):
+        return pool.strings.offsets, pool.strings.blob, pool.order
+    encoded = [s.encode("utf-8") for s in pool.strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    order = np.array(sorted(range(len(encoded)), key=encoded.__getitem__), dtype=np.int64)
+    return offsets, blob, order
+
+
+class SpillBuilder(ElementTableBuilder):
+    # An ElementTableBuilder whose columns grow on disk; build() maps them back read-only
+    def __init__(self, path, buffer_bytes=BUFFER_BYTES):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.buffer_bytes = buffer_bytes
+        self._files = list()
+        super().__init__()
+
+    def _column(self, name, typecode, fill=0, count=0):
+        column = ColumnFile(os.path.join(self.path, f'''{name}.bin'''), typecode, self.buffer_bytes)
+        column.fill(fill, count)
+        self._files.append(column)
+        return column
+
+    def _array(self, column, dtype):
+        column.close()
+        return _map(column.path, dtype, len(column))
+
+    def build(self):
+        for column in self._files:
+            column.close()
+        save_table(super().build(), self.path)
+        # Reopened, so the interned strings are mapped too rather than held in the builder's pools
+        return open_table(self.path)
+
+    def close(self):
+        for column in self._files:
+            column.close()
+
+
+def _map(path, dtype, length):
+    if not length:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=(length,))
+
+
+def _entry(arr, path, name):
+    filename = f'''{name}.bin'''
+    target = os.path.join(path, filename)
+    backing = getattr(arr, "filename", None)
+    if backing is not None and os.path.abspath(backing) == os.path.abspath(target):
+        # Already on disk, as for a table built by SpillBuilder; rewriting a mapped file in place
+        # would pull it out from under the table
+        if arr.nbytes != os.path.getsize(target):
+            raise ValueError(f'''Cannot save a slice of a table over the files it is mapped from: {target}''')
+    else:
+        np.ascontiguousarray(arr).tofile(target)
+    return {"file": filename, "dtype": arr.dtype.str, "length": len(arr)}
+
+
+def save_table(table, path):
+    # Writes a table as one raw file per array plus a manifest; open_table maps it back
+    _require_numpy()
+    os.makedirs(path, exist_ok=True)
+    manifest = {"columns": OrderedDict((name, _entry(col, path, f'''columns.{name}'''))
+                                       for name, col in table.columns.items())}
+    for group in _RAGGED:
+        ragged = getattr(table, group)
+        manifest[group] = {"offsets": _entry(ragged.offsets, path, f'''{group}.offsets'''),
+                           "arrays": {name: _entry(arr, path, f'''{group}.{name}''')
+                                      for name, arr in ragged.arrays.items()}}
+    manifest["strings"] = dict()
+    for pool in _POOLS:
+        offsets, blob, order = _pool_arrays(getattr(table, pool))
+        manifest["strings"][pool] = {"offsets": _entry(offsets, path, f'''strings.{pool}.offsets'''),
+                                     "blob": _entry(blob, path, f'''strings.{pool}.blob'''),
+                                     "order": _entry(order, path, f'''strings.{pool}.order''')}
+    with open(os.path.join(path, MANIFEST), "w") as f:
+        json.dump(manifest, f)
+
+
+def open_table(path):
+    # Maps a saved table read-only; columns are paged in by the OS as they are touched
+    _require_numpy()
+    with open(os.path.join(path, MANIFEST)) as f:
+        manifest = json.load(f)
+
+    def load(entry):
+        return _map(os.path.join(path, entry["file"]), np.dtype(entry["dtype"]), entry["length"])
+
+    columns = OrderedDict((name, load(entry)) for name, entry in manifest["columns"].items())
+    ragged = {group: Ragged(load(manifest[group]["offsets"]),
+                            **{name: load(entry) for name, entry in manifest[group]["arrays"].items()})
+              for group in _RAGGED}
+    pools = {name: MappedStringPool(**{part: load(entry) for part, entry in entries.items()})
+             for name, entries in manifest["strings"].items()}
+    return ElementTable(columns, ragged["tags"], ragged["nodes"], ragged["members"], **pools)
+
+
+def spill_stream(stream, path, buffer_bytes=BUFFER_BYTES):
+    builder = SpillBuilder(path, buffer_bytes=buffer_bytes)
+    try:
+        return stream.fill(builder).build()
+    finally:
+        builder.close()
+
+
+def request_spill(qb, path, chunk_size=CHUNK_SIZE):
+    return spill_stream(qb.iter_elements(chunk_size=chunk_size), path)
@@ -0,0 +1,173 @@
+import os
+import json
+import math
+import threading
+import concurrent.futures
+
+import requests
+
+from .elements import merge_elements
+from .cache import cache_key
+
+
+DEFAULT_MAX_WORKERS = 4
+QUADTILE_MAX_ZOOM = 16 # Overpass quadtile index resolution
+MIN_TILE_SIZE = 0.01 # Degrees; tiles are not bisected below this span
+FAILURE_STATUS_CODES = (504,)
+FAILURE_REMARKS = ("query timed out", "out of memory")
+
+
+def grid_tiles(bbox, rows, cols):
+    if rows < 1 or cols < 1:
+        raise ValueError("Grid must have at least one row and one column")
+    s, w, n, e = bbox
+    dlat = (n - s) / rows
+    dlon = (e - w) / cols
+    tiles = []
+    for i in range(rows):
+        for j in range(cols):
+            ts = s + i * dlat
+            tw = w + j * dlon
+            tn = n if i == rows - 1 else ts + dlat
+            te = e if j == cols - 1 else tw + dlon
+            tiles.append((ts, tw, tn, te))
+    return tiles
+
+
+def quadtile_index(lat, lon, zoom):
+    ncells = 1 << zoom
+    x = min(int((lon + 180.0) / 360.0 * ncells), ncells - 1)
+    y = min(int((lat + 90.0) / 180.0 * ncells), ncells - 1)
+    # Interleave bits, lon first, as in the Overpass quadtile index
+    qt = 0
+    for b in reversed(range(zoom)):
+        qt = (qt << 2) | (((x >> b) & 1) << 1) | ((y >> b) & 1)
+    return qt
+
+
+def quadtiles(bbox, zoom):
+    if not 0 <= zoom <= QUADTILE_MAX_ZOOM:
+        raise ValueError(f'''Quadtile zoom must be between 0 and {QUADTILE_MAX_ZOOM}''')
+    s, w, n, e = bbox
+    ncells = 1 << zoom
+    dlat = 180.0 / ncells
+    dlon = 360.0 / ncells
+    y0 = max(int(math.floor((s + 90.0) / dlat)), 0)
+    y1 = min(int(math.ceil((n + 90.0) / dlat)), ncells)
+    x0 = max(int(math.floor((w + 180.0) / dlon)), 0)
+    x1 = min(int(math.ceil((e + 180.0) / dlon)), ncells)
+    tiles = []
+    for y in range(y0, max(y1, y0 + 1)):
+        for x in range(x0, max(x1, x0 + 1)):
+            ts = max(s, y * dlat - 90.0)
+            tn = min(n, (y + 1) * dlat - 90.0)
+            tw = max(w, x * dlon - 180.0)
+            te = min(e, (x + 1) * dlon - 180.0)
+            if ts < tn and tw < te:
+                tiles.append((ts, tw, tn, te))
+    # Order tiles the way the server orders quadtile sorted output
+    tiles.sort(key=lambda t: quadtile_index(t[0], t[1], zoom))
+    return tiles
+
+
+def request_tiles(qb, tiles, max_workers=DEFAULT_MAX_WORKERS):
+    def fetch(tile):
+        return list(qb.tile(tile).iter_elements())
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+        results = pool.map(fetch, tiles)
+        return merge_elements(results)
+
+
+class TileTooSmall(RuntimeError):
+    pass
+
+
+class _TileFailed(Exception):
+    pass
+
+
+def is_resource_failure(remark):
+    remark = (remark or "").lower()
+    return any(marker in remark for marker in FAILURE_REMARKS)
+
+
+def split_bbox(bbox):
+    s, w, n, e = bbox
+    mlat = (s + n) / 2
+    mlon = (w + e) / 2
+    return [(s, w, mlat, mlon), (s, mlon, mlat, e), (mlat, w, n, mlon), (mlat, mlon, n, e)]
+
+
+class TileHistory:
+    # Remembers which tiles completed for a query and area, so later runs skip the failures
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._tiles = dict()
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                self._tiles = json.load(f)
+
+    @staticmethod
+    def key(qb, bbox):
+        query = qb.tile(None).raw_query_string
+        area = ",".join(f'''{c:.6f}''' for c in bbox)
+        return f'''{cache_key(query, qb.overpass_endpoint)}:{area}'''
+
+    def get(self, key):
+        with self._lock:
+            tiles = self._tiles.get(key)
+        return None if tiles is None else [tuple(t) for t in tiles]
+
+    def record(self, key, tiles):
+        with self._lock:
+            self._tiles[key] = [list(t) for t in tiles]
+            if self.path is not None:
+                with open(self.path, "w") as f:
+                    json.dump(self._tiles, f)
+
+    def __len__(self):
+        return len(self._tiles)
+
+
+def _fetch_tile(qb, tile):
+    try:
+        stream = qb.tile(tile).iter_elements()
+        elements = list(stream)
+    except requests.HTTPError as e:
+        if e.response is not None and e.response.status_code in FAILURE_STATUS_CODES:
+            raise _TileFailed(f'''HTTP {e.response.status_code}''')
+        raise
+    if is_resource_failure(stream.remark):
+        raise _TileFailed(stream.remark)
+    return elements
+
+
+def request_adaptive(qb, bbox, min_size=MIN_TILE_SIZE, max_workers=DEFAULT_MAX_WORKERS, history=None):
+    # Tiles that time out or run out of memory are split into quadrants and retried
+    key = None if history is None else history.key(qb, bbox)
+    tiles = (history.get(key) if history is not None else None) or [tuple(bbox)]
+    results = dict()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = {pool.submit(_fetch_tile, qb, t): t for t in tiles}
+        try:
+            while pending:
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    tile = pending.pop(future)
+                    try:
+                        results[tile] = future.result()
+                    except _TileFailed as failure:
+                        s, w, n, e = tile
+                        if max(n - s, e - w) / 2 < min_size:
+                            raise TileTooSmall(f'''Tile {tile} failed at the minimum size: {failure}''') from None
+                        for quadrant in split_bbox(tile):
+                            pending[pool.submit(_fetch_tile, qb, quadrant)] = quadrant
+        finally:
+            for future in pending:
+                future.cancel()
+    done_tiles = sorted(results, key=lambda t: quadtile_index(t[0], t[1], QUADTILE_MAX_ZOOM))
+    if history is not None:
+        history.record(key, done_tiles)
+    return merge_elements(results[t] for t in done_tiles)
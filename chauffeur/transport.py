@@ -0,0 +1,62 @@
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .settings import QuerySettings
+
+
+DEFAULT_POOL_CONNECTIONS = 4
+DEFAULT_POOL_MAXSIZE = 16
+TIMEOUT_GRACE = 30 # Seconds allowed beyond the server side timeout
+
+
+def client_timeout(settings, grace=TIMEOUT_GRACE):
+    timeout = settings.timeout
+    if timeout is None:
+        timeout = QuerySettings.DEFAULT_TIMEOUT
+    return timeout + grace
+
+
+class Transport:
+    def __init__(self,
+                 pool_connections=DEFAULT_POOL_CONNECTIONS,
+                 pool_maxsize=DEFAULT_POOL_MAXSIZE,
+                 accept_encoding="gzip, deflate",
+                 headers=None):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.session = requests.Session()
+        # pool_connections is the number of hosts kept, pool_maxsize the keep-alive sockets per host
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["Accept-Encoding"] = accept_encoding
+        if headers:
+            self.session.headers.update(headers)
+
+    def post(self, endpoint, query, stream=False, timeout=None):
+        # The interpreter reads the query from the "data" form field;
+        # compressed bodies are decoded transparently, also while streaming.
+        return self.session.post(endpoint, data={"data": query}, stream=stream, timeout=timeout)
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+_default_transport = None
+_default_lock = threading.Lock()
+
+
+def default_transport():
+    global _default_transport
+    with _default_lock:
+        if _default_transport is None:
+            _default_transport = Transport()
+        return _default_transport
@@ -19,8 +19,13 @@ setup(name="chauffeur-pass",
       long_description_content_type="text/markdown",
       url="https://github.com/rjpolackwich/chauffeur",
       license="MIT",
-      packages=find_packages(exclude=['docs', 'tests']),
+      packages=find_packages(exclude=['docs', 'tests', 'benchmarks']),
       install_requires=reqs,
+      extras_require={
+          "async": ["aiohttp"],
+          "numpy": ["numpy"],
+          "arrow": ["pyarrow"],
+      },
       classifiers=[
           "Programming Language :: Python :: 3",
           "License :: OSI Approved :: MIT License"
@@ -0,0 +1,83 @@
+import time
+import random
+import threading
+import http.server
+
+
+class StubOverpassServer:
+    def __init__(self, payload=b'{"elements": []}', status=200, delay=0.0, content_type="application/json",
+                 failure_rate=0.0, failure_status=503):
+        self.payload = payload
+        self.status = status
+        self.delay = delay
+        self.content_type = content_type
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.requests = []
+        self.peers = set()
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'''http://{host}:{port}/api/interpreter'''
+
+    def handle(self, handler):
+        with self._lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            length = int(handler.headers.get("Content-Length") or 0)
+            body = handler.rfile.read(length) if length else b""
+            with self._lock:
+                self.requests.append((handler.command, handler.path, dict(handler.headers), body))
+                self.peers.add(handler.client_address)
+            if self.delay:
+                time.sleep(self.delay)
+            if self.failure_rate and random.random() < self.failure_rate:
+                status, payload, headers = self.failure_status, b"", dict()
+            else:
+                status, payload, headers = self.respond(handler, body)
+            handler.send_response(status)
+            handler.send_header("Content-Type", self.content_type)
+            handler.send_header("Content-Length", str(len(payload)))
+            for k, v in headers.items():
+                handler.send_header(k, v)
+            handler.end_headers()
+            handler.wfile.write(payload)
+        finally:
+            with self._lock:
+                self.active -= 1
+
+    def respond(self, handler, body):
+        return self.status, self.payload, dict()
+
+    def __enter__(self):
+        stub = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                stub.handle(self)
+
+            def do_POST(self):
+                stub.handle(self)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
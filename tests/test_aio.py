@@ -0,0 +1,106 @@
+import time
+import asyncio
+import unittest
+import urllib.parse
+from unittest import mock
+
+import requests
+
+from chauffeur.aio import arequest_all, AsyncResponse
+from chauffeur.transport import client_timeout
+from chauffeur.endpoints import EndpointPool
+from chauffeur.query import QueryBuilder, NodeQuery
+from chauffeur.settings import QuerySettings
+from chauffeur.filters import TagFilter
+from tests.stubs import StubOverpassServer
+
+
+PAYLOAD = b'{"elements": [{"type": "node", "id": 1, "lat": 1.0, "lon": 2.0}]}'
+
+
+def make_builder(endpoint, value="school"):
+    qb = QueryBuilder(payload_format="json")
+    qb.overpass_endpoint = endpoint
+    qb.qsx.append(NodeQuery(filters=TagFilter("amenity", value)))
+    return qb
+
+
+class TestAsyncRequests(unittest.TestCase):
+    def test_client_timeout(self):
+        self.assertEqual(client_timeout(QuerySettings(timeout=60), grace=5), 65)
+        self.assertEqual(client_timeout(QuerySettings(), grace=0), QuerySettings.DEFAULT_TIMEOUT)
+
+    def test_arequest(self):
+        with StubOverpassServer(payload=PAYLOAD) as server:
+            qb = make_builder(server.url)
+            response = asyncio.run(qb.arequest())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["elements"][0]["id"], 1)
+        method, _, _, body = server.requests[0]
+        self.assertEqual(method, "POST")
+        self.assertEqual(urllib.parse.parse_qs(body.decode())["data"], [qb.raw_query_string])
+
+    def test_bounded_concurrency(self):
+        with StubOverpassServer(payload=PAYLOAD, delay=0.05) as server:
+            builders = [make_builder(server.url, str(i)) for i in range(12)]
+            responses = asyncio.run(arequest_all(builders, concurrency=3))
+        self.assertEqual(len(responses), 12)
+        self.assertTrue(all(r.status_code == 200 for r in responses))
+        self.assertLessEqual(server.max_active, 3)
+
+    def test_timeout(self):
+        with StubOverpassServer(payload=PAYLOAD, delay=1.0) as server:
+            qb = make_builder(server.url)
+            with self.assertRaises(asyncio.TimeoutError):
+                asyncio.run(qb.arequest(timeout=0.1))
+
+    def test_cancellation(self):
+        with StubOverpassServer(payload=PAYLOAD, delay=1.0) as server:
+            builders = [make_builder(server.url, str(i)) for i in range(4)]
+
+            async def run():
+                task = asyncio.ensure_future(arequest_all(builders, concurrency=2))
+                await asyncio.sleep(0.1)
+                task.cancel()
+                await task
+
+            with self.assertRaises(asyncio.CancelledError):
+                asyncio.run(run())
+            self.assertLessEqual(len(server.requests), 2)
+
+    def test_endpoint_pool(self):
+        with StubOverpassServer(payload=PAYLOAD) as a, StubOverpassServer(payload=PAYLOAD) as b:
+            qb = make_builder("http://unused.invalid/api/interpreter")
+            qb.endpoints = EndpointPool([a.url, b.url])
+            responses = asyncio.run(arequest_all([qb] * 4))
+            metrics = qb.endpoints.metrics()
+            qb.endpoints.close()
+        self.assertTrue(all(r.status_code == 200 for r in responses))
+        self.assertEqual(len(a.requests) + len(b.requests), 4)
+        self.assertEqual(sum(e["requests"] for e in metrics["endpoints"].values()), 4)
+
+    def test_endpoint_pool_hedge(self):
+        with StubOverpassServer(payload=PAYLOAD) as fast, StubOverpassServer(payload=PAYLOAD, delay=1.0) as slow:
+            qb = make_builder(fast.url)
+            qb.endpoints = EndpointPool([slow.url, fast.url], hedge_quantile=0.95, hedge_delay=0.05)
+            slow_ep, fast_ep = qb.endpoints.endpoints
+            with mock.patch.object(qb.endpoints, "select", side_effect=[slow_ep, fast_ep]):
+                start = time.monotonic()
+                response = asyncio.run(qb.arequest())
+                elapsed = time.monotonic() - start
+            metrics = qb.endpoints.metrics()
+            qb.endpoints.close()
+        self.assertEqual(response.status_code, 200)
+        self.assertLess(elapsed, 0.8)
+        self.assertEqual((metrics["hedges"], metrics["hedge_wins"]), (1, 1))
+        # The cancelled loser is neither counted against its mirror nor left in flight
+        self.assertEqual(metrics["endpoints"][slow.url]["requests"], 0)
+        self.assertEqual(metrics["endpoints"][slow.url]["in_flight"], 0)
+
+    def test_raise_for_status(self):
+        with self.assertRaises(requests.HTTPError):
+            AsyncResponse(429, b"", reason="Too Many Requests").raise_for_status()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+import json
+import unittest
+
+from chauffeur.batch import BatchQuery, MARKER_TYPE
+from chauffeur.query import QueryBuilder, NodeQuery, WayQuery
+from chauffeur.formats import fmt
+from chauffeur.filters import TagFilter
+from tests.stubs import StubOverpassServer
+
+
+def marker(name):
+    return {"type": MARKER_TYPE, "id": 1, "tags": {"name": name}}
+
+
+class TestBatchQuery(unittest.TestCase):
+    def setUp(self):
+        self.cafes = QueryBuilder(timeout=60, payload_format="json")
+        self.cafes.qsx.append(NodeQuery(filters=TagFilter("amenity", "cafe")))
+        self.bakeries = WayQuery(filters=TagFilter("shop", "bakery"))
+
+    def test_compile(self):
+        batch = BatchQuery([self.cafes])
+        batch.add(self.bakeries, name="bakeries")
+        batch.output_mode.VERBOSITY = fmt.Verbosity.CONCISE
+        self.assertEqual(batch.names, ["q0", "bakeries"])
+        self.assertEqual(
+            batch.raw_query_string,
+            '[out:json][timeout:60];'
+            'node[amenity=cafe];'
+            f'make {MARKER_TYPE} name="q0"->.{MARKER_TYPE};.{MARKER_TYPE} out;'
+            'out qt;'
+            'way[shop=bakery]->.bakeries;(.bakeries;.bakeries >;)->.bakeries;'
+            f'make {MARKER_TYPE} name="bakeries"->.{MARKER_TYPE};.{MARKER_TYPE} out;'
+            '.bakeries out skel qt;')
+
+    def test_settings_must_match(self):
+        other = QueryBuilder(timeout=30)
+        other.qsx.append(NodeQuery())
+        batch = BatchQuery([self.cafes])
+        with self.assertRaises(ValueError):
+            batch.add(other)
+        with self.assertRaises(ValueError):
+            batch.add(self.bakeries, name="q0")
+        with self.assertRaises(ValueError):
+            batch.add(self.bakeries, name="not a set")
+
+    def test_demultiplex(self):
+        elements = [marker("q0"),
+                    {"type": "node", "id": 1, "lat": 1.0, "lon": 1.0},
+                    {"type": "node", "id": 2, "lat": 1.0, "lon": 1.0},
+                    marker("q1"),
+                    {"type": "way", "id": 3, "nodes": [1, 2]},
+                    {"type": "node", "id": 1, "lat": 1.0, "lon": 1.0}]
+        payload = json.dumps({"elements": elements}).encode()
+        with StubOverpassServer(payload=payload) as server:
+            batch = BatchQuery([self.cafes, self.bakeries])
+            batch.overpass_endpoint = server.url
+            results = batch.results()
+        self.assertEqual(len(server.requests), 1)
+        self.assertEqual([e["id"] for e in results["q0"]], [1, 2])
+        self.assertEqual([e["id"] for e in results["q1"]], [3, 1])
+
+    def test_demultiplex_xml(self):
+        payload = f'''<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6" generator="Overpass API">
+<{MARKER_TYPE} id="1"><tag k="name" v="q0"/></{MARKER_TYPE}>
+<node id="1" lat="1.0" lon="1.0"/>
+<{MARKER_TYPE} id="1"><tag k="name" v="q1"/></{MARKER_TYPE}>
+</osm>'''.encode()
+        with StubOverpassServer(payload=payload, content_type="application/osm3s+xml") as server:
+            batch = BatchQuery([self.bakeries, WayQuery()])
+            batch.overpass_endpoint = server.url
+            results = batch.results()
+        self.assertEqual([e["id"] for e in results["q0"]], [1])
+        self.assertEqual(results["q1"], [])
+
+
+if __name__ == "__main__":
+    unittest.main()
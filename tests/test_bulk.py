@@ -0,0 +1,99 @@
+import json
+import threading
+import unittest
+from unittest import mock
+from urllib.parse import parse_qs
+
+from chauffeur.query import QueryBuilder
+from chauffeur.filters import IdFilter
+from chauffeur.bulk import group_ids, chunk_ids, batch_size, id_batches, ELEMENT_SIZE_ESTIMATES
+
+from tests.stubs import StubOverpassServer
+
+
+class TestIdFilter(unittest.TestCase):
+    def test_multiple_ids(self):
+        f = IdFilter([3, 1, 2])
+        self.assertEqual(repr(f), "(id:3,1,2)")
+        self.assertEqual(f.osm_ids, (3, 1, 2))
+        self.assertEqual(repr(IdFilter([5])), "(id:5)")
+        self.assertEqual(IdFilter([5]), IdFilter(5))
+        self.assertEqual(IdFilter(5).osm_ids, (5,))
+
+
+class TestChunking(unittest.TestCase):
+    def test_group_ids(self):
+        grouped = group_ids([("way", 2), ("node", 5), ("node", 1), ("node", 5)])
+        self.assertEqual(dict(grouped), {"way": [2], "node": [1, 5]})
+        self.assertEqual(dict(group_ids({"relation": ["7", 7]})), {"relation": [7]})
+        with self.assertRaises(ValueError):
+            group_ids({"area": [1]})
+
+    def test_chunk_ids_by_count(self):
+        self.assertEqual(list(chunk_ids(range(5), max_ids=2)), [[0, 1], [2, 3], [4]])
+
+    def test_chunk_ids_by_length(self):
+        chunks = list(chunk_ids([100, 200, 300, 400], max_length=8))
+        self.assertEqual(chunks, [[100, 200], [300, 400]])
+        # A single id that overflows still gets its own chunk
+        self.assertEqual(list(chunk_ids([123456], max_length=2)), [[123456]])
+
+    def test_batch_size_respects_maxsize(self):
+        self.assertEqual(batch_size("relation", maxsize=ELEMENT_SIZE_ESTIMATES["relation"] * 3), 3)
+        self.assertEqual(batch_size("node", maxsize=1), 1)
+        self.assertEqual(batch_size("node", max_ids=10), 10)
+
+    def test_id_batches_group_by_type(self):
+        batches = list(id_batches({"node": [1, 2, 3], "way": [4]}, max_ids=2))
+        self.assertEqual(batches, [("node", [1, 2]), ("node", [3]), ("way", [4])])
+
+
+class TestBuilderBatches(unittest.TestCase):
+    def test_batches_fit_query_length(self):
+        qb = QueryBuilder(payload_format="json")
+        batches = qb.id_batches({"node": range(1000, 2000)}, max_length=200)
+        self.assertGreater(len(batches), 1)
+        for batch in batches:
+            self.assertLessEqual(len(batch.raw_query_string), 200)
+        self.assertEqual(batches[0].raw_query_string[:20], "[out:json];node(id:1")
+        self.assertEqual(len(qb.qsx.qc), 0)
+
+
+class IdServer(StubOverpassServer):
+    # Answers every id in the query with a node; the first node is shared by every batch
+    def respond(self, handler, body):
+        query = parse_qs(body.decode())["data"][0]
+        ids = query.split("(id:")[1].split(")")[0].split(",")
+        elements = [{"type": "node", "id": 0, "lat": 0.0, "lon": 0.0}]
+        elements.extend({"type": "node", "id": int(i), "lat": 0.0, "lon": 0.0} for i in ids)
+        return 200, json.dumps({"elements": elements}).encode(), dict()
+
+
+class TestRequestIds(unittest.TestCase):
+    def test_request_ids_merges_batches(self):
+        with IdServer(delay=0.05) as server:
+            with mock.patch.object(QueryBuilder, "overpass_endpoint", server.url):
+                qb = QueryBuilder(payload_format="json")
+                elements = list(qb.request_ids({"node": range(1, 41)}, max_ids=5, max_workers=4))
+        self.assertEqual(len(server.requests), 8)
+        self.assertGreater(server.max_active, 1)
+        self.assertEqual(sorted(e["id"] for e in elements), list(range(0, 41)))
+
+    def test_request_ids_is_lazy(self):
+        calls = list()
+        lock = threading.Lock()
+
+        def fake_iter(qb, chunk_size=None):
+            with lock:
+                calls.append(qb)
+            return iter([{"type": "node", "id": 1}])
+
+        with mock.patch.object(QueryBuilder, "iter_elements", fake_iter):
+            stream = QueryBuilder().request_ids({"node": range(100)}, max_ids=1, max_workers=2)
+            self.assertEqual(next(stream)["id"], 1)
+            stream.close()
+        self.assertLess(len(calls), 100)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,152 @@
+import os
+import datetime as dt
+import tempfile
+import unittest
+from unittest import mock
+
+from chauffeur.cache import ResponseCache, CachedResponse, normalize_query, cache_key, has_remark
+from chauffeur.query import QueryBuilder, NodeQuery
+from chauffeur.filters import TagFilter
+
+
+class FakeResponse:
+    status_code = 200
+
+    def __init__(self, content):
+        self.content = content
+
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+    def raise_for_status(self):
+        pass
+
+    def close(self):
+        pass
+
+
+PAYLOAD = b'{"elements": [{"type": "node", "id": 1, "lat": 1.0, "lon": 2.0}]}'
+
+
+class TestCacheKey(unittest.TestCase):
+    def test_normalize_query(self):
+        a = '[out:json];node["name"="a  b"](1,2,3,4);out body;'
+        b = '[out:json] ;\n node [ "name"="a  b" ] ( 1, 2, 3, 4 );\n  out  body ;'
+        self.assertEqual(normalize_query(b), a)
+        self.assertNotEqual(normalize_query(a), normalize_query(a.replace("a  b", "a b")))
+
+    def test_cache_key(self):
+        self.assertEqual(cache_key("node;out;", "http://a"), cache_key("node ; out ;", "http://a"))
+        self.assertNotEqual(cache_key("node;out;", "http://a"), cache_key("node;out;", "http://b"))
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "cache.sqlite")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_roundtrip_compressed(self):
+        cache = ResponseCache(self.path)
+        content = b"x" * 10000
+        cache.put("k", content)
+        self.assertEqual(cache.get("k"), content)
+        self.assertLess(cache.size, len(content))
+        self.assertIsNone(cache.get("missing"))
+        cache.close()
+        # Persisted across instances
+        self.assertEqual(ResponseCache(self.path).get("k"), content)
+
+    def test_ttl(self):
+        cache = ResponseCache(self.path, ttl=10)
+        with mock.patch("chauffeur.cache.time.time", return_value=1000.0):
+            cache.put("k", b"a")
+            cache.put("forever", b"b", ttl=ResponseCache.FOREVER)
+        with mock.patch("chauffeur.cache.time.time", return_value=1005.0):
+            self.assertEqual(cache.get("k"), b"a")
+        with mock.patch("chauffeur.cache.time.time", return_value=1011.0):
+            self.assertIsNone(cache.get("k"))
+            self.assertEqual(cache.get("forever"), b"b")
+
+    def test_lru_eviction(self):
+        cache = ResponseCache(self.path, max_bytes=50, compress_level=0)
+        with mock.patch("chauffeur.cache.time.time", return_value=1.0):
+            cache.put("a", b"1" * 10)
+        with mock.patch("chauffeur.cache.time.time", return_value=2.0):
+            cache.put("b", b"2" * 10)
+        with mock.patch("chauffeur.cache.time.time", return_value=3.0):
+            cache.get("a")
+        with mock.patch("chauffeur.cache.time.time", return_value=4.0):
+            cache.put("c", b"3" * 10)
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("a"))
+        self.assertIsNotNone(cache.get("c"))
+        self.assertLessEqual(cache.size, 50)
+
+
+class TestQueryBuilderCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.qb = QueryBuilder(payload_format="json")
+        self.qb.qsx.append(NodeQuery(filters=TagFilter("amenity", "school")))
+        self.qb.cache = ResponseCache(os.path.join(self.tmpdir.name, "cache.sqlite"), ttl=60)
+        self.calls = []
+
+        def fake_send(qb, query, stream=False):
+            self.calls.append(query)
+            return FakeResponse(PAYLOAD)
+        self.patch = mock.patch.object(QueryBuilder, "_send", fake_send)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        self.tmpdir.cleanup()
+
+    def test_request_hit(self):
+        self.assertEqual(self.qb.request().content, PAYLOAD)
+        response = self.qb.request()
+        self.assertIsInstance(response, CachedResponse)
+        self.assertEqual(response.content, PAYLOAD)
+        self.assertEqual(len(self.calls), 1)
+
+    def test_streaming_fills_cache(self):
+        first = list(self.qb.iter_elements())
+        second = list(self.qb.iter_elements())
+        self.assertEqual(first, second)
+        self.assertEqual(first[0]["id"], 1)
+        self.assertEqual(len(self.calls), 1)
+
+    def test_remark_not_cached(self):
+        self.patch.stop()
+        error = b'{"elements": [], "remark": "runtime error: Query timed out"}'
+        with mock.patch.object(QueryBuilder, "_send", lambda qb, q, stream=False: FakeResponse(error)):
+            self.qb.request()
+            self.assertEqual(len(self.qb.cache), 0)
+        self.patch.start()
+
+    def test_remark_tag_cached(self):
+        self.patch.stop()
+        tagged = b'{"elements": [{"type": "node", "id": 1, "tags": {"remark": "x", "note": "remark"}}]}'
+        self.assertFalse(has_remark(tagged))
+        self.assertTrue(has_remark(tagged[:-1] + b', "remark": "runtime error: out of memory"}'))
+        self.assertTrue(has_remark(b'<osm><remark> runtime error </remark></osm>'))
+        self.assertFalse(has_remark(b'<osm><tag k="remark" v="x"/></osm>'))
+        with mock.patch.object(QueryBuilder, "_send", lambda qb, q, stream=False: FakeResponse(tagged)):
+            list(self.qb.iter_elements())
+            self.assertEqual(len(self.qb.cache), 1)
+        self.patch.start()
+
+    def test_dated_query_cached_forever(self):
+        self.qb.settings.date = dt.datetime(2020, 1, 1)
+        self.qb.request()
+        key = cache_key(self.qb.raw_query_string, self.qb.overpass_endpoint)
+        expires = self.qb.cache._conn.execute(
+            "SELECT expires FROM responses WHERE key = ?", (key,)).fetchone()[0]
+        self.assertIsNone(expires)
+
+
+if __name__ == "__main__":
+    unittest.main()
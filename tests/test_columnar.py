@@ -0,0 +1,109 @@
+import json
+import unittest
+
+try:
+    import numpy as np
+except ImportError: # pragma: no cover
+    np = None
+
+from chauffeur.elements import ElementStream
+from chauffeur.columnar import ElementTable, ElementTableBuilder
+
+from tests.test_elements import XML_PAYLOAD, JSON_PAYLOAD, chunked
+
+
+ELEMENTS = [
+    {"type": "node", "id": 1, "lat": 1.0, "lon": 1.0, "version": 2, "timestamp": "2020-01-01T00:00:00Z",
+     "tags": {"amenity": "cafe", "name": "A"}},
+    {"type": "node", "id": 2, "lat": 2.0, "lon": 2.0, "tags": {"amenity": "bar"}},
+    {"type": "node", "id": 3, "lat": 3.0, "lon": 3.0},
+    {"type": "way", "id": 10, "nodes": [1, 2, 3], "tags": {"highway": "path", "name": "B"}},
+    {"type": "relation", "id": 100, "members": [{"type": "way", "ref": 10, "role": "outer"}],
+     "tags": {"amenity": "cafe"}},
+]
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class TestElementTable(unittest.TestCase):
+    def setUp(self):
+        self.table = ElementTable.from_elements(ELEMENTS)
+
+    def test_columns(self):
+        t = self.table
+        self.assertEqual(len(t), 5)
+        self.assertEqual(t.ids.dtype, np.int64)
+        self.assertEqual(t.ids.tolist(), [1, 2, 3, 10, 100])
+        self.assertEqual(t.type_mask("node").tolist(), [True, True, True, False, False])
+        self.assertEqual(t.version.tolist(), [2, 0, 0, 0, 0])
+        self.assertEqual(str(t.timestamp[0]), "2020-01-01T00:00:00")
+        self.assertTrue(np.isnat(t.timestamp[1]))
+        self.assertTrue(np.isnan(t.lat[3]))
+        self.assertFalse(t.has_bounds)
+
+    def test_tags_are_interned(self):
+        t = self.table
+        self.assertEqual(len(t.keys), 3)
+        self.assertEqual(t.tags.offsets.tolist(), [0, 2, 3, 3, 5, 6])
+        self.assertEqual(t.has_tag("amenity").tolist(), [True, True, False, False, True])
+        self.assertEqual(t.has_tag("amenity", "cafe").tolist(), [True, False, False, False, True])
+        self.assertFalse(t.has_tag("shop").any())
+        self.assertFalse(t.has_tag("amenity", "pub").any())
+        self.assertEqual(t.tag_values("name").tolist(), ["A", None, None, "B", None])
+
+    def test_round_trip(self):
+        self.assertEqual(list(self.table), ELEMENTS)
+        self.assertEqual(self.table[-1], ELEMENTS[-1])
+
+    def test_view_is_zero_copy(self):
+        t = self.table
+        view = t[1:4]
+        self.assertEqual(len(view), 3)
+        self.assertTrue(np.shares_memory(view.ids, t.ids))
+        self.assertTrue(np.shares_memory(view.tags.offsets, t.tags.offsets))
+        self.assertIs(view.tags["key"], t.tags["key"])
+        self.assertEqual(list(view), ELEMENTS[1:4])
+        self.assertEqual(view.has_tag("name").tolist(), [False, False, True])
+        self.assertEqual(len(t[4:2]), 0)
+
+    def test_filter(self):
+        t = self.table
+        cafes = t[t.has_tag("amenity", "cafe")]
+        self.assertEqual(list(cafes), [ELEMENTS[0], ELEMENTS[4]])
+        self.assertEqual(cafes.tags.offsets.tolist(), [0, 2, 3])
+        self.assertEqual(list(t[[3, 0]]), [ELEMENTS[3], ELEMENTS[0]])
+        self.assertEqual(list(t[::2]), ELEMENTS[::2])
+        self.assertEqual(list(t.filter(t.within((1.5, 1.5, 3.5, 3.5)))), ELEMENTS[1:3])
+        self.assertEqual(len(t[np.zeros(5, dtype=bool)]), 0)
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class TestStreamFill(unittest.TestCase):
+    def test_xml_and_json_agree(self):
+        xml = ElementStream(chunked(XML_PAYLOAD, 11), payload_format="xml")
+        payload = json.dumps(JSON_PAYLOAD).encode()
+        js = ElementStream(chunked(payload, 11), payload_format="json")
+        xml_table = ElementTable.from_stream(xml)
+        json_table = ElementTable.from_stream(js)
+        self.assertEqual(xml_table.ids.tolist(), [1, 10, 100])
+        self.assertEqual(xml_table.ids.tolist(), json_table.ids.tolist())
+        np.testing.assert_array_equal(xml_table.lat, json_table.lat)
+        np.testing.assert_array_equal(xml_table.nodes["lat"], json_table.nodes["lat"])
+        self.assertEqual(xml_table.tag_values("amenity").tolist(), ["school", None, None])
+        self.assertEqual(xml_table[2]["members"], [{"type": "way", "ref": 10, "role": "outer"}])
+        self.assertEqual(xml_table.lat[2], 50.15)
+        self.assertTrue(xml_table.has_bounds)
+        self.assertEqual(xml_table["maxlat"][1], 50.2)
+        self.assertTrue(np.isnan(xml_table["maxlat"][0]))
+        self.assertEqual(xml.remark, "runtime error: Query timed out")
+
+    def test_builder_backfills_optional_columns(self):
+        builder = ElementTableBuilder()
+        builder.add({"type": "way", "id": 1, "nodes": [5, 6]})
+        builder.add({"type": "way", "id": 2, "nodes": [6, 7], "geometry": [None, {"lat": 1.0, "lon": 2.0}]})
+        table = builder.build()
+        self.assertEqual(table.nodes["ref"].tolist(), [5, 6, 6, 7])
+        self.assertEqual(np.isnan(table.nodes["lat"]).tolist(), [True, True, True, False])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,177 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from chauffeur.query import QueryBuilder, NodeQuery, WayQuery
+from chauffeur.filters import TagFilter, IdFilter
+from chauffeur.formats import fmt
+from chauffeur.grammar import Node, Way
+from chauffeur.cache import ResponseCache
+from chauffeur.cost import (CostModel, CostHistory, bbox_area, tag_selectivity, element_bytes, default_history_path,
+                            MIN_TIMEOUT)
+
+
+BERLIN = [52.3, 13.0, 52.7, 13.8]
+
+
+def builder(query, bbox=BERLIN, **kwargs):
+    qb = QueryBuilder(payload_format="json", bbox=bbox, **kwargs)
+    qb.qsx.append(query)
+    return qb
+
+
+class TestFeatures(unittest.TestCase):
+    def test_bbox_area(self):
+        # One degree square at the equator is about 12,364 km2
+        self.assertAlmostEqual(bbox_area((0.0, 0.0, 1.0, 1.0)), 12364, delta=10)
+        self.assertLess(bbox_area((60.0, 0.0, 61.0, 1.0)), bbox_area((0.0, 0.0, 1.0, 1.0)))
+
+    def test_selectivity(self):
+        self.assertGreater(tag_selectivity(TagFilter("building")), tag_selectivity(TagFilter("amenity")))
+        self.assertLess(tag_selectivity(TagFilter("amenity", "cafe")), tag_selectivity(TagFilter("amenity")))
+        self.assertLess(tag_selectivity(TagFilter("amenity", "cafe")),
+                        tag_selectivity(TagFilter("amenity", ["cafe", "bar"])))
+        self.assertGreater(tag_selectivity(TagFilter("!amenity")), 0.9)
+
+    def test_element_bytes(self):
+        generic = fmt.Verbosity.GENERIC
+        qb = QueryBuilder()
+        qb.output_mode.VERBOSITY = generic
+        plain = element_bytes(Way._level, qb.output_mode, "json")
+        qb.include_geometries()
+        self.assertGreater(element_bytes(Way._level, qb.output_mode, "json"), plain)
+        self.assertEqual(element_bytes(Node._level, qb.output_mode, "json"),
+                         element_bytes(Node._level, QueryBuilder().output_mode, "json"))
+        self.assertGreater(element_bytes(Way._level, qb.output_mode, "xml"),
+                           element_bytes(Way._level, qb.output_mode, "json"))
+
+
+class TestCostModel(unittest.TestCase):
+    def test_estimate_scales(self):
+        model = CostModel()
+        small = model.estimate(builder(NodeQuery(filters=TagFilter("amenity", "cafe"))))
+        large = model.estimate(builder(NodeQuery(filters=TagFilter("amenity", "cafe")), bbox=[50.0, 10.0, 54.0, 16.0]))
+        broad = model.estimate(builder(NodeQuery(filters=TagFilter("amenity"))))
+        self.assertGreater(large.bytes, small.bytes)
+        self.assertGreater(broad.elements, small.elements)
+        self.assertGreater(large.seconds, small.seconds)
+
+    def test_id_filter_bounds_count(self):
+        estimate = CostModel().estimate(builder(NodeQuery(filters=IdFilter([1, 2, 3])), bbox=None))
+        self.assertLessEqual(estimate.elements, 3)
+
+    def test_tune_small_query(self):
+        qb = builder(NodeQuery(filters=TagFilter("amenity", "cafe")))
+        plan = qb.tune(model=CostModel())
+        self.assertEqual((plan.rows, plan.cols), (1, 1))
+        self.assertEqual(qb.settings.timeout, MIN_TIMEOUT)
+        self.assertEqual(qb.settings.maxsize, plan.maxsize)
+        self.assertIn(f'''[timeout:{MIN_TIMEOUT}]''', qb.raw_query_string)
+
+    def test_tune_large_query_tiles(self):
+        qb = builder(WayQuery(filters=TagFilter("building")), bbox=[40.0, -10.0, 60.0, 20.0])
+        qb.include_geometries()
+        plan = CostModel().tune(qb)
+        self.assertGreater(plan.rows, 1)
+        self.assertEqual(plan.rows, plan.cols)
+        self.assertLessEqual(qb.settings.maxsize, qb.settings.MAXSIZE_LIMIT)
+
+    def test_probe(self):
+        qb = builder(NodeQuery(filters=TagFilter("amenity", "cafe")))
+        sent = list()
+
+        def fake_iter(probe, chunk_size=None):
+            sent.append(probe.raw_query_string)
+            return iter([{"type": "count", "id": 0, "tags": {"nodes": "2000", "ways": "0", "relations": "0"}}])
+
+        with mock.patch.object(QueryBuilder, "iter_elements", fake_iter):
+            estimate = qb.estimate(model=CostModel(), probe=True)
+        self.assertTrue(sent[0].endswith("node[amenity=cafe];out count;"))
+        self.assertEqual(estimate.elements, 2000)
+        self.assertEqual(qb.raw_query_string[-7:], "out qt;")
+
+
+class TestHistory(unittest.TestCase):
+    def test_learns_from_runs(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "cost.json")
+            model = CostModel(history=CostHistory(path, alpha=1.0))
+            qb = builder(NodeQuery(filters=TagFilter("amenity", "cafe")))
+            before = model.estimate(qb)
+            actual = [{"type": "node", "id": i} for i in range(int(before.elements / 4))]
+            with mock.patch.object(QueryBuilder, "iter_elements", lambda qb, chunk_size=None: iter(actual)):
+                plan, elements = qb.request_auto(model=model)
+            self.assertEqual(len(elements), len(actual))
+            after = CostModel(history=CostHistory(path)).estimate(qb)
+        self.assertAlmostEqual(after.elements, len(actual), delta=1)
+        self.assertEqual(plan.estimate, before)
+
+    def test_tiled_run_records_counts_only(self):
+        history = CostHistory(alpha=1.0)
+        model = CostModel(history=history, tile_bytes=1)
+        qb = builder(NodeQuery(filters=TagFilter("amenity", "cafe")))
+        with mock.patch.object(QueryBuilder, "request_tiled", lambda qb, rows, cols, max_workers: []):
+            plan, _ = qb.request_auto(model=model)
+        self.assertGreater(plan.rows, 1)
+        self.assertEqual(history.factors("*")[1], 1.0)
+
+    def setUp(self):
+        # Keep default histories out of the real cache directory
+        self.tmp = tempfile.TemporaryDirectory()
+        self.env = mock.patch.dict(os.environ, {"XDG_CACHE_HOME": self.tmp.name})
+        self.env.start()
+
+    def tearDown(self):
+        self.env.stop()
+        self.tmp.cleanup()
+
+    def run_auto(self, qb, count):
+        actual = [{"type": "node", "id": i} for i in range(count)]
+        with mock.patch.object(QueryBuilder, "iter_elements", lambda qb, chunk_size=None: iter(actual)):
+            return qb.request_auto()
+
+    def test_default_history_persists(self):
+        path = default_history_path()
+        self.assertEqual(path, os.path.join(self.tmp.name, "chauffeur", "cost_history.json"))
+        qb = builder(NodeQuery(filters=TagFilter("amenity", "cafe")))
+        before = qb.estimate()
+        self.run_auto(qb, int(before.elements / 4))
+        self.assertTrue(os.path.exists(path))
+        # Other builders learn into the same history, and a later run reads it back
+        self.assertLess(builder(NodeQuery(filters=TagFilter("amenity", "cafe"))).estimate().elements,
+                        before.elements)
+        self.assertLess(CostHistory(path).factors("*")[0], 1.0)
+
+    def test_history_beside_response_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = ResponseCache(os.path.join(tmp, "responses.db"))
+            qb = builder(NodeQuery(filters=TagFilter("amenity", "cafe")))
+            qb.cache = cache
+            self.run_auto(qb, 10)
+            cache.close()
+            self.assertTrue(os.path.exists(os.path.join(tmp, "cost_history.json")))
+        self.assertFalse(os.path.exists(default_history_path()))
+
+    def test_damaged_history(self):
+        path = os.path.join(self.tmp.name, "cost.json")
+        with open(path, "w") as f:
+            f.write("{not json")
+        self.assertEqual(len(CostHistory(path)), 0)
+
+    def test_default_model_per_builder(self):
+        a = builder(NodeQuery(filters=TagFilter("amenity", "cafe")))
+        b = builder(NodeQuery(filters=TagFilter("amenity", "cafe")))
+        a.estimate()
+        b.estimate()
+        self.assertIsNot(a.cost_model, b.cost_model)
+        self.assertIsNone(QueryBuilder.cost_model)
+        # A model set on the class is still shared by every builder that has none of its own
+        with mock.patch.object(QueryBuilder, "cost_model", CostModel()) as shared:
+            c = builder(NodeQuery(filters=TagFilter("amenity", "cafe")))
+            c.estimate()
+            self.assertIs(c.cost_model, shared)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,153 @@
+import os
+import json
+import datetime
+import tempfile
+import unittest
+from urllib.parse import parse_qs
+
+from chauffeur.query import QueryBuilder, NodeQuery
+from chauffeur.settings import QuerySettings
+from chauffeur.elements import ElementStream
+from chauffeur.diff import ChangeStream, ElementStore, RefreshError
+
+from tests.stubs import StubOverpassServer
+
+
+FULL = {
+    "osm3s": {"timestamp_osm_base": "2026-10-01T00:00:00Z"},
+    "elements": [
+        {"type": "node", "id": 1, "lat": 1.0, "lon": 1.0, "tags": {"amenity": "cafe"}},
+        {"type": "node", "id": 2, "lat": 2.0, "lon": 2.0, "tags": {"amenity": "bar"}},
+        {"type": "node", "id": 3, "lat": 3.0, "lon": 3.0, "tags": {"amenity": "pub"}},
+    ],
+}
+
+ADIFF = b'''<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6" generator="Overpass API">
+<meta osm_base="2026-10-02T00:00:00Z"/>
+<action type="create">
+  <node id="4" lat="4.0" lon="4.0" version="1"><tag k="amenity" v="cafe"/></node>
+</action>
+<action type="modify">
+  <old><node id="1" lat="1.0" lon="1.0" version="1"><tag k="amenity" v="cafe"/></node></old>
+  <new><node id="1" lat="1.5" lon="1.5" version="2"><tag k="amenity" v="cafe"/></node></new>
+</action>
+<action type="delete">
+  <old><node id="2" lat="2.0" lon="2.0" version="1"/></old>
+  <new><node id="2" visible="false" version="2"/></new>
+</action>
+</osm>
+'''
+
+DIFF = b'''<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6" generator="Overpass API">
+<meta osm_base="2026-10-02T00:00:00Z"/>
+<insert>
+  <node id="3" lat="3.5" lon="3.5"/>
+  <node id="5" lat="5.0" lon="5.0"/>
+</insert>
+<erase>
+  <node id="3" lat="3.0" lon="3.0"/>
+  <node id="1" lat="1.0" lon="1.0"/>
+</erase>
+</osm>
+'''
+
+
+class TestDiffSettings(unittest.TestCase):
+    def test_diff_settings(self):
+        qs = QuerySettings(diff=datetime.datetime(2026, 10, 1))
+        self.assertEqual(repr(qs), '[diff:"2026-10-01T00:00:00Z"];')
+        qs = QuerySettings(adiff=("2026-10-01T00:00:00Z", "2026-10-02T02:00:00+02:00"))
+        self.assertEqual(repr(qs), '[adiff:"2026-10-01T00:00:00Z","2026-10-02T00:00:00Z"];')
+        with self.assertRaises(ValueError):
+            qs.diff = "2026-10-01T00:00:00Z"
+
+    def test_diff_query(self):
+        qb = QueryBuilder(payload_format="json")
+        qb.qsx.append(NodeQuery(filters="[amenity]"))
+        diff = qb.diff_query("2026-10-01T00:00:00Z")
+        self.assertEqual(diff.raw_query_string, '[out:xml][adiff:"2026-10-01T00:00:00Z"];node[amenity];out qt;')
+        self.assertEqual(qb.raw_query_string, "[out:json];node[amenity];out qt;")
+        diff = diff.diff_query("2026-10-01T00:00:00Z", "2026-10-02T00:00:00Z", augmented=False)
+        self.assertTrue(diff.raw_query_string.startswith(
+            '[out:xml][diff:"2026-10-01T00:00:00Z","2026-10-02T00:00:00Z"];'))
+
+
+class TestChangeStream(unittest.TestCase):
+    def test_adiff(self):
+        stream = ChangeStream([ADIFF[i:i + 13] for i in range(0, len(ADIFF), 13)])
+        changes = list(stream)
+        self.assertEqual([c.action for c in changes], ["create", "modify", "delete"])
+        self.assertEqual(changes[1].new["lat"], 1.5)
+        self.assertEqual(changes[2].old["id"], 2)
+        self.assertEqual(stream.osm_base, "2026-10-02T00:00:00Z")
+
+    def test_plain_diff(self):
+        changes = list(ChangeStream([DIFF]))
+        self.assertEqual([(c.action, (c.old or c.new)["id"]) for c in changes],
+                         [("create", 3), ("create", 5), ("delete", 3), ("delete", 1)])
+
+
+class TestElementStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = ElementStore(os.path.join(self.tmp.name, "store.sqlite"))
+
+    def tearDown(self):
+        self.store.close()
+        self.tmp.cleanup()
+
+    def load_full(self):
+        self.store.load(ElementStream([json.dumps(FULL).encode()], payload_format="json"))
+
+    def test_apply_adiff(self):
+        self.load_full()
+        self.assertEqual(self.store.timestamp, "2026-10-01T00:00:00Z")
+        counts = self.store.apply(ChangeStream([ADIFF]))
+        self.assertEqual(counts, {"create": 1, "modify": 1, "delete": 1})
+        self.assertEqual(sorted(e["id"] for e in self.store), [1, 3, 4])
+        self.assertEqual(self.store.get("node", 1)["lat"], 1.5)
+        self.assertNotIn(("node", 2), self.store)
+        self.assertEqual(self.store.timestamp, "2026-10-02T00:00:00Z")
+
+    def test_apply_plain_diff(self):
+        self.load_full()
+        counts = self.store.apply(ChangeStream([DIFF]))
+        self.assertEqual(counts, {"create": 1, "modify": 1, "delete": 1})
+        self.assertEqual(sorted(e["id"] for e in self.store), [2, 3, 5])
+        self.assertEqual(self.store.get("node", 3)["lat"], 3.5)
+
+    def test_remark_rolls_back(self):
+        self.load_full()
+        broken = ADIFF.replace(b"</osm>", b"<remark>runtime error: Query timed out</remark></osm>")
+        with self.assertRaises(RefreshError):
+            self.store.apply(ChangeStream([broken]))
+        self.assertEqual(len(self.store), 3)
+        self.assertEqual(self.store.timestamp, "2026-10-01T00:00:00Z")
+
+
+class DiffServer(StubOverpassServer):
+    def respond(self, handler, body):
+        query = parse_qs(body.decode())["data"][0]
+        if "[adiff:" in query:
+            return 200, ADIFF, dict()
+        return 200, json.dumps(FULL).encode(), dict()
+
+
+class TestRefresh(unittest.TestCase):
+    def test_refresh(self):
+        with tempfile.TemporaryDirectory() as tmp, DiffServer() as server:
+            store = ElementStore(os.path.join(tmp, "store.sqlite"))
+            qb = QueryBuilder(payload_format="json")
+            qb.overpass_endpoint = server.url
+            qb.qsx.append(NodeQuery(filters="[amenity]"))
+            self.assertEqual(qb.refresh(store), {"create": 3, "modify": 0, "delete": 0})
+            self.assertEqual(qb.refresh(store), {"create": 1, "modify": 1, "delete": 1})
+            store.close()
+        queries = [parse_qs(r[3].decode())["data"][0] for r in server.requests]
+        self.assertEqual(queries[1], '[out:xml][adiff:"2026-10-01T00:00:00Z"];node[amenity];out qt;')
+
+
+if __name__ == "__main__":
+    unittest.main()
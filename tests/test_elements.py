@@ -0,0 +1,96 @@
+import json
+import unittest
+
+from chauffeur.elements import ElementStream, merge_elements, element_key
+
+
+XML_PAYLOAD = b'''<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6" generator="Overpass API">
+<note>The data included in this document is from www.openstreetmap.org.</note>
+<meta osm_base="2026-10-01T00:00:00Z"/>
+  <node id="1" lat="50.1" lon="7.1" version="3" timestamp="2020-01-01T00:00:00Z">
+    <tag k="amenity" v="school"/>
+  </node>
+  <way id="10">
+    <bounds minlat="50.1" minlon="7.1" maxlat="50.2" maxlon="7.2"/>
+    <nd ref="1" lat="50.1" lon="7.1"/>
+    <nd ref="2" lat="50.2" lon="7.2"/>
+    <tag k="highway" v="residential"/>
+  </way>
+  <relation id="100">
+    <center lat="50.15" lon="7.15"/>
+    <member type="way" ref="10" role="outer"/>
+  </relation>
+  <remark> runtime error: Query timed out </remark>
+</osm>
+'''
+
+JSON_PAYLOAD = {
+    "version": 0.6,
+    "generator": "Overpass API",
+    "osm3s": {"timestamp_osm_base": "2026-10-01T00:00:00Z", "copyright": "ODbL"},
+    "elements": [
+        {"type": "node", "id": 1, "lat": 50.1, "lon": 7.1, "tags": {"amenity": "school"}},
+        {"type": "way", "id": 10, "nodes": [1, 2],
+         "geometry": [{"lat": 50.1, "lon": 7.1}, {"lat": 50.2, "lon": 7.2}]},
+        {"type": "relation", "id": 100, "center": {"lat": 50.15, "lon": 7.15},
+         "members": [{"type": "way", "ref": 10, "role": "outer"}]},
+    ],
+    "remark": "runtime error: Query timed out",
+}
+
+
+def chunked(data, size):
+    return (data[i:i + size] for i in range(0, len(data), size))
+
+
+class TestElementStream(unittest.TestCase):
+    def test_xml(self):
+        stream = ElementStream(chunked(XML_PAYLOAD, 7), payload_format="xml")
+        elements = list(stream)
+        self.assertEqual([element_key(e) for e in elements],
+                         [("node", 1), ("way", 10), ("relation", 100)])
+        node, way, rel = elements
+        self.assertEqual(node["lat"], 50.1)
+        self.assertEqual(node["version"], 3)
+        self.assertEqual(node["tags"], {"amenity": "school"})
+        self.assertEqual(way["nodes"], [1, 2])
+        self.assertEqual(way["geometry"][1], {"lat": 50.2, "lon": 7.2})
+        self.assertEqual(way["bounds"]["maxlon"], 7.2)
+        self.assertEqual(rel["center"], {"lat": 50.15, "lon": 7.15})
+        self.assertEqual(rel["members"], [{"type": "way", "ref": 10, "role": "outer"}])
+        self.assertEqual(stream.osm_base, "2026-10-01T00:00:00Z")
+        self.assertEqual(stream.remark, "runtime error: Query timed out")
+
+    def test_json(self):
+        data = json.dumps(JSON_PAYLOAD, indent=1).encode()
+        for size in (1, 5, 4096):
+            stream = ElementStream(chunked(data, size), payload_format="json")
+            self.assertEqual(list(stream), JSON_PAYLOAD["elements"])
+            self.assertEqual(stream.osm_base, "2026-10-01T00:00:00Z")
+            self.assertEqual(stream.remark, "runtime error: Query timed out")
+
+    def test_xml_json_agree(self):
+        xml_elements = list(ElementStream([XML_PAYLOAD], payload_format="xml"))
+        json_elements = list(ElementStream([json.dumps(JSON_PAYLOAD).encode()], payload_format="json"))
+        self.assertEqual(xml_elements[2], json_elements[2])
+
+    def test_close(self):
+        closed = []
+        stream = ElementStream([XML_PAYLOAD], payload_format="xml", close=lambda: closed.append(True))
+        self.assertEqual(len(list(stream)), 3)
+        self.assertTrue(closed)
+
+    def test_unsupported_format(self):
+        with self.assertRaises(ValueError):
+            list(ElementStream([b""], payload_format="csv"))
+
+    def test_merge_elements(self):
+        a = [{"type": "node", "id": 1}, {"type": "way", "id": 1}]
+        b = [{"type": "node", "id": 1}, {"type": "node", "id": 2}]
+        self.assertEqual([element_key(e) for e in merge_elements([a, b])],
+                         [("node", 1), ("way", 1), ("node", 2)])
+
+
+if __name__ == "__main__":
+    unittest.main()
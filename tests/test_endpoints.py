@@ -0,0 +1,131 @@
+import time
+import unittest
+from unittest import mock
+
+from chauffeur.query import QueryBuilder, NodeQuery
+from chauffeur.endpoints import EndpointPool, percentile
+from chauffeur.transport import Transport
+from tests.stubs import StubOverpassServer
+
+
+PAYLOAD = b'{"elements": [{"type": "node", "id": 1, "lat": 1.0, "lon": 2.0}]}'
+
+
+def count(server):
+    return sum(1 for r in server.requests if r[0] == "POST")
+
+
+class TestEndpointPool(unittest.TestCase):
+    def setUp(self):
+        self.transport = Transport()
+
+    def tearDown(self):
+        self.transport.close()
+
+    def test_percentile(self):
+        self.assertEqual(percentile(range(100), 0.95), 95)
+        self.assertIsNone(percentile([], 0.5))
+
+    def test_requires_endpoints(self):
+        with self.assertRaises(ValueError):
+            EndpointPool([])
+
+    def test_latency_weighted(self):
+        with StubOverpassServer(PAYLOAD) as fast, StubOverpassServer(PAYLOAD, delay=0.5) as slow:
+            with EndpointPool([slow.url, fast.url], transport=self.transport) as pool:
+                for _ in range(30):
+                    self.assertEqual(pool.post("node(1);out;").status_code, 200)
+                metrics = pool.metrics()
+        self.assertGreaterEqual(count(fast), 20)
+        self.assertLess(metrics["endpoints"][fast.url]["latency"], metrics["endpoints"][slow.url]["latency"])
+
+    def test_passive_ejection_and_active_check(self):
+        with StubOverpassServer(PAYLOAD) as good, StubOverpassServer(PAYLOAD, failure_rate=1.0) as bad:
+            with EndpointPool([bad.url, good.url], transport=self.transport, max_failures=2) as pool:
+                for _ in range(20):
+                    pool.post("node(1);out;")
+                self.assertLessEqual(count(bad), 2)
+                self.assertTrue(pool.metrics()["endpoints"][bad.url]["ejected"])
+                self.assertEqual(pool.healthy()[0].url, good.url)
+                # The mirror recovers; its status page brings it back into rotation
+                bad.failure_rate = 0.0
+                self.assertEqual(pool.check(), {bad.url: True, good.url: True})
+                self.assertEqual(len(pool.healthy()), 2)
+
+    def test_all_ejected_still_sends(self):
+        with StubOverpassServer(PAYLOAD, failure_rate=1.0) as bad:
+            with EndpointPool([bad.url], transport=self.transport, max_failures=1) as pool:
+                self.assertEqual(pool.post("node(1);out;").status_code, 503)
+                self.assertEqual(pool.post("node(1);out;").status_code, 503)
+        self.assertEqual(count(bad), 2)
+
+    def test_hedged_request(self):
+        with StubOverpassServer(PAYLOAD) as fast, StubOverpassServer(PAYLOAD, delay=1.0) as slow:
+            with EndpointPool([slow.url, fast.url], transport=self.transport,
+                              hedge_quantile=0.95, hedge_delay=0.05) as pool:
+                slow_ep, fast_ep = pool.endpoints
+                with mock.patch.object(pool, "select", side_effect=[slow_ep, fast_ep]):
+                    start = time.monotonic()
+                    response = pool.post("node(1);out;")
+                    elapsed = time.monotonic() - start
+                metrics = pool.metrics()
+        self.assertEqual(response.status_code, 200)
+        self.assertLess(elapsed, 0.8)
+        self.assertEqual((metrics["hedges"], metrics["hedge_wins"]), (1, 1))
+        self.assertEqual((count(slow), count(fast)), (1, 1))
+
+    def test_hedge_loser_closed(self):
+        responses = []
+        post = self.transport.post
+
+        def capture(*args, **kwargs):
+            response = post(*args, **kwargs)
+            responses.append(response)
+            return response
+
+        with StubOverpassServer(PAYLOAD) as fast, StubOverpassServer(PAYLOAD, delay=0.3) as slow:
+            with EndpointPool([slow.url, fast.url], transport=self.transport,
+                              hedge_quantile=0.95, hedge_delay=0.05) as pool:
+                slow_ep, fast_ep = pool.endpoints
+                with mock.patch.object(self.transport, "post", side_effect=capture), \
+                        mock.patch.object(pool, "select", side_effect=[slow_ep, fast_ep]):
+                    response = pool.post("node(1);out;")
+                    time.sleep(0.6)
+        self.assertEqual(response.json()["elements"][0]["id"], 1)
+        self.assertTrue(response._content_consumed)
+        loser = [r for r in responses if r is not response][0]
+        # Dropped at the headers, with the body left unread
+        self.assertTrue(loser.raw.closed)
+        self.assertFalse(loser._content_consumed)
+
+    def test_hedge_fails_over_early(self):
+        with StubOverpassServer(PAYLOAD) as good, StubOverpassServer(PAYLOAD, failure_rate=1.0) as bad:
+            with EndpointPool([bad.url, good.url], transport=self.transport,
+                              hedge_quantile=0.95, hedge_delay=5.0) as pool:
+                bad_ep, good_ep = pool.endpoints
+                with mock.patch.object(pool, "select", side_effect=[bad_ep, good_ep]):
+                    start = time.monotonic()
+                    response = pool.post("node(1);out;")
+                    elapsed = time.monotonic() - start
+        self.assertEqual(response.status_code, 200)
+        self.assertLess(elapsed, 2.0)
+
+    def test_hedge_threshold_from_samples(self):
+        pool = EndpointPool(["http://a", "http://b"], hedge_quantile=0.5, hedge_delay=9.0)
+        self.assertEqual(pool.hedge_after(), 9.0)
+        pool.endpoints[0].samples.extend([0.1] * 10 + [0.3] * 10)
+        self.assertEqual(pool.hedge_after(), 0.3)
+        pool.close()
+
+    def test_query_builder(self):
+        with StubOverpassServer(PAYLOAD) as a, StubOverpassServer(PAYLOAD) as b:
+            qb = QueryBuilder(payload_format="json")
+            qb.qsx.append(NodeQuery(filters="[amenity]"))
+            qb.endpoints = EndpointPool([a.url, b.url], transport=self.transport)
+            self.assertEqual(list(qb.iter_elements())[0]["id"], 1)
+            qb.endpoints.close()
+        self.assertEqual(count(a) + count(b), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,140 @@
+import unittest
+
+try:
+    import numpy as np
+except ImportError: # pragma: no cover
+    np = None
+
+from chauffeur.query import QueryBuilder, NodeQuery, WayQuery, RelationQuery, NodeWayQuery
+from chauffeur.filters import TagFilter, BboxFilter, IdFilter, UserFilter, CompoundFilter
+from chauffeur.columnar import ElementTable
+from chauffeur.geometry import assemble_ways
+from chauffeur.formats import fmt
+from chauffeur.cost import CountFormatter
+from chauffeur.evaluate import evaluate, evaluate_statement, select, UnsupportedFilter
+
+
+AMENITIES = ["cafe", "bar", "pub", "school", "fast_food", "restaurant", "bank", "atm", "pharmacy",
+             "post_office", "library", "cinema", "theatre", "fuel", "parking", "toilets", "bench"]
+
+ELEMENTS = [
+    {"type": "node", "id": 1, "lat": 0.5, "lon": 0.5, "tags": {"amenity": "cafe", "name": "A"}},
+    {"type": "node", "id": 2, "lat": 5.0, "lon": 5.0, "tags": {"amenity": "bar"}},
+    {"type": "node", "id": 3, "lat": 0.2, "lon": 0.2, "tags": {"amenity": "cafeteria"}},
+    {"type": "node", "id": 4, "lat": 3.0, "lon": -1.0},
+    {"type": "node", "id": 5, "lat": 3.0, "lon": 3.0},
+    {"type": "node", "id": 6, "lat": 9.0, "lon": 9.0, "tags": {"amenity": "a b"}},
+    # Crosses the unit box without a node inside it
+    {"type": "way", "id": 10, "nodes": [4, 5], "tags": {"highway": "path"}},
+    {"type": "way", "id": 11, "nodes": [2, 6], "tags": {"highway": "road", "amenity": "parking"}},
+    {"type": "relation", "id": 100, "members": [{"type": "node", "ref": 1, "role": ""}],
+     "tags": {"amenity": "school"}},
+]
+
+
+def ids(table, mask):
+    return table.ids[mask].tolist()
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class TestEvaluate(unittest.TestCase):
+    def setUp(self):
+        self.table = assemble_ways(ElementTable.from_elements(ELEMENTS))
+
+    def test_tag_filters(self):
+        t = self.table
+        self.assertEqual(ids(t, evaluate(TagFilter("amenity"), t)), [1, 2, 3, 6, 11, 100])
+        self.assertEqual(ids(t, evaluate(TagFilter("!amenity"), t)), [4, 5, 10])
+        self.assertEqual(ids(t, evaluate(TagFilter("amenity", "cafe"), t)), [1])
+        self.assertEqual(ids(t, evaluate(TagFilter("amenity", "a b"), t)), [6])
+        self.assertEqual(ids(t, evaluate(TagFilter("amenity", ["cafe", "bar"]), t)), [1, 2])
+        self.assertEqual(ids(t, evaluate(TagFilter("amenity", ["cafe", "bar"], exists=False), t)),
+                         [3, 6, 11, 100])
+        self.assertEqual(ids(t, evaluate(TagFilter("shop", "x"), t)), [])
+
+    def test_trie_regex_values(self):
+        t = self.table
+        # Long lists compile to a trie regex; "cafeteria" must not match the "cafe" prefix
+        tf = TagFilter("amenity", AMENITIES)
+        self.assertIn("~", repr(tf))
+        self.assertEqual(ids(t, evaluate(tf, t)), [1, 2, 11, 100])
+
+    def test_bbox(self):
+        t = self.table
+        box = BboxFilter([0.0, 0.0, 1.0, 1.0])
+        self.assertEqual(ids(t, evaluate(box, t)), [1, 3, 100])
+        box = BboxFilter([0.0, 0.0, 3.5, 3.5])
+        self.assertEqual(ids(t, evaluate(box, t)), [1, 3, 5, 10, 100])
+        # Segment from (3, -1) to (3, 3) passes through the box
+        box = BboxFilter([2.0, 0.0, 4.0, 1.0])
+        self.assertEqual(ids(t, evaluate(box, t)), [10])
+
+    def test_ids_and_compound(self):
+        t = self.table
+        self.assertEqual(ids(t, evaluate(IdFilter([2, 10, 77]), t)), [2, 10])
+        cf = CompoundFilter([TagFilter("amenity"), BboxFilter([0.0, 0.0, 1.0, 1.0])])
+        self.assertEqual(ids(t, evaluate(cf, t)), [1, 3, 100])
+
+    def test_unsupported(self):
+        with self.assertRaises(UnsupportedFilter):
+            evaluate(UserFilter("(around:100)"), self.table)
+
+    def test_statements(self):
+        t = self.table
+        amenity_nodes = NodeQuery(filters=TagFilter("amenity"))
+        self.assertEqual(ids(t, evaluate_statement(amenity_nodes, t)), [1, 2, 3, 6])
+        both = NodeWayQuery(filters=TagFilter("amenity"))
+        self.assertEqual(ids(t, evaluate_statement(both, t)), [1, 2, 3, 6, 11])
+        union = amenity_nodes + RelationQuery(filters=TagFilter("amenity"))
+        self.assertEqual(ids(t, evaluate_statement(union, t)), [1, 2, 3, 6, 100])
+        diff = amenity_nodes - NodeQuery(filters=TagFilter("amenity", "cafe"))
+        self.assertEqual(ids(t, evaluate_statement(diff, t)), [2, 3, 6])
+
+    def test_select_dicts(self):
+        selected = select(ELEMENTS, TagFilter("highway", "path"))
+        self.assertEqual(list(selected)[0]["id"], 10)
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class TestSelectBuilder(unittest.TestCase):
+    def test_builder_matches_query(self):
+        qb = QueryBuilder(bbox=[0.0, 0.0, 3.5, 3.5])
+        qb.output_mode.VERBOSITY = fmt.Verbosity.CONCISE
+        qb.qsx.append(WayQuery(filters=TagFilter("highway")))
+        selected = qb.select(ELEMENTS)
+        # The way plus the nodes (._;>;) recurses down to
+        self.assertEqual(selected.ids.tolist(), [4, 5, 10])
+
+    def test_builder_without_recursion(self):
+        qb = QueryBuilder()
+        qb.qsx.append(NodeQuery(filters=TagFilter("amenity", "bar")))
+        self.assertEqual(qb.select(ELEMENTS).ids.tolist(), [2])
+
+
+    def test_named_sets(self):
+        qb = QueryBuilder()
+        qb.qsx.append(NodeQuery(filters=TagFilter("amenity", "cafe")), name="cafes")
+        qb.qsx.append(NodeQuery(filters=TagFilter("amenity", "bar")))
+        qb.qsx.append(WayQuery(filters=TagFilter("highway")), name="roads")
+        # A named set is not what out prints, but can be selected by its name
+        self.assertEqual(qb.select(ELEMENTS).ids.tolist(), [2])
+        self.assertEqual(qb.select(ELEMENTS, name="cafes").ids.tolist(), [1])
+        self.assertEqual(qb.select(ELEMENTS, name="roads").ids.tolist(), [10, 11])
+        with self.assertRaises(KeyError):
+            qb.select(ELEMENTS, name="pubs")
+
+    def test_unsupported_builders(self):
+        qb = QueryBuilder()
+        qb.qsx.append(NodeQuery(filters=TagFilter("amenity", "cafe")), name="cafes")
+        with self.assertRaises(UnsupportedFilter):
+            qb.select(ELEMENTS)
+        qb.qsx.append(NodeQuery(filters=TagFilter("amenity")))
+        qb.output_mode.ResultLimit = 1
+        with self.assertRaises(UnsupportedFilter):
+            qb.select(ELEMENTS)
+        qb.output_mode = CountFormatter()
+        with self.assertRaises(UnsupportedFilter):
+            qb.select(ELEMENTS)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+import io
+import csv
+import json
+import unittest
+from unittest import mock
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError: # pragma: no cover
+    pa = None
+
+from chauffeur.query import QueryBuilder
+from chauffeur.export import batched, export, CSVWriter, GeoJSONLinesWriter, ArrowWriter
+
+
+ELEMENTS = [
+    {"type": "node", "id": 1, "lat": 1.0, "lon": 2.0, "tags": {"amenity": "cafe", "name": "A, B"}},
+    {"type": "way", "id": 10, "center": {"lat": 3.0, "lon": 4.0}, "version": 2,
+     "geometry": [{"lat": 0.0, "lon": 0.0}, {"lat": 1.0, "lon": 1.0}]},
+    {"type": "way", "id": 11, "tags": {"building": "yes"},
+     "geometry": [{"lat": 0.0, "lon": 0.0}, {"lat": 0.0, "lon": 1.0},
+                  {"lat": 1.0, "lon": 1.0}, {"lat": 0.0, "lon": 0.0}]},
+    {"type": "relation", "id": 100, "members": []},
+]
+
+
+class TestBatched(unittest.TestCase):
+    def test_batched_is_lazy(self):
+        def gen():
+            for i in range(5):
+                yield i
+            raise AssertionError("read past the requested batches")
+
+        batches = batched(gen(), 2)
+        self.assertEqual(next(batches), [0, 1])
+        self.assertEqual(next(batches), [2, 3])
+        self.assertEqual(list(batched(range(5), 2)), [[0, 1], [2, 3], [4]])
+
+
+class TestWriters(unittest.TestCase):
+    def test_csv(self):
+        f = io.StringIO()
+        self.assertEqual(export(ELEMENTS, CSVWriter(f, tags=["amenity", "name"]), batch_size=3), 4)
+        rows = list(csv.reader(io.StringIO(f.getvalue())))
+        self.assertEqual(rows[0], ["type", "id", "lat", "lon", "amenity", "name"])
+        self.assertEqual(rows[1], ["node", "1", "1.0", "2.0", "cafe", "A, B"])
+        self.assertEqual(rows[2], ["way", "10", "3.0", "4.0", "", ""])
+        self.assertEqual(len(rows), 5)
+
+    def test_geojson_lines(self):
+        f = io.StringIO()
+        export(ELEMENTS, GeoJSONLinesWriter(f), batch_size=2)
+        features = [json.loads(line) for line in f.getvalue().splitlines()]
+        self.assertEqual(len(features), 4)
+        self.assertEqual(features[0]["id"], "node/1")
+        self.assertEqual(features[0]["geometry"], {"type": "Point", "coordinates": [2.0, 1.0]})
+        self.assertEqual(features[0]["properties"], {"amenity": "cafe", "name": "A, B"})
+        self.assertEqual(features[1]["geometry"]["type"], "LineString")
+        self.assertEqual(features[1]["properties"], {"@version": 2})
+        self.assertEqual(features[2]["geometry"]["type"], "Polygon")
+        self.assertIsNone(features[3]["geometry"])
+
+    def test_geojson_selected_tags(self):
+        f = io.StringIO()
+        export(ELEMENTS[:1], GeoJSONLinesWriter(f, tags=["name"]))
+        self.assertEqual(json.loads(f.getvalue())["properties"], {"name": "A, B"})
+
+    @unittest.skipIf(pa is None, "pyarrow is not installed")
+    def test_arrow_ipc(self):
+        sink = io.BytesIO()
+        export(ELEMENTS, ArrowWriter(sink, tags=["amenity"]), batch_size=3)
+        reader = pa.ipc.open_stream(sink.getvalue())
+        batches = list(reader)
+        self.assertEqual([b.num_rows for b in batches], [3, 1])
+        table = pa.Table.from_batches(batches)
+        self.assertEqual(table.column("id").to_pylist(), [1, 10, 11, 100])
+        self.assertEqual(table.column("amenity").to_pylist(), ["cafe", None, None, None])
+
+    @unittest.skipIf(pa is None, "pyarrow is not installed")
+    def test_parquet_row_groups(self):
+        sink = io.BytesIO()
+        export(ELEMENTS, ArrowWriter(sink, tags=["building"], format="parquet"), batch_size=2)
+        sink.seek(0)
+        parquet = pq.ParquetFile(sink)
+        self.assertEqual(parquet.metadata.num_row_groups, 2)
+        self.assertEqual(parquet.read().column("building").to_pylist(), [None, None, "yes", None])
+
+    @unittest.skipIf(pa is None, "pyarrow is not installed")
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            ArrowWriter(io.BytesIO(), format="feather")
+
+
+class TestQueryExport(unittest.TestCase):
+    def test_builder_export(self):
+        f = io.StringIO()
+        with mock.patch.object(QueryBuilder, "iter_elements", lambda qb, chunk_size=None: iter(ELEMENTS)):
+            count = QueryBuilder().export(CSVWriter(f), batch_size=2)
+        self.assertEqual(count, 4)
+        self.assertEqual(len(f.getvalue().splitlines()), 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
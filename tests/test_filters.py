@@ -1,3 +1,5 @@
+import copy
+import pickle
 import unittest
 
 from chauffeur.filters import Filter, CompoundFilter, GenericFilter
@@ -63,5 +65,63 @@ class TestGenericFilters(unittest.TestCase):
 
 
 
+class TestValueSemantics(unittest.TestCase):
+    def test_immutable_and_slotted(self):
+        tf = TagFilter("amenity", ["school", "college"])
+        self.assertFalse(hasattr(tf, "__dict__"))
+        with self.assertRaises(AttributeError):
+            tf.exists = False
+        with self.assertRaises(AttributeError):
+            IdFilter(1).osm_id = 2
+        self.assertIsInstance(tf.values, tuple)
+
+    def test_structural_equality(self):
+        self.assertEqual(TagFilter("amenity", ["school"]), TagFilter("amenity", ("school",)))
+        self.assertNotEqual(TagFilter("amenity", "school"), TagFilter("amenity", "school", exists=False))
+        self.assertNotEqual(IdFilter(1), UserFilter("(id:1)"))
+        self.assertEqual(BboxFilter([1, 2, 3, 4]), BboxFilter((1, 2, 3, 4)))
+        filters = {TagFilter("amenity", "school"), TagFilter("amenity", "school"), IdFilter(1)}
+        self.assertEqual(len(filters), 2)
+
+    def test_memoized_repr(self):
+        tf = TagFilter("amenity", ["school", "college"])
+        self.assertIs(repr(tf), repr(tf))
+        cf = CompoundFilter([tf, IdFilter(1)])
+        first = repr(cf)
+        self.assertIs(repr(cf), first)
+        cf.add_filter(IdFilter(2))
+        self.assertEqual(repr(cf), first + "(id:2)")
+
+    def test_compound_equality(self):
+        a = CompoundFilter([TagFilter("a"), TagFilter("b")])
+        b = TagFilter("a") + TagFilter("b")
+        self.assertEqual(a, b)
+        b += TagFilter("c")
+        self.assertNotEqual(a, b)
+        self.assertEqual(b, CompoundFilter([TagFilter("a"), TagFilter("b"), TagFilter("c")]))
+        # Mutable, so never usable as a key
+        with self.assertRaises(TypeError):
+            hash(a)
+
+    def test_frozen_compound_as_key(self):
+        cf = CompoundFilter([TagFilter("a", "1"), IdFilter(2)])
+        cache = {cf.freeze(): 1}
+        self.assertEqual(cache[(TagFilter("a", "1") + IdFilter(2)).freeze()], 1)
+        frozen = cf.freeze()
+        cf.add_filter(TagFilter("b"))
+        self.assertNotIn(cf.freeze(), cache)
+        self.assertEqual(repr(frozen), "[a=1](id:2)")
+        self.assertIs(repr(frozen), repr(frozen))
+        self.assertEqual(frozen.thaw(), CompoundFilter([TagFilter("a", "1"), IdFilter(2)]))
+        self.assertEqual(pickle.loads(pickle.dumps(frozen)), frozen)
+
+    def test_copy_and_pickle(self):
+        tf = TagFilter("amenity", ["school", "college"], exists=False)
+        self.assertIs(copy.deepcopy(tf), tf)
+        restored = pickle.loads(pickle.dumps(tf))
+        self.assertEqual(restored, tf)
+        self.assertEqual(repr(restored), repr(tf))
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,69 @@
+import json
+import unittest
+from unittest import mock
+
+try:
+    import numpy as np
+except ImportError: # pragma: no cover
+    np = None
+
+from chauffeur.query import QueryBuilder, WayQuery
+from chauffeur.formats import fmt
+from chauffeur.elements import ElementStream
+from chauffeur.columnar import ElementTable
+from chauffeur.geometry import NodeIndex, assemble_ways, coordinates, is_complete
+
+
+SKEL_ELEMENTS = [
+    {"type": "way", "id": 10, "nodes": [3, 1, 2]},
+    {"type": "way", "id": 11, "nodes": [2, 99]},
+    {"type": "node", "id": 2, "lat": 2.0, "lon": 20.0},
+    {"type": "node", "id": 1, "lat": 1.0, "lon": 10.0},
+    {"type": "node", "id": 3, "lat": 3.0, "lon": 30.0},
+]
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class TestNodeIndex(unittest.TestCase):
+    def test_lookup(self):
+        index = NodeIndex(np.array([5, 1, 3]), np.array([5.0, 1.0, 3.0]), np.array([50.0, 10.0, 30.0]))
+        lat, lon = index.lookup(np.array([3, 4, 1, 9, 0]))
+        np.testing.assert_array_equal(lat, [3.0, np.nan, 1.0, np.nan, np.nan])
+        np.testing.assert_array_equal(lon, [30.0, np.nan, 10.0, np.nan, np.nan])
+
+    def test_empty(self):
+        index = NodeIndex(np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0))
+        lat, _ = index.lookup(np.array([1]))
+        self.assertTrue(np.isnan(lat).all())
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class TestAssembleWays(unittest.TestCase):
+    def test_assemble(self):
+        table = assemble_ways(ElementTable.from_elements(SKEL_ELEMENTS))
+        np.testing.assert_array_equal(coordinates(table, 0), [[30.0, 3.0], [10.0, 1.0], [20.0, 2.0]])
+        self.assertEqual(table[0]["geometry"], [{"lat": 3.0, "lon": 30.0}, {"lat": 1.0, "lon": 10.0},
+                                                {"lat": 2.0, "lon": 20.0}])
+        self.assertEqual(table[1]["geometry"], [{"lat": 2.0, "lon": 20.0}, None])
+        self.assertEqual(is_complete(table).tolist(), [True, False, True, True, True])
+
+    def test_assemble_view(self):
+        table = ElementTable.from_elements(SKEL_ELEMENTS)
+        ways = assemble_ways(table[1:2], index=NodeIndex.from_table(table))
+        self.assertEqual(ways.nodes.offsets.tolist(), [0, 2])
+        self.assertEqual(ways[0]["geometry"][0], {"lat": 2.0, "lon": 20.0})
+
+    def test_request_table_assembles(self):
+        qb = QueryBuilder(payload_format="json")
+        qb.output_mode.VERBOSITY = fmt.Verbosity.CONCISE
+        qb.qsx.append(WayQuery(filters="[highway]"))
+        self.assertIn("(._;>;);out skel", qb.raw_query_string)
+        payload = json.dumps({"elements": SKEL_ELEMENTS}).encode()
+        stream = ElementStream([payload], payload_format="json")
+        with mock.patch.object(QueryBuilder, "iter_elements", lambda qb, chunk_size=None: stream):
+            table = qb.request_table(assemble=True)
+        self.assertEqual(len(table[0]["geometry"]), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
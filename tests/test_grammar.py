@@ -4,7 +4,12 @@ import collections.abc
 from chauffeur.grammar import OSMElement, Node, Way, Relation
 from chauffeur.grammar import AbstractQueryStatement, GenericElementQuery, BaseQuerySet
 from chauffeur.grammar import UnionQuerySet, DifferenceQuerySet, CompoundQuery
-from chauffeur.filters import CompoundFilter
+from chauffeur.filters import CompoundFilter, TagFilter
+
+
+class NodeElementQuery(GenericElementQuery):
+    __slots__ = ()
+    _element = Node
 
 
 class TestOSMElements(unittest.TestCase):
@@ -67,6 +72,46 @@ class TestBaseQueryObjects(unittest.TestCase):
         self.assertTrue(issubclass(DifferenceQuerySet, BaseQuerySet))
 
 
+class TestStructuralEquality(unittest.TestCase):
+    def test_element_query(self):
+        a = NodeElementQuery(filters=TagFilter("amenity", "school"))
+        b = NodeElementQuery(filters=TagFilter("amenity", "school"))
+        self.assertFalse(hasattr(a, "__dict__"))
+        self.assertEqual(a, b)
+        self.assertNotEqual(a, NodeElementQuery(filters=TagFilter("amenity", "college")))
+        b.filters.add_filter(TagFilter("name"))
+        self.assertNotEqual(a, b)
+        with self.assertRaises(TypeError):
+            hash(a)
+
+    def test_query_sets(self):
+        a = NodeElementQuery(filters=TagFilter("amenity", "school"))
+        b = NodeElementQuery(filters=TagFilter("shop"))
+        self.assertEqual(a + b, UnionQuerySet([a, b]))
+        self.assertNotEqual(a + b, b + a)
+        self.assertNotEqual(a + b, a - b)
+        with self.assertRaises(TypeError):
+            hash(a + b)
+
+    def test_frozen_statements_as_keys(self):
+        a = NodeElementQuery(filters=TagFilter("amenity", "school"))
+        b = NodeElementQuery(filters=TagFilter("shop"))
+        cache = {(a + b).freeze(): "union", a.freeze(): "node", (a - b).freeze(): "difference"}
+        self.assertEqual(cache[UnionQuerySet([NodeElementQuery(filters=TagFilter("amenity", "school")), b]).freeze()],
+                         "union")
+        self.assertEqual(cache[NodeElementQuery(filters=TagFilter("amenity", "school")).freeze()], "node")
+        self.assertEqual(cache[(a - b).freeze()], "difference")
+        # The snapshot is unaffected by later changes to the statement
+        frozen = a.freeze()
+        a.add_filter(TagFilter("name"))
+        self.assertNotIn(a.freeze(), cache)
+        self.assertEqual(repr(frozen), "node[amenity=school];")
+        self.assertIs(repr(frozen), repr(frozen))
+        self.assertEqual(frozen.thaw(), NodeElementQuery(filters=TagFilter("amenity", "school")))
+        with self.assertRaises(AttributeError):
+            frozen.parts = ()
+
+
 
 if __name__ == "__main__":
     unittest.main()
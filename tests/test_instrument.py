@@ -0,0 +1,174 @@
+import json
+import asyncio
+import unittest
+import urllib.request
+
+try:
+    import numpy as np
+except ImportError: # pragma: no cover
+    np = None
+
+from chauffeur.query import QueryBuilder, NodeQuery
+from chauffeur.filters import TagFilter
+from chauffeur.elements import ElementStream
+from chauffeur.singleflight import SingleFlight
+from chauffeur.columnar import ElementTableBuilder
+from chauffeur.instrument import (Instruments, InstrumentedStream, MetricsAggregator, Histogram, Span,
+                                  prometheus_text, start_http_server)
+from tests.stubs import StubOverpassServer
+
+
+ELEMENTS = [{"type": "node", "id": i, "lat": 1.0, "lon": 2.0} for i in range(50)]
+ELEMENTS.append({"type": "way", "id": 100, "nodes": [1, 2]})
+PAYLOAD = json.dumps({"elements": ELEMENTS}).encode()
+
+
+class InlineScheduler:
+    def submit(self, send, stream=False):
+        return send()
+
+    async def asubmit(self, send):
+        return await send()
+
+
+def make_builder(endpoint):
+    qb = QueryBuilder(payload_format="json")
+    qb.overpass_endpoint = endpoint
+    qb.qsx.append(NodeQuery(filters=TagFilter("amenity", "school")))
+    return qb
+
+
+class TestInstrumentation(unittest.TestCase):
+    def setUp(self):
+        self.instruments = Instruments()
+        self.spans = list()
+        self.instruments.subscribe(self.spans.append)
+
+    def phases(self):
+        return [s.phase for s in self.spans]
+
+    def test_unsubscribed_is_untouched(self):
+        hub = Instruments()
+        with StubOverpassServer(payload=PAYLOAD) as server:
+            qb = make_builder(server.url)
+            qb.instruments = hub
+            stream = qb.iter_elements()
+            self.assertIs(type(stream), ElementStream)
+            list(stream)
+
+    def test_streamed_phases(self):
+        with StubOverpassServer(payload=PAYLOAD) as server:
+            qb = make_builder(server.url)
+            qb.instruments = self.instruments
+            stream = qb.iter_elements(chunk_size=100)
+            self.assertIsInstance(stream, InstrumentedStream)
+            self.assertEqual(len(list(stream)), 51)
+        self.assertEqual(self.phases(), ["compile", "ttfb", "transfer", "parse"])
+        compile_, ttfb, transfer, parse = self.spans
+        self.assertEqual(ttfb.status, 200)
+        self.assertEqual(ttfb.endpoint, server.url)
+        self.assertEqual(transfer.bytes, len(PAYLOAD))
+        self.assertEqual(parse.counts, {"node": 50, "way": 1})
+        self.assertTrue(all(s.seconds >= 0 for s in self.spans))
+
+    @unittest.skipIf(np is None, "numpy is not installed")
+    def test_fill_counts_elements(self):
+        stream = InstrumentedStream(self.instruments, [PAYLOAD], payload_format="json")
+        self.assertEqual(len(stream.fill(ElementTableBuilder())), 51)
+        self.assertEqual(self.spans[-1].counts, {"node": 50, "way": 1})
+
+    def test_queue_and_unstreamed_request(self):
+        with StubOverpassServer(payload=PAYLOAD) as server:
+            qb = make_builder(server.url)
+            qb.instruments = self.instruments
+            qb.scheduler = InlineScheduler()
+            qb.request()
+        self.assertEqual(self.phases(), ["compile", "queue", "ttfb", "transfer"])
+        self.assertEqual(self.spans[-1].bytes, len(PAYLOAD))
+
+    def test_async_request(self):
+        with StubOverpassServer(payload=PAYLOAD) as server:
+            qb = make_builder(server.url)
+            qb.instruments = self.instruments
+            qb.scheduler = InlineScheduler()
+            asyncio.run(qb.arequest())
+        self.assertEqual(self.phases(), ["compile", "queue", "ttfb", "transfer"])
+        ttfb, transfer = self.spans[-2:]
+        self.assertEqual((ttfb.endpoint, ttfb.status), (server.url, 200))
+        self.assertEqual(transfer.bytes, len(PAYLOAD))
+
+    def test_async_connection_error(self):
+        qb = make_builder("http://127.0.0.1:9/api/interpreter")
+        qb.instruments = self.instruments
+        with self.assertRaises(Exception):
+            asyncio.run(qb.arequest())
+        self.assertEqual(self.spans[-1].phase, "ttfb")
+        self.assertIsNotNone(self.spans[-1].error)
+
+    def test_connection_error(self):
+        qb = make_builder("http://127.0.0.1:9/api/interpreter")
+        qb.instruments = self.instruments
+        with self.assertRaises(Exception):
+            qb.request()
+        self.assertEqual(self.spans[-1].phase, "ttfb")
+        self.assertEqual(self.spans[-1].error, "ConnectionError")
+
+    def test_coalesced_bytes_counted_once(self):
+        with StubOverpassServer(payload=PAYLOAD) as server:
+            qb = make_builder(server.url)
+            qb.instruments = self.instruments
+            qb.singleflight = SingleFlight()
+            list(qb.iter_elements())
+        self.assertEqual(self.phases(), ["compile", "ttfb", "transfer", "parse"])
+
+    def test_unsubscribe(self):
+        self.instruments.unsubscribe(self.spans.append)
+        self.assertFalse(self.instruments.active)
+
+
+class TestAggregation(unittest.TestCase):
+    def test_histogram_percentile(self):
+        h = Histogram(buckets=(1.0, 2.0, 4.0, float("inf")))
+        for v in (0.5,) * 50 + (1.5,) * 40 + (3.0,) * 9 + (100.0,):
+            h.observe(v)
+        self.assertAlmostEqual(h.percentile(0.5), 1.0)
+        self.assertAlmostEqual(h.percentile(0.7), 1.5)
+        self.assertEqual(h.percentile(1.0), 4.0)
+        self.assertIsNone(Histogram().percentile(0.5))
+
+    def test_aggregator_and_prometheus(self):
+        agg = MetricsAggregator()
+        agg(Span("ttfb", 0.2, endpoint="http://a", status=200))
+        agg(Span("ttfb", 0.4, endpoint='http://b"q', status=504))
+        agg(Span("transfer", 0.1, endpoint="http://a", bytes=1000))
+        agg(Span("parse", 0.05, endpoint="http://a", counts={"node": 3, "way": 1}))
+        agg(Span("parse", 0.05, endpoint="http://a", counts={"node": 2}, error="ValueError"))
+        self.assertEqual(agg.elements, {"node": 5, "way": 1})
+        self.assertLessEqual(agg.percentile("ttfb", 0.5), 0.25)
+        self.assertEqual(set(agg.summary()), {"ttfb", "transfer", "parse"})
+        text = prometheus_text(agg)
+        self.assertIn('chauffeur_phase_seconds_bucket{phase="ttfb",endpoint="http://a",le="0.25"} 1', text)
+        self.assertIn('chauffeur_phase_seconds_bucket{phase="ttfb",endpoint="http://a",le="+Inf"} 1', text)
+        self.assertIn('chauffeur_phase_seconds_count{phase="parse",endpoint="http://a"} 2', text)
+        self.assertIn('chauffeur_received_bytes_total{endpoint="http://a"} 1000', text)
+        self.assertIn('chauffeur_elements_total{type="node"} 5', text)
+        self.assertIn('chauffeur_responses_total{endpoint="http://b\\"q",status="504"} 1', text)
+        self.assertIn('chauffeur_errors_total{phase="parse",error="ValueError"} 1', text)
+        self.assertIn("# TYPE chauffeur_phase_seconds histogram", text)
+
+    def test_http_exporter(self):
+        agg = MetricsAggregator()
+        agg(Span("compile", 0.001))
+        server = start_http_server(agg, 0)
+        try:
+            host, port = server.server_address[:2]
+            with urllib.request.urlopen(f'''http://{host}:{port}/metrics''') as response:
+                body = response.read().decode()
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertIn('chauffeur_phase_seconds_count{phase="compile",endpoint=""} 1', body)
+
+
+if __name__ == "__main__":
+    unittest.main()
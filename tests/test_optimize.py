@@ -0,0 +1,117 @@
+import unittest
+
+from chauffeur.optimize import optimize_filters, optimize_statement, QueryContradiction
+from chauffeur.query import QueryBuilder, NodeQuery, WayQuery, NodeWayRelationQuery
+from chauffeur.filters import TagFilter, BboxFilter, IdFilter, UserFilter, CompoundFilter
+from chauffeur.grammar import UnionQuerySet
+
+
+class TestFilterOptimizer(unittest.TestCase):
+    def test_drops_duplicates_and_implied(self):
+        cf = CompoundFilter([TagFilter("amenity"), TagFilter("amenity", "school"),
+                             TagFilter("amenity", "school"), UserFilter("[name]"), UserFilter("[name]")])
+        self.assertEqual(repr(optimize_filters(cf)), '[amenity=school][name]')
+
+    def test_intersects_value_lists(self):
+        cf = CompoundFilter([TagFilter("amenity", ["school", "college", "university"]),
+                             TagFilter("amenity", ["college", "university"]),
+                             TagFilter("amenity", ["university"], exists=False)])
+        self.assertEqual(repr(optimize_filters(cf)), '[amenity=college]')
+
+    def test_merges_exclusions(self):
+        cf = CompoundFilter([TagFilter("shop", "alcohol", exists=False),
+                             TagFilter("shop", ["bakery"], exists=False)])
+        self.assertEqual(repr(optimize_filters(cf)), '[shop][shop!~"^(alcohol|bakery)$"]')
+
+    def test_contradictions(self):
+        with self.assertRaises(QueryContradiction):
+            optimize_filters(CompoundFilter([TagFilter("amenity", "school"), TagFilter("amenity", exists=False)]))
+        with self.assertRaises(QueryContradiction):
+            optimize_filters(CompoundFilter([TagFilter("amenity", "school"), TagFilter("amenity", "bar")]))
+        with self.assertRaises(QueryContradiction):
+            optimize_filters(CompoundFilter([BboxFilter([0, 0, 1, 1]), BboxFilter([2, 2, 3, 3])]))
+        with self.assertRaises(QueryContradiction):
+            optimize_filters(CompoundFilter([IdFilter(1), IdFilter(2)]))
+
+    def test_id_sets_intersect(self):
+        f = optimize_filters(CompoundFilter([IdFilter([1, 2, 3]), IdFilter([3, 2, 9])]))
+        self.assertEqual(repr(f), "(id:2,3)")
+        with self.assertRaises(QueryContradiction):
+            optimize_filters(CompoundFilter([IdFilter([1, 2]), IdFilter([3])]))
+
+    def test_intersects_bboxes(self):
+        cf = CompoundFilter([BboxFilter([0, 0, 2, 2]), BboxFilter([1, 1, 3, 3])])
+        self.assertEqual(list(optimize_filters(cf)), [BboxFilter([1, 1, 2, 2])])
+
+    def test_union_merge(self):
+        union = UnionQuerySet([NodeQuery(filters=TagFilter("amenity", "cafe")),
+                               NodeQuery(filters=TagFilter("amenity", "bar")),
+                               NodeQuery(filters=TagFilter("amenity", "cafe")),
+                               WayQuery(filters=TagFilter("amenity", "cafe"))])
+        self.assertEqual(repr(optimize_statement(union)), '(node[amenity~"^(cafe|bar)$"];way[amenity=cafe];);')
+
+    def test_union_merge_never_crosses_keys(self):
+        # Once a holds both values, the first statement no longer differs from the third in b alone
+        union = UnionQuerySet([NodeQuery(filters=(TagFilter("a", "1"), TagFilter("b", "1"))),
+                               NodeQuery(filters=(TagFilter("a", "2"), TagFilter("b", "1"))),
+                               NodeQuery(filters=(TagFilter("a", "1"), TagFilter("b", "2")))])
+        self.assertEqual(repr(optimize_statement(union)), '(node[a~"^(1|2)$"][b=1];node[a=1][b=2];);')
+
+
+    def test_nested_unions_flatten(self):
+        union = (NodeQuery(filters=(TagFilter("amenity", "cafe"), TagFilter("amenity"))) +
+                 NodeQuery(filters=TagFilter("amenity", "bar"))) + WayQuery(filters=TagFilter("amenity", "bar"))
+        self.assertEqual(repr(optimize_statement(union)), '(node[amenity~"^(cafe|bar)$"];way[amenity=bar];);')
+        single = NodeQuery(filters=TagFilter("amenity", "cafe")) + NodeQuery(filters=TagFilter("amenity", "bar"))
+        self.assertEqual(repr(optimize_statement(single)), 'node[amenity~"^(cafe|bar)$"];')
+
+    def test_union_merge_respects_names_and_inputs(self):
+        union = UnionQuerySet([NodeQuery(name="a", filters=TagFilter("amenity", "cafe")),
+                               NodeQuery(name="b", filters=TagFilter("amenity", "bar"))])
+        self.assertEqual(len(optimize_statement(union).query_statements), 2)
+        first, second = NodeQuery(filters=TagFilter("amenity", "cafe")), NodeQuery(filters=TagFilter("amenity", "bar"))
+        first._inputs, second._inputs = ["x"], ["y"]
+        self.assertEqual(len(optimize_statement(UnionQuerySet([first, second])).query_statements), 2)
+        # Equal filters over different inputs are different statements
+        third = NodeQuery(filters=TagFilter("amenity", "cafe"))
+        third._inputs = ["y"]
+        self.assertNotEqual(first, third)
+        self.assertEqual(len(optimize_statement(UnionQuerySet([first, third])).query_statements), 2)
+
+class TestQueryBuilderOptimize(unittest.TestCase):
+    def test_opt_in(self):
+        qb = QueryBuilder()
+        qb.qsx.append(NodeQuery(filters=(TagFilter("amenity", "cafe"), TagFilter("amenity"))))
+        self.assertEqual(qb.raw_query_string, "node[amenity=cafe][amenity];out qt;")
+        qb.optimize_queries = True
+        self.assertEqual(qb.raw_query_string, "node[amenity=cafe];out qt;")
+
+    def test_lifts_common_bbox(self):
+        qb = QueryBuilder(optimize_queries=True)
+        bbox = BboxFilter([50.6, 7.0, 50.8, 7.3])
+        q = NodeQuery(filters=(TagFilter("amenity", "school"), bbox)) + \
+            WayQuery(filters=(bbox, TagFilter("amenity", "school")))
+        qb.qsx.append(q)
+        self.assertEqual(qb.raw_query_string,
+                         '[bbox:50.60000000,7.00000000,50.80000000,7.30000000];'
+                         '(node[amenity=school];way[amenity=school];);out qt;')
+        # The builder itself is left untouched
+        self.assertIsNone(qb.GlobalBoundingBox)
+        self.assertIn(repr(bbox), repr(qb.qsx))
+
+    def test_keeps_distinct_bboxes(self):
+        qb = QueryBuilder()
+        qb.qsx.append(NodeQuery(filters=BboxFilter([0, 0, 1, 1])) + NodeQuery(filters=BboxFilter([1, 1, 2, 2])))
+        self.assertIsNone(qb.optimize()[0].bbox)
+
+    def test_contradiction_never_compiles(self):
+        qb = QueryBuilder(optimize_queries=True)
+        qb.qsx.append(NodeWayRelationQuery(filters=(TagFilter("amenity", "school"), TagFilter("!amenity"))))
+        with self.assertRaises(QueryContradiction):
+            qb.raw_query_string
+        qb.optimize_queries = False
+        self.assertIn("[!amenity]", qb.raw_query_string)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,145 @@
+import datetime
+import unittest
+
+from chauffeur.query import QueryBuilder, NodeQuery, WayQuery, RelationQuery, NodeWayRelationQuery
+from chauffeur.filters import TagFilter, BboxFilter, IdFilter, UserFilter
+from chauffeur.grammar import UnionQuerySet, Way
+from chauffeur.formats import fmt
+from chauffeur.cost import CountFormatter
+from chauffeur.parser import parse, canonicalize, literal_values, ParseError
+
+
+TYPICAL = ('[out:json][timeout:25];(node["amenity"="cafe"](50.7,7.1,50.8,7.2);'
+           'way["amenity"="cafe"](50.7,7.1,50.8,7.2););out body;')
+
+
+def builders():
+    qb = QueryBuilder(basic_optimize=False, payload_format="json", timeout=25, maxsize=1024)
+    qb.qsx.append(NodeQuery(filters=[TagFilter("amenity", ["cafe", "bar"]), BboxFilter([1, 2, 3, 4])]))
+    yield qb, True
+    qb = QueryBuilder(basic_optimize=False, date=datetime.datetime(2020, 1, 1), bbox=[1.5, 2, 3, 4])
+    qb.qsx.append(WayQuery(filters=[TagFilter("highway", ["footway", "path"], exists=False), TagFilter("!area")]),
+                  name="ways")
+    qb.qsx.append(WayQuery(filters=TagFilter("addr:street", "Main Street")) - WayQuery(filters=IdFilter([1, 2])))
+    qb.output_mode.VERBOSITY = fmt.Verbosity.CONCISE
+    yield qb, True
+    qb = QueryBuilder(basic_optimize=False, adiff=("2020-01-01T00:00:00Z", "2020-02-01T00:00:00Z"))
+    values = [f'''v{i}''' for i in range(40)]
+    qb.qsx.append(UnionQuerySet([RelationQuery(filters=TagFilter("type", values)),
+                                 NodeWayRelationQuery(filters=[UserFilter("(around:100,1.0,2.0)"), IdFilter(7)])]))
+    qb.include_geometries()
+    qb.output_mode.ResultLimit = 5
+    # Trie compressed value lists come back as a UserFilter holding the same regex
+    yield qb, False
+
+
+class TestParse(unittest.TestCase):
+    def test_round_trip(self):
+        for qb, same_objects in builders():
+            query = qb.raw_query_string
+            parsed = parse(query)
+            self.assertEqual(parsed.raw_query_string, query)
+            if same_objects:
+                self.assertEqual(parsed.qsx.qc, qb.qsx.qc)
+
+    def test_grammar_objects(self):
+        qb = parse(TYPICAL)
+        self.assertEqual(qb.settings.payload_format, "json")
+        self.assertEqual(qb.settings.timeout, 25)
+        union, = qb.qsx.qc
+        self.assertIsInstance(union, UnionQuerySet)
+        node, way = union.query_statements
+        self.assertEqual(node, NodeQuery(filters=[TagFilter("amenity", "cafe"), BboxFilter([50.7, 7.1, 50.8, 7.2])]))
+        self.assertIsInstance(way, WayQuery)
+        self.assertIs(qb.output_mode.VERBOSITY, fmt.Verbosity.GENERIC)
+        self.assertIs(qb.output_mode.SORTORDER, fmt.SortOrder.OBJECT_ID)
+
+    def test_filters(self):
+        qb = parse('''nwr [ 'name' ~ "^(A|B\\\\.c)$" ][k][k!=v](id: 1, 2)(5)[t~"x",i](around:100, 1.5,2)[!fixme];out;''')
+        self.assertEqual(list(qb.qsx.qc[0].filters), [
+            TagFilter("name", ["A", "B.c"]),
+            TagFilter("k", "v", exists=False),
+            IdFilter([1, 2]),
+            IdFilter(5),
+            UserFilter('[t~"x",i]'),
+            UserFilter("(around:100,1.5,2)"),
+            TagFilter("!fixme"),
+        ])
+        # Without a [k] to fold into, [k!=v] also matches elements lacking k
+        qb = parse('node[k!=v]["a b"][~"^n"~"."];out;')
+        self.assertEqual(list(qb.qsx.qc[0].filters),
+                         [UserFilter("[k!=v]"), UserFilter('["a b"]'), UserFilter('[~"^n"~"."]')])
+
+    def test_literal_values(self):
+        self.assertEqual(literal_values("^(a|b\\|c)$"), ["a", "b|c"])
+        self.assertEqual(literal_values("^cafe$"), ["cafe"])
+        self.assertIsNone(literal_values("^ca.e$"))
+        self.assertIsNone(literal_values("cafe"))
+
+    def test_settings_and_output(self):
+        qb = parse('[date:"2020-01-01T01:00:00+01:00"][diff:"2019-01-01T00:00:00Z"];node[a];out count;')
+        self.assertEqual(qb.settings.date, datetime.datetime(2020, 1, 1))
+        self.assertEqual(qb.settings.diff, "2019-01-01T00:00:00Z")
+        self.assertIsInstance(qb.output_mode, CountFormatter)
+        qb = parse("/* tagged */ way[a]; // recurse\n(._;>;);out meta bb qt 3;")
+        self.assertTrue(qb._recurse_down(qb.qsx.output))
+        self.assertTrue(qb.raw_query_string.endswith("(._;>;);out meta bb qt 3;"))
+        self.assertFalse(parse("way[a];out skel;")._recurse_down(Way))
+
+    def test_from_query(self):
+        query = '(node[a=b](1,2,3,4);node[a=c](1,2,3,4););out qt;'
+        qb = QueryBuilder.from_query(query, timeout=60)
+        self.assertIsInstance(qb, QueryBuilder)
+        self.assertEqual(qb.raw_query_string, '[timeout:60];(node[a=b](1.00000000,2.00000000,3.00000000,4.00000000);'
+                                              'node[a=c](1.00000000,2.00000000,3.00000000,4.00000000););out qt;')
+        qb = QueryBuilder.from_query(query, optimize_queries=True, timeout=60)
+        self.assertEqual(qb.raw_query_string, '[timeout:60][bbox:1.00000000,2.00000000,3.00000000,4.00000000];'
+                                              'node[a~"^(b|c)$"];out qt;')
+
+    def test_errors(self):
+        for query in ("node[a", "out;", "node.a[x];out;", "node[a];out;out;", "[csv:x];node;out;",
+                      "node[a]->.x;out;", "node(x;out;", "[timeout:1.5];node;out;", "node[a]"):
+            with self.assertRaises(ParseError, msg=query):
+                parse(query)
+        with self.assertRaisesRegex(ParseError, "position 7"):
+            parse("node[a=];out;")
+
+
+class TestCanonicalize(unittest.TestCase):
+    def test_equivalent_queries(self):
+        variants = [
+            TYPICAL,
+            '''[timeout:25] [out:json];
+               ( way['amenity'='cafe'] (50.7, 7.1, 50.8, 7.2) ;
+                 node[amenity=cafe](50.70,7.10,50.80,7.20); );
+               out;''',
+            '[out:json][timeout:25];(node(50.7,7.1,50.8,7.2)[amenity~"^(cafe)$"];'
+            'way(50.7,7.1,50.8,7.2)[amenity=cafe][amenity];);out;',
+        ]
+        self.assertEqual(len({canonicalize(q) for q in variants}), 1)
+        self.assertNotEqual(canonicalize(TYPICAL), canonicalize(TYPICAL.replace("cafe", "bar")))
+
+    def test_distinct_unions(self):
+        three = "(node[a=1][b=1];node[a=2][b=1];node[a=1][b=2];);out;"
+        four = "(node[a=1][b=1];node[a=2][b=1];node[a=1][b=2];node[a=2][b=2];);out;"
+        self.assertNotEqual(canonicalize(three), canonicalize(four))
+        self.assertEqual(canonicalize(three), canonicalize("(node[b=2][a=1];node[b=1][a=2];node[a=1][b=1];);out;"))
+
+    def test_value_lists_are_sets(self):
+        keys = {canonicalize(q) for q in ('node[k~"^(a|b)$"];out;', 'node[k~"^(b|a)$"];out;',
+                                          "node[k~'^(b|a|b)$'][k];out;")}
+        self.assertEqual(keys, {'node[k~"^(a|b)$"];out;'})
+        self.assertEqual(canonicalize('(node[k~"^(a|b)$"];node[k~"^(b|a)$"];);out;'), '(node[k~"^(a|b)$"];);out;')
+
+    def test_contradiction_is_not_rejected(self):
+        # Canonicalizing never runs the optimizer, so a query that can never match still gets a key
+        self.assertEqual(canonicalize("node[!a][a=1];out;"), canonicalize("node[a=1][!a];out;"))
+
+    def test_order_within_difference_is_kept(self):
+        a = canonicalize("(node[a]; - node[b];);out;")
+        b = canonicalize("(node[b]; - node[a];);out;")
+        self.assertNotEqual(a, b)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -119,9 +119,13 @@ class TestQueryBuilder(unittest.TestCase):
         self.assertEqual(self.qb.qsx.output, self.nwrq._output)
         self.assertEqual(repr(self.qb.qsx), repr(self.nwrq))
 
-    @unittest.skip("Experimental Interface")
     def test_named_query_assignment(self):
-        pass
+        nq = NodeQuery(filters=self.tf_rail)
+        self.qb.qsx.append(nq, name="stations")
+        self.qb.qsx.append(self.nwrq)
+        self.assertIs(self.qb.qsx.r["stations"], nq)
+        self.assertIs(self.qb.qsx._dset, self.nwrq)
+        self.assertEqual(repr(self.qb.qsx), f'''node{self.tf_rail}->.stations;{self.nwrq}''')
 
     @unittest.skip("Experimental Interface")
     def test_dynamic_statement_chaining(self):
@@ -0,0 +1,93 @@
+import re
+import random
+import string
+import unittest
+
+from chauffeur.regex import compile_values, split_values, trie_regex, quote, unquote, escape
+from chauffeur.regex import TRIE_THRESHOLD
+from chauffeur.filters import TagFilter, format_values
+from chauffeur.query import NodeQuery
+
+
+def matches_exactly(testcase, regexes, values, probes):
+    compiled = [re.compile(unquote(quote(r))) for r in regexes]
+    values = set(values)
+    for probe in set(probes) | values:
+        matched = any(r.fullmatch(probe) for r in compiled)
+        testcase.assertEqual(matched, probe in values, probe)
+
+
+class TestTrieRegex(unittest.TestCase):
+    def setUp(self):
+        rng = random.Random(7)
+        alphabet = string.ascii_lowercase[:5] + "._-( )|*+?$^\\\"é"
+        self.values = sorted({"".join(rng.choice(alphabet) for _ in range(rng.randint(0, 6)))
+                              for _ in range(3000)})
+        self.probes = ["".join(rng.choice(alphabet) for _ in range(rng.randint(0, 7)))
+                       for _ in range(20000)]
+        self.probes += [v + "a" for v in self.values] + [v[:-1] for v in self.values]
+
+    def test_matches_exact_set(self):
+        regexes = compile_values(self.values, max_length=10 ** 9)
+        self.assertEqual(len(regexes), 1)
+        matches_exactly(self, regexes, self.values, self.probes)
+
+    def test_compact(self):
+        brands = [f'''brand{i}''' for i in range(1000)]
+        regex = trie_regex(brands)
+        self.assertLess(len(regex), len("|".join(brands)) / 5)
+        matches_exactly(self, [regex], brands, [f'''brand{i}''' for i in range(2000)] + ["brand", "bran"])
+
+    def test_split(self):
+        chunks = split_values(self.values, max_length=500)
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(len(regex) <= 500 for chunk, regex in chunks if len(chunk) > 1))
+        self.assertEqual(sorted(v for chunk, _ in chunks for v in chunk), self.values)
+        matches_exactly(self, [regex for _, regex in chunks], self.values, self.probes)
+
+    def test_short_lists_keep_order(self):
+        self.assertEqual(compile_values(["school", "college"]), ["^(school|college)$"])
+        self.assertEqual(compile_values(["a.b", "c"]), ["^(a\\.b|c)$"])
+        self.assertEqual(len(compile_values([str(i) for i in range(TRIE_THRESHOLD)])), 1)
+
+    def test_quote(self):
+        self.assertEqual(quote(escape('a"b.c')), '"a\\"b\\\\.c"')
+        self.assertEqual(unquote(quote('a\\"b')), 'a\\"b')
+
+
+class TestLargeTagFilters(unittest.TestCase):
+    def test_format_values(self):
+        self.assertEqual(format_values("Main St"), '="Main St"')
+        self.assertEqual(format_values(["a.b", "c"]), '~"^(a\\\\.b|c)$"')
+
+    def test_statement_union_split(self, n=3000):
+        vals = [f'''brand {i:05d} {chr(97 + i % 26)}''' for i in range(n)]
+        tf = TagFilter("brand", vals)
+        self.assertGreater(len(tf.alternatives()), 1)
+        # On its own the filter is a single clause covering every value
+        single = repr(tf)
+        self.assertEqual(single, f'''[brand{format_values(vals)}]''')
+        self.assertTrue(all(re.fullmatch(unquote(single[7:-1]), v) for v in vals))
+        s = repr(NodeQuery(filters=tf))
+        self.assertTrue(s.startswith("(node[brand~"))
+        self.assertEqual(s.count("node["), len(tf.alternatives()))
+
+    def test_long_value(self):
+        vals = [f'''v{i}''' for i in range(20)] + ["x" * 1200, "x" * 1199 + "y"]
+        regex = trie_regex(vals)
+        self.assertTrue(all(re.fullmatch(regex, v) for v in vals))
+        self.assertIsNone(re.fullmatch(regex, "x" * 1201))
+        self.assertTrue(repr(TagFilter("name", vals)).startswith("[name~"))
+        self.assertTrue(format_values(vals).startswith("~"))
+        # Each value a prefix of the next nests one group per value
+        self.assertEqual(len(compile_values(["a" * i for i in range(1, 2000)], max_length=10 ** 6)), 1)
+
+    def test_exclusion_split(self, n=3000):
+        vals = [f'''brand {i:05d} {chr(97 + i % 26)}''' for i in range(n)]
+        s = repr(TagFilter("brand", vals, exists=False))
+        self.assertTrue(s.startswith("[brand][brand!~"))
+        self.assertGreater(s.count("[brand!~"), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
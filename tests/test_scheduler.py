@@ -0,0 +1,180 @@
+import time
+import asyncio
+import threading
+import unittest
+
+from chauffeur.aio import arequest_all
+from chauffeur.query import QueryBuilder, NodeQuery
+from chauffeur.scheduler import SlotScheduler, ServerStatus, status_url_for
+from chauffeur.transport import Transport
+from chauffeur.filters import TagFilter
+from tests.stubs import StubOverpassServer
+
+
+STATUS_FREE = b"""Connected as: 123
+Current time: 2026-10-18T12:00:00Z
+Rate limit: 2
+2 slots available now.
+Currently running queries (pid, space limit, time limit, start time):
+"""
+
+STATUS_COOLDOWN = b"""Connected as: 123
+Current time: 2026-10-18T12:00:00Z
+Rate limit: 2
+Slot available after: 2026-10-18T12:00:03Z, in 3 seconds.
+Slot available after: 2026-10-18T12:00:09Z, in 9 seconds.
+Currently running queries (pid, space limit, time limit, start time):
+"""
+
+
+class FakeOverpass(StubOverpassServer):
+    def __init__(self, statuses, codes, query_delay=0.0, **kwargs):
+        super().__init__(**kwargs)
+        self.statuses = list(statuses)
+        self.codes = list(codes)
+        self.query_delay = query_delay
+        self.running = 0
+        self.max_running = 0
+
+    def respond(self, handler, body):
+        with self._lock:
+            if handler.path.endswith("/status"):
+                status = self.statuses.pop(0) if len(self.statuses) > 1 else self.statuses[0]
+                return 200, status, dict()
+            code = self.codes.pop(0) if len(self.codes) > 1 else self.codes[0]
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(self.query_delay)
+        with self._lock:
+            self.running -= 1
+        return code, self.payload, dict()
+
+
+class TestServerStatus(unittest.TestCase):
+    def test_parse(self):
+        status = ServerStatus.parse(STATUS_FREE.decode())
+        self.assertEqual(status.rate_limit, 2)
+        self.assertEqual(status.available, 2)
+        self.assertEqual(status.next_slot, 0)
+        status = ServerStatus.parse(STATUS_COOLDOWN.decode())
+        self.assertEqual(status.available, 0)
+        self.assertEqual(status.cooldowns, [3, 9])
+        self.assertEqual(status.next_slot, 3)
+        self.assertTrue(ServerStatus.parse("Rate limit: 0\n").unlimited)
+
+    def test_status_url(self):
+        self.assertEqual(status_url_for("http://overpass-api.de/api/interpreter"),
+                         "http://overpass-api.de/api/status")
+
+
+class TestSlotScheduler(unittest.TestCase):
+    def setUp(self):
+        self.sleeps = []
+        self.transport = Transport()
+        self.qb = QueryBuilder(payload_format="json")
+        self.qb.qsx.append(NodeQuery(filters=TagFilter("amenity", "school")))
+        self.qb.transport = self.transport
+
+    def tearDown(self):
+        self.transport.close()
+
+    def make_scheduler(self, server, **kwargs):
+        return SlotScheduler.for_endpoint(server.url, transport=self.transport,
+                                          sleep=self.sleeps.append, **kwargs)
+
+    def test_retry_with_backoff(self):
+        with FakeOverpass([STATUS_FREE], [429, 504, 200]) as server:
+            self.qb.overpass_endpoint = server.url
+            self.qb.scheduler = self.make_scheduler(server, backoff_base=1.0, backoff_max=3.0)
+            response = self.qb.request()
+        self.assertEqual(response.status_code, 200)
+        interpreter_calls = [r for r in server.requests if r[1].endswith("/interpreter")]
+        self.assertEqual(len(interpreter_calls), 3)
+        metrics = self.qb.scheduler.metrics()
+        self.assertEqual(metrics["retries"], 2)
+        self.assertEqual(metrics["requests"], 3)
+        self.assertEqual(metrics["queue_depth"], 0)
+        self.assertEqual(metrics["in_flight"], 0)
+        self.assertEqual(len(self.sleeps), 2)
+        self.assertLessEqual(self.sleeps[0], 1.0)
+        self.assertLessEqual(self.sleeps[1], 2.0)
+
+    def test_streamed_body_holds_slot(self):
+        with FakeOverpass([STATUS_FREE], [200]) as server:
+            self.qb.overpass_endpoint = server.url
+            self.qb.scheduler = self.make_scheduler(server)
+            response = self.qb.request(stream=True)
+            self.assertEqual(self.qb.scheduler.metrics()["in_flight"], 1)
+            self.assertEqual(b"".join(response.iter_content(16)), server.payload)
+            self.assertEqual(self.qb.scheduler.metrics()["in_flight"], 0)
+            response = self.qb.request(stream=True)
+            self.assertEqual(self.qb.scheduler.metrics()["in_flight"], 1)
+            response.close()
+            response.close()
+            self.assertEqual(self.qb.scheduler.metrics()["in_flight"], 0)
+            self.qb.request()
+            self.assertEqual(self.qb.scheduler.metrics()["in_flight"], 0)
+
+    def test_retries_exhausted(self):
+        with FakeOverpass([STATUS_FREE], [429]) as server:
+            self.qb.overpass_endpoint = server.url
+            self.qb.scheduler = self.make_scheduler(server, max_retries=1)
+            self.assertEqual(self.qb.request().status_code, 429)
+
+    def test_waits_for_cooldown(self):
+        with FakeOverpass([STATUS_COOLDOWN, STATUS_FREE], [200]) as server:
+            self.qb.overpass_endpoint = server.url
+            self.qb.scheduler = self.make_scheduler(server)
+            self.assertEqual(self.qb.request().status_code, 200)
+        self.assertEqual(self.sleeps, [3])
+
+    def test_slots_bound_concurrency(self):
+        with FakeOverpass([STATUS_FREE], [200], query_delay=0.05) as server:
+            self.qb.overpass_endpoint = server.url
+            scheduler = SlotScheduler.for_endpoint(server.url, transport=self.transport, poll_interval=0.01)
+            self.qb.scheduler = scheduler
+            depths = []
+            threads = [threading.Thread(target=self.qb.request) for _ in range(6)]
+            for t in threads:
+                t.start()
+            while any(t.is_alive() for t in threads):
+                depths.append(scheduler.queue_depth)
+                threads[0].join(0.01)
+        interpreter_calls = [r for r in server.requests if r[1].endswith("/interpreter")]
+        self.assertEqual(len(interpreter_calls), 6)
+        self.assertLessEqual(server.max_running, 2)
+        metrics = scheduler.metrics()
+        self.assertEqual(metrics["requests"], 6)
+        self.assertEqual(metrics["queue_depth"], 0)
+        self.assertEqual(metrics["wait_count"], 6)
+        self.assertGreater(metrics["wait_time_max"], 0.0)
+        self.assertGreater(max(depths), 0)
+
+
+    def test_async_retry(self):
+        with FakeOverpass([STATUS_FREE], [429, 200]) as server:
+            self.qb.overpass_endpoint = server.url
+            self.qb.scheduler = self.make_scheduler(server, backoff_base=0.01)
+            response = asyncio.run(self.qb.arequest())
+        self.assertEqual(response.status_code, 200)
+        metrics = self.qb.scheduler.metrics()
+        self.assertEqual((metrics["requests"], metrics["retries"], metrics["in_flight"]), (2, 1, 0))
+
+    def test_async_slots_bound_concurrency(self):
+        with FakeOverpass([STATUS_FREE], [200], query_delay=0.05) as server:
+            scheduler = SlotScheduler.for_endpoint(server.url, transport=self.transport, poll_interval=0.01)
+            builders = []
+            for i in range(6):
+                qb = QueryBuilder(payload_format="json")
+                qb.qsx.append(NodeQuery(filters=TagFilter("amenity", str(i))))
+                qb.overpass_endpoint = server.url
+                qb.scheduler = scheduler
+                builders.append(qb)
+            responses = asyncio.run(arequest_all(builders, concurrency=6))
+        self.assertTrue(all(r.status_code == 200 for r in responses))
+        self.assertLessEqual(server.max_running, 2)
+        metrics = scheduler.metrics()
+        self.assertEqual((metrics["requests"], metrics["wait_count"], metrics["in_flight"]), (6, 6, 0))
+
+if __name__ == "__main__":
+    unittest.main()
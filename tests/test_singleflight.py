@@ -0,0 +1,147 @@
+import time
+import asyncio
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from chauffeur.query import QueryBuilder, NodeQuery
+from chauffeur.filters import TagFilter
+from chauffeur.singleflight import SingleFlight, SharedResponse
+from chauffeur.aio import arequest_all
+from tests.stubs import StubOverpassServer
+
+try:
+    import numpy as np
+except ImportError: # pragma: no cover
+    np = None
+
+
+PAYLOAD = b'{"elements": [{"type": "node", "id": 1, "lat": 1.0, "lon": 2.0}]}'
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_builder(endpoint, flight, value="school"):
+    qb = QueryBuilder(payload_format="json")
+    qb.overpass_endpoint = endpoint
+    qb.singleflight = flight
+    qb.qsx.append(NodeQuery(filters=TagFilter("amenity", value)))
+    return qb
+
+
+class TestSingleFlight(unittest.TestCase):
+    def test_concurrent_callers_share_request(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def send():
+            calls.append(1)
+            release.wait(5)
+            return SharedResponse(200, b"payload")
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            futures = [pool.submit(flight.fetch, "key", send) for _ in range(8)]
+            while flight.metrics()["hits"] < 7:
+                time.sleep(0.001)
+            release.set()
+            results = [f.result() for f in futures]
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(r.content == b"payload" for r in results))
+        self.assertEqual((flight.hits, flight.misses), (7, 1))
+        self.assertEqual(flight.metrics()["in_flight"], 0)
+
+    def test_errors_reach_every_caller(self):
+        flight = SingleFlight(memo_ttl=10)
+        started = threading.Event()
+        release = threading.Event()
+
+        def send():
+            started.set()
+            release.wait(5)
+            raise ConnectionError("boom")
+
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            leader = pool.submit(flight.fetch, "key", send)
+            started.wait(5)
+            follower = pool.submit(flight.fetch, "key", send)
+            while flight.metrics()["hits"] < 1:
+                time.sleep(0.001)
+            release.set()
+            for future in (leader, follower):
+                with self.assertRaises(ConnectionError):
+                    future.result()
+        # Failures are never memoized
+        self.assertEqual(flight.metrics()["memo_size"], 0)
+
+    def test_memo(self):
+        clock = Clock()
+        flight = SingleFlight(memo_ttl=5, clock=clock)
+        calls = []
+
+        def send():
+            calls.append(1)
+            return SharedResponse(200, b"payload")
+
+        flight.fetch("key", send)
+        clock.now = 4
+        flight.fetch("key", send)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flight.metrics()["memo_hits"], 1)
+        clock.now = 5
+        flight.fetch("key", send)
+        self.assertEqual(len(calls), 2)
+        flight.fetch("other", lambda: SharedResponse(504, b""))
+        flight.fetch("remark", lambda: SharedResponse(200, b'{"remark": "runtime error"}'))
+        self.assertEqual(flight.metrics()["memo_size"], 1)
+
+    def test_query_builder(self):
+        flight = SingleFlight()
+        with StubOverpassServer(payload=PAYLOAD, delay=0.3) as server:
+            builders = [make_builder(server.url, flight) for _ in range(6)]
+            other = make_builder(server.url, flight, value="cafe")
+            with ThreadPoolExecutor(max_workers=7) as pool:
+                results = list(pool.map(lambda qb: list(qb.iter_elements()), builders + [other]))
+        self.assertEqual(len(server.requests), 2)
+        self.assertTrue(all(r == results[0] for r in results))
+        self.assertEqual(flight.misses, 2)
+
+    def test_followers_share_parsed_elements(self):
+        flight = SingleFlight()
+        with StubOverpassServer(payload=PAYLOAD, delay=0.3) as server:
+            builders = [make_builder(server.url, flight) for _ in range(4)]
+            with ThreadPoolExecutor(max_workers=4) as pool:
+                streams = list(pool.map(lambda qb: qb.iter_elements(), builders))
+        self.assertEqual(len(server.requests), 1)
+        # One parse, replayed to every caller
+        self.assertTrue(all(s is streams[0] for s in streams))
+        self.assertEqual([list(s) for s in streams], [[streams[0].elements[0]]] * 4)
+
+    @unittest.skipIf(np is None, "numpy is not installed")
+    def test_followers_share_table(self):
+        flight = SingleFlight(memo_ttl=60)
+        with StubOverpassServer(payload=PAYLOAD) as server:
+            first = make_builder(server.url, flight).request_table()
+            second = make_builder(server.url, flight).request_table()
+        self.assertEqual(len(server.requests), 1)
+        self.assertIs(first, second)
+        self.assertEqual(first["id"].tolist(), [1])
+
+    def test_async(self):
+        flight = SingleFlight()
+        with StubOverpassServer(payload=PAYLOAD, delay=0.2) as server:
+            builders = [make_builder(server.url, flight) for _ in range(5)]
+            responses = asyncio.run(arequest_all(builders, concurrency=5))
+        self.assertEqual(len(server.requests), 1)
+        self.assertTrue(all(r.json()["elements"][0]["id"] == 1 for r in responses))
+        self.assertEqual((flight.hits, flight.misses), (4, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
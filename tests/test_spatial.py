@@ -0,0 +1,109 @@
+import math
+import unittest
+
+try:
+    import numpy as np
+except ImportError: # pragma: no cover
+    np = None
+
+from chauffeur.columnar import ElementTable
+from chauffeur.filters import BboxFilter
+from chauffeur.geometry import assemble_ways
+from chauffeur.evaluate import evaluate
+from chauffeur.spatial import SpatialIndex, index_table, extents, EARTH_RADIUS
+
+from tests.test_evaluate import ELEMENTS
+
+
+def random_elements(n=2000, seed=0):
+    rng = np.random.default_rng(seed)
+    elements = [{"type": "node", "id": i + 1, "lat": float(a), "lon": float(o)}
+                for i, (a, o) in enumerate(zip(rng.uniform(50, 51, n), rng.uniform(7, 8, n)))]
+    for j in range(n // 10):
+        refs = rng.integers(1, n + 1, size=int(rng.integers(2, 5))).tolist()
+        elements.append({"type": "way", "id": j + 1, "nodes": refs})
+    elements.append({"type": "way", "id": n, "nodes": [n + 1]}) # Its node was never fetched
+    elements.append({"type": "relation", "id": 1, "members": [{"type": "way", "ref": 3, "role": ""}]})
+    return elements
+
+
+BOXES = [(50.1, 7.1, 50.15, 7.2), (50.5, 7.5, 50.9, 7.9), (49.0, 6.0, 52.0, 9.0), (0.0, 0.0, 1.0, 1.0),
+         (50.3, 7.3, 50.3, 7.3)]
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class TestSpatialIndex(unittest.TestCase):
+    def setUp(self):
+        self.table = ElementTable.from_elements(random_elements())
+
+    def brute_force(self, index, bbox):
+        s, w, n, e = bbox
+        minlat, minlon, maxlat, maxlon = extents(index.table)
+        return np.flatnonzero((minlat <= n) & (maxlat >= s) & (minlon <= e) & (maxlon >= w))
+
+    def test_query_bbox(self):
+        for zoom in (None, 0, 5, 20):
+            index = SpatialIndex(self.table, zoom=zoom)
+            for bbox in BOXES:
+                self.assertEqual(index.query_bbox(bbox).tolist(), self.brute_force(index, bbox).tolist())
+        # Way geometry comes from the node rows; the unfetched node leaves one way unindexed
+        self.assertEqual(len(index), len(self.table) - 2)
+
+    def test_query_radius(self):
+        index = SpatialIndex(self.table)
+        lat, lon, radius = 50.5, 7.5, 2000.0
+        rows = index.query_radius(lat, lon, radius)
+        nodes = rows[rows < 2000]
+        t = self.table
+        dlat = np.radians(t.lat[:2000] - lat)
+        dlon = np.radians(t.lon[:2000] - lon)
+        h = (np.sin(dlat / 2) ** 2
+             + math.cos(math.radians(lat)) * np.cos(np.radians(t.lat[:2000])) * np.sin(dlon / 2) ** 2)
+        expected = np.flatnonzero(2 * EARTH_RADIUS * np.arcsin(np.sqrt(h)) <= radius)
+        self.assertEqual(nodes.tolist(), expected.tolist())
+        self.assertTrue(len(rows) > len(nodes))
+
+    def test_query_radius_across_antimeridian(self):
+        table = ElementTable.from_elements([{"type": "node", "id": 1, "lat": 0.0, "lon": -179.99},
+                                            {"type": "node", "id": 2, "lat": 0.0, "lon": 179.98},
+                                            {"type": "node", "id": 3, "lat": 0.0, "lon": 0.0}])
+        index = SpatialIndex(table)
+        self.assertEqual(index.query_radius(0.0, 179.999, 5000.0).tolist(), [0, 1])
+        self.assertEqual(index.query_radius(0.0, -179.999, 5000.0).tolist(), [0, 1])
+        self.assertEqual(index.query_radius(0.0, 179.999, 1000.0).tolist(), [])
+
+    def test_bbox_filter_uses_index(self):
+        unindexed = [evaluate(BboxFilter(bbox), self.table) for bbox in BOXES]
+        index = index_table(self.table)
+        self.assertIs(self.table.spatial_index, index)
+        for bbox, expected in zip(BOXES, unindexed):
+            self.assertEqual(evaluate(BboxFilter(bbox), self.table).tolist(), expected.tolist())
+        # Derived tables start without one
+        self.assertIsNone(self.table[:10].spatial_index)
+
+    def test_matches_scan_for_every_geometry_source(self):
+        centers = [dict(e, center={"lat": 0.5, "lon": 0.5}) if e["type"] == "way" else e for e in ELEMENTS]
+        bounded = [dict(e, bounds={"minlat": 2.5, "minlon": -2.0, "maxlat": 3.5, "maxlon": 0.5})
+                   if e["type"] != "node" else e for e in ELEMENTS]
+        tables = [ElementTable.from_elements(ELEMENTS), assemble_ways(ElementTable.from_elements(ELEMENTS)),
+                  ElementTable.from_elements([{k: v for k, v in e.items() if k != "nodes"} for e in centers]),
+                  ElementTable.from_elements([{k: v for k, v in e.items() if k != "nodes"} for e in bounded])]
+        for table in tables:
+            for bbox in ((0.0, 0.0, 1.0, 1.0), (2.0, -2.0, 4.0, 0.0), (4.0, 4.0, 10.0, 10.0)):
+                table.spatial_index = None
+                expected = evaluate(BboxFilter(bbox), table)
+                index_table(table, zoom=6)
+                self.assertEqual(evaluate(BboxFilter(bbox), table).tolist(), expected.tolist())
+
+    def test_relations_with_members_are_always_candidates(self):
+        index = SpatialIndex(ElementTable.from_elements(ELEMENTS))
+        self.assertEqual(index.candidates((40.0, 40.0, 41.0, 41.0)).tolist(), [8])
+
+    def test_empty(self):
+        index = SpatialIndex(ElementTable.from_elements([]))
+        self.assertEqual(len(index), 0)
+        self.assertEqual(index.query_bbox((0, 0, 1, 1)).tolist(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
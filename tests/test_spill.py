@@ -0,0 +1,127 @@
+import os
+import json
+import tempfile
+import unittest
+from unittest import mock
+
+try:
+    import numpy as np
+except ImportError: # pragma: no cover
+    np = None
+
+from chauffeur.query import QueryBuilder
+from chauffeur.elements import ElementStream
+from chauffeur.columnar import ElementTable
+from chauffeur.geometry import assemble_ways, coordinates
+from chauffeur.evaluate import evaluate
+from chauffeur.filters import TagFilter
+from chauffeur.spill import SpillBuilder, ColumnFile, MappedStringPool, spill_stream, save_table, open_table
+
+from tests.test_elements import XML_PAYLOAD, chunked
+from tests.test_columnar import ELEMENTS
+
+
+BOUNDED = ELEMENTS + [
+    {"type": "way", "id": 11, "nodes": [1, 2], "bounds": {"minlat": 1.0, "minlon": 1.0, "maxlat": 2.0, "maxlon": 2.0},
+     "geometry": [{"lat": 1.0, "lon": 1.0}, {"lat": 2.0, "lon": 2.0}]},
+]
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class TestSpill(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "extract")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def spill(self, elements, buffer_bytes=16):
+        # A tiny buffer forces every column through several appends to its file
+        builder = SpillBuilder(self.path, buffer_bytes=buffer_bytes)
+        for elm in elements:
+            builder.add(elm)
+        return builder.build()
+
+    def test_column_file(self):
+        path = os.path.join(self.tmp.name, "col.bin")
+        col = ColumnFile(path, "q", buffer_bytes=16)
+        col.fill(0, 3)
+        col.extend(range(5))
+        col.append(9)
+        self.assertEqual(len(col), 9)
+        col.close()
+        self.assertEqual(np.fromfile(path, dtype=np.int64).tolist(), [0, 0, 0, 0, 1, 2, 3, 4, 9])
+
+    def test_matches_in_memory_table(self):
+        spilled = self.spill(BOUNDED)
+        self.assertIsInstance(spilled.ids, np.memmap)
+        self.assertEqual(list(spilled), list(ElementTable.from_elements(BOUNDED)))
+        # Lazily created columns are back-filled for the rows before them
+        self.assertTrue(np.isnan(spilled["minlat"][:5]).all())
+        self.assertEqual(spilled.nodes["lat"].tolist()[-2:], [1.0, 2.0])
+
+    def test_reopen_without_copying(self):
+        self.spill(BOUNDED)
+        table = open_table(self.path)
+        self.assertIsInstance(table.ids, np.memmap)
+        self.assertIsInstance(table.tags["key"], np.memmap)
+        self.assertEqual(table.timestamp.dtype, np.dtype("datetime64[s]"))
+        self.assertEqual(list(table), list(ElementTable.from_elements(BOUNDED)))
+        with self.assertRaises(ValueError):
+            table.ids[0] = 5
+
+    def test_strings_are_mapped(self):
+        elements = ELEMENTS + [{"type": "node", "id": 50, "lat": 0.0, "lon": 0.0,
+                                "tags": {"name": "Café Zürich", "amenity": "cafe", "": "empty"}}]
+        expected = ElementTable.from_elements(elements)
+        self.spill(elements)
+        self.assertFalse(os.path.exists(os.path.join(self.path, "strings.json")))
+        table = open_table(self.path)
+        self.assertIsInstance(table.values, MappedStringPool)
+        self.assertIsInstance(table.values.strings.blob, np.memmap)
+        self.assertEqual(list(table.values.strings), expected.values.strings)
+        with mock.patch("chauffeur.spill.ITER_BLOCK", 2):
+            self.assertEqual(list(table.values.strings), expected.values.strings)
+        for s in expected.values.strings + ["missing", "Caf", "Café Zürich!"]:
+            self.assertEqual(table.values.code(s), expected.values.code(s))
+        self.assertEqual(table.keys.code(""), expected.keys.code(""))
+        self.assertEqual(table.tag_values("name").tolist(), expected.tag_values("name").tolist())
+        for tf in (TagFilter("name", "Café Zürich"), TagFilter("amenity", ["cafe", "school"] * 10)):
+            self.assertEqual(evaluate(tf, table).tolist(), evaluate(tf, expected).tolist())
+        # Saving a reopened table over its own files leaves them in place
+        save_table(table, self.path)
+        self.assertEqual(list(open_table(self.path)), list(expected))
+
+    def test_downstream_steps(self):
+        table = self.spill(ELEMENTS)
+        cafes = table[evaluate(TagFilter("amenity", "cafe"), table)]
+        self.assertEqual(cafes.ids.tolist(), [1, 100])
+        assembled = assemble_ways(table)
+        self.assertEqual(coordinates(assembled, 3).tolist(), [[1.0, 1.0], [2.0, 2.0], [3.0, 3.0]])
+
+    def test_save_in_memory_table(self):
+        table = ElementTable.from_elements(ELEMENTS)
+        save_table(table[1:4], self.path)
+        reopened = open_table(self.path)
+        self.assertEqual(list(reopened), list(table[1:4]))
+        with open(os.path.join(self.path, "table.json")) as f:
+            self.assertEqual(json.load(f)["columns"]["id"]["length"], 3)
+
+    def test_refuses_to_overwrite_mapped_slice(self):
+        table = self.spill(ELEMENTS)
+        with self.assertRaises(ValueError):
+            save_table(table[1:3], self.path)
+
+    def test_stream_and_builder(self):
+        table = spill_stream(ElementStream(chunked(XML_PAYLOAD, 7), payload_format="xml"), self.path)
+        self.assertEqual(table.ids.tolist(), [1, 10, 100])
+        qb = QueryBuilder(payload_format="xml")
+        with mock.patch.object(QueryBuilder, "iter_elements",
+                               lambda qb, chunk_size=None: ElementStream([XML_PAYLOAD], payload_format="xml")):
+            table = qb.request_spill(os.path.join(self.tmp.name, "other"))
+        self.assertEqual(len(table), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,154 @@
+import os
+import json
+import tempfile
+import unittest
+from unittest import mock
+
+import requests
+
+from chauffeur.query import QueryBuilder, NodeQuery
+from chauffeur.filters import TagFilter
+from chauffeur.tiling import grid_tiles, quadtiles, quadtile_index, split_bbox, is_resource_failure
+from chauffeur.tiling import TileHistory, TileTooSmall
+
+
+class FakeResponse:
+    def __init__(self, payload):
+        self.content = json.dumps(payload).encode()
+
+    def json(self):
+        return json.loads(self.content)
+
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+    def raise_for_status(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class TestTiles(unittest.TestCase):
+    def test_grid_tiles(self):
+        tiles = grid_tiles([0.0, 0.0, 2.0, 4.0], 2, 2)
+        self.assertEqual(tiles, [(0.0, 0.0, 1.0, 2.0), (0.0, 2.0, 1.0, 4.0),
+                                 (1.0, 0.0, 2.0, 2.0), (1.0, 2.0, 2.0, 4.0)])
+        with self.assertRaises(ValueError):
+            grid_tiles([0.0, 0.0, 1.0, 1.0], 0, 1)
+
+    def test_quadtiles(self):
+        bbox = [-10.0, -10.0, 10.0, 10.0]
+        tiles = quadtiles(bbox, 1)
+        self.assertEqual(len(tiles), 4)
+        self.assertEqual(tiles[0], (-10.0, -10.0, 0.0, 0.0))
+        self.assertEqual(tiles[-1], (0.0, 0.0, 10.0, 10.0))
+        idx = [quadtile_index(t[0], t[1], 1) for t in tiles]
+        self.assertEqual(idx, sorted(idx))
+        self.assertEqual(quadtiles(bbox, 0), [(-10.0, -10.0, 10.0, 10.0)])
+
+
+class TestTiledRequest(unittest.TestCase):
+    def setUp(self):
+        self.qb = QueryBuilder(payload_format="json", bbox=[0.0, 0.0, 2.0, 2.0])
+        self.qb.qsx.append(NodeQuery(filters=TagFilter("amenity", "school")))
+
+    def test_tile(self):
+        tiled = self.qb.tile((0.0, 0.0, 1.0, 1.0))
+        self.assertEqual(tiled.GlobalBoundingBox, (0.0, 0.0, 1.0, 1.0))
+        self.assertEqual(self.qb.GlobalBoundingBox, [0.0, 0.0, 2.0, 2.0])
+        self.assertIs(tiled.qsx.qb, tiled)
+        self.assertIn("[bbox:0.00000000,0.00000000,1.00000000,1.00000000]", tiled.raw_query_string)
+
+    def test_request_tiled_dedupes(self):
+        def fake_request(qb, stream=False):
+            s, w, n, e = qb.GlobalBoundingBox
+            elements = [{"type": "node", "id": int(s * 10 + w), "lat": s, "lon": w},
+                        {"type": "node", "id": 999, "lat": 1.0, "lon": 1.0}]
+            return FakeResponse({"elements": elements})
+
+        with mock.patch.object(QueryBuilder, "request", fake_request):
+            elements = self.qb.request_tiled(rows=2, cols=2, max_workers=2)
+        ids = [e["id"] for e in elements]
+        self.assertEqual(len(ids), 5)
+        self.assertEqual(ids.count(999), 1)
+
+    def test_tiles_requires_bbox(self):
+        with self.assertRaises(ValueError):
+            QueryBuilder().tiles(zoom=2)
+
+
+class GatewayTimeout(FakeResponse):
+    def __init__(self):
+        super().__init__({})
+        self.status_code = 504
+
+    def raise_for_status(self):
+        raise requests.HTTPError("504 Gateway Timeout", response=self)
+
+
+class TestAdaptiveRequest(unittest.TestCase):
+    def setUp(self):
+        self.qb = QueryBuilder(payload_format="json", bbox=[0.0, 0.0, 4.0, 4.0])
+        self.qb.qsx.append(NodeQuery(filters=TagFilter("amenity", "school")))
+        self.seen = list()
+
+    def fake_request(self, max_span):
+        def request(qb, stream=False):
+            s, w, n, e = qb.GlobalBoundingBox
+            self.seen.append((s, w, n, e))
+            if (s, w) == (0.0, 0.0) and n - s > 1.0:
+                return GatewayTimeout()
+            if n - s > max_span:
+                return FakeResponse({"elements": [], "remark": "runtime error: Query run out of memory using about 2048 MB of RAM."})
+            elements = [{"type": "node", "id": int(s * 100 + w), "lat": s, "lon": w},
+                        {"type": "node", "id": 999, "lat": 1.0, "lon": 1.0}]
+            return FakeResponse({"elements": elements})
+        return request
+
+    def test_helpers(self):
+        self.assertEqual(split_bbox((0.0, 0.0, 2.0, 4.0)),
+                         [(0.0, 0.0, 1.0, 2.0), (0.0, 2.0, 1.0, 4.0), (1.0, 0.0, 2.0, 2.0), (1.0, 2.0, 2.0, 4.0)])
+        self.assertTrue(is_resource_failure("runtime error: Query timed out in \"query\" at line 1"))
+        self.assertTrue(is_resource_failure("runtime error: Query run out of memory using about 2048 MB"))
+        self.assertFalse(is_resource_failure(None))
+
+    def test_bisects_failures(self):
+        with mock.patch.object(QueryBuilder, "request", self.fake_request(max_span=2.0)):
+            elements = self.qb.request_adaptive(max_workers=2)
+        # One 2-degree quadrant hit a 504 and was split again
+        self.assertEqual(len(elements), 3 + 4 + 1)
+        self.assertEqual([e["id"] for e in elements].count(999), 1)
+        self.assertEqual(self.seen[0], (0.0, 0.0, 4.0, 4.0))
+
+    def test_history_reuses_tiles(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "tiles.json")
+            with mock.patch.object(QueryBuilder, "request", self.fake_request(max_span=2.0)):
+                first = self.qb.request_adaptive(history=TileHistory(path))
+                attempts = len(self.seen)
+                self.seen.clear()
+                second = self.qb.request_adaptive(history=TileHistory(path))
+        self.assertEqual(len(self.seen), 7)
+        self.assertLess(len(self.seen), attempts)
+        self.assertEqual(sorted(e["id"] for e in first), sorted(e["id"] for e in second))
+
+    def test_minimum_size(self):
+        with mock.patch.object(QueryBuilder, "request", self.fake_request(max_span=0.1)):
+            with self.assertRaises(TileTooSmall):
+                self.qb.request_adaptive(min_size=1.0)
+
+    def test_other_errors_propagate(self):
+        def request(qb, stream=False):
+            response = GatewayTimeout()
+            response.status_code = 400
+            return response
+
+        with mock.patch.object(QueryBuilder, "request", request):
+            with self.assertRaises(requests.HTTPError):
+                self.qb.request_adaptive()
+
+
+if __name__ == "__main__":
+    unittest.main()
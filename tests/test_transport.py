@@ -0,0 +1,60 @@
+import gzip
+import json
+import unittest
+import urllib.parse
+
+from chauffeur.query import QueryBuilder, NodeQuery
+from chauffeur.transport import Transport, default_transport
+from chauffeur.filters import TagFilter
+from tests.stubs import StubOverpassServer
+
+
+ELEMENTS = [{"type": "node", "id": i, "lat": 1.0, "lon": 2.0} for i in range(200)]
+PAYLOAD = json.dumps({"elements": ELEMENTS}).encode()
+
+
+class GzipServer(StubOverpassServer):
+    def respond(self, handler, body):
+        if "gzip" in handler.headers.get("Accept-Encoding", ""):
+            return 200, gzip.compress(self.payload), {"Content-Encoding": "gzip"}
+        return 200, self.payload, dict()
+
+
+class TestTransport(unittest.TestCase):
+    def setUp(self):
+        self.qb = QueryBuilder(payload_format="json")
+        self.qb.qsx.append(NodeQuery(filters=TagFilter("amenity", "school")))
+
+    def test_default_transport_shared(self):
+        self.assertIs(default_transport(), default_transport())
+        self.assertIsNone(QueryBuilder.transport)
+
+    def test_post_form_body(self):
+        with StubOverpassServer(payload=PAYLOAD) as server, Transport() as transport:
+            self.qb.overpass_endpoint = server.url
+            self.qb.transport = transport
+            self.assertEqual(self.qb.request().status_code, 200)
+        method, _, headers, body = server.requests[0]
+        self.assertEqual(method, "POST")
+        self.assertEqual(urllib.parse.parse_qs(body.decode())["data"], [self.qb.raw_query_string])
+        self.assertIn("gzip", headers["Accept-Encoding"])
+
+    def test_keep_alive(self):
+        with StubOverpassServer(payload=PAYLOAD) as server, Transport(pool_maxsize=1) as transport:
+            self.qb.overpass_endpoint = server.url
+            self.qb.transport = transport
+            for _ in range(5):
+                self.qb.request()
+        self.assertEqual(len(server.requests), 5)
+        self.assertEqual(len(server.peers), 1)
+
+    def test_streaming_decompression(self):
+        with GzipServer(payload=PAYLOAD) as server, Transport() as transport:
+            self.qb.overpass_endpoint = server.url
+            self.qb.transport = transport
+            elements = list(self.qb.iter_elements(chunk_size=256))
+        self.assertEqual(elements, ELEMENTS)
+
+
+if __name__ == "__main__":
+    unittest.main()